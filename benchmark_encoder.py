@@ -0,0 +1,72 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from ingestclient.utils.encoder import TileEncoder, benchmark
+from PIL import Image
+import numpy as np
+import argparse
+
+
+# Encoder settings compared by default
+ENCODERS = {
+    "png (default)": TileEncoder("png"),
+    "png level 1": TileEncoder("png", compress_level=1),
+    "png level 1 rle": TileEncoder("png", compress_level=1, png_strategy="rle"),
+    "png level 9": TileEncoder("png", compress_level=9),
+    "tiff (uncompressed)": TileEncoder("tiff"),
+    "tiff deflate": TileEncoder("tiff", tiff_compression="tiff_deflate"),
+    "npz": TileEncoder("npz"),
+    "npz (uncompressed)": TileEncoder("npz", compress_level=0),
+    "raw": TileEncoder("raw"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tile encoding throughput and compression",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog="Visit https://docs.theBoss.io for more details")
+
+    parser.add_argument("images",
+                        nargs="*",
+                        help="Images to cut tiles from. Random 16-bit tiles are used if omitted")
+
+    parser.add_argument("--tile_size", "-t",
+                        type=int,
+                        default=512,
+                        help="Tile size in x and y")
+
+    parser.add_argument("--repeat", "-r",
+                        type=int,
+                        default=3,
+                        help="Number of times each tile is encoded")
+
+    args = parser.parse_args()
+
+    tiles = []
+    for image in args.images:
+        data = np.array(Image.open(image))
+        for y in range(0, data.shape[0] - args.tile_size + 1, args.tile_size):
+            for x in range(0, data.shape[1] - args.tile_size + 1, args.tile_size):
+                tiles.append(data[y:y + args.tile_size, x:x + args.tile_size])
+    if not tiles:
+        tiles = [np.random.randint(0, 4096, (args.tile_size, args.tile_size)).astype(np.uint16) for _ in range(8)]
+
+    results = benchmark(ENCODERS, tiles, args.repeat)
+
+    print("{:<24}{:>12}{:>10}".format("encoder", "MB/s", "ratio"))
+    for name in sorted(results, key=lambda n: -results[n]["mb_per_sec"]):
+        print("{:<24}{:>12.1f}{:>10.2f}".format(name, results[name]["mb_per_sec"], results[name]["ratio"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -16,6 +16,8 @@
 from ingestclient.core.engine import Engine
 from ingestclient.core.config import ConfigFileError
 from ingestclient.core.backend import BossBackend
+from ingestclient.core.exporter import MetricsExporter
+from ingestclient.core.supervisor import WorkerSupervisor
 from ingestclient import check_version
 from ingestclient.utils.log import always_log_info
 from ingestclient.utils.console import print_estimated_job
@@ -58,17 +60,27 @@ def get_confirmation(prompt, force=False):
         return True
 
 
-def worker_process_run(api_token, job_id, pipe, config_file=None, configuration=None):
-    """A worker process main execution function. Generates an engine, and joins the job
-       (that was either created by the main process or joined by it).
+def worker_process_run(api_token, job_id, pipe, config_file=None, configuration=None, use_asyncio=False,
+                       ledger_path=None, job_info=None, failure_journal=None, slice_cache_mb=None):
+    """A worker process main execution function. Generates an engine, and connects it to the job
+       (that was either created by the main process or joined by it) with the credentials the main process received.
        Ends when no more tasks are left that can be executed.
 
     Args:
         api_token(str): the token to initialize the engine with.
         job_id(int): the id of the job the engine needs to join with.
-        pipe(multiprocessing.Pipe): the receiving end of the pipe that communicates with the master process.
+        pipe(multiprocessing.Connection): the worker's end of the duplex pipe to the master process. The master sends
+                                          ("credentials", tuple) when it renews credentials,
+                                          ("job_done", True) once no upload tasks are left and
+                                          ("should_run", bool) after an interrupt. The worker sends
+                                          ("progress", dict) and ("stats", dict) reports.
         config_file(str): the path to the configuration file (configuration required if omitted)
         configuration(Configuration): a pre-loaded configuration object (config_file required if omitted)
+        use_asyncio(bool): flag indicating if the asyncio engine should be used instead of the default engine
+        ledger_path(str): path to the upload ledger, None to upload without one
+        job_info(tuple): the main process engine's get_job_info(). If omitted the worker joins the job itself
+        failure_journal(str): path to the journal of tiles that failed to upload, None to not record them
+        slice_cache_mb(float): this worker's memory budget for decoded slices, None to use the configuration's
 
     """
     always_log_info("Creating new worker process, pid={}.".format(os.getpid()))
@@ -77,17 +89,34 @@ def worker_process_run(api_token, job_id, pipe, config_file=None, configuration=
     if config_file is None and configuration is None:
         raise Exception('Must provide either a configuration instance or a configuration file')
 
+    if use_asyncio:
+        from ingestclient.core.async_engine import AsyncEngine
+        engine_class = AsyncEngine
+    else:
+        engine_class = Engine
+
     try:
-        engine = Engine(config_file=config_file, 
-                        configuration=configuration,
-                        backend_api_token=api_token, 
-                        ingest_job_id=job_id)
+        engine = engine_class(config_file=config_file,
+                              configuration=configuration,
+                              backend_api_token=api_token,
+                              ingest_job_id=job_id)
     except ConfigFileError as err:
         print("ERROR (pid: {}): {}".format(os.getpid(), err))
         sys.exit(1)
-
-    # Join job
-    engine.join()
+    engine.ledger_path = ledger_path
+    engine.failure_journal = failure_journal
+    if slice_cache_mb is not None:
+        engine.tile_processor.slice_cache_mb = slice_cache_mb
+    engine.stats_reporter = lambda tag, payload: pipe.send((tag, payload))
+
+    if job_info:
+        # Use the main process's credentials, and the renewed ones it pushes, instead of joining. The main process
+        # also watches the job status and signals when the job is done
+        engine.set_job_info(job_info)
+        engine.attach_master(pipe)
+    else:
+        # Join job
+        engine.join()
 
     # Start it up!
     should_run = True
@@ -98,7 +127,15 @@ def worker_process_run(api_token, job_id, pipe, config_file=None, configuration=
             should_run = False
         except KeyboardInterrupt:
             # Make sure they want to stop this client, wait for the main process to send the next step
-            should_run = pipe.recv()
+            while True:
+                tag, payload = pipe.recv()
+                if tag == "credentials":
+                    engine.set_job_info(payload)
+                elif tag == "job_done":
+                    engine.job_done.set()
+                elif tag == "should_run":
+                    should_run = payload
+                    break
     always_log_info("  - Process pid={} finished gracefully.".format(os.getpid()))
     
 
@@ -137,7 +174,38 @@ def get_parser():
                         help="Flag indicating if you want to manually mark an Ingest Job for completion. If omitted, the client will automatically cleanup after a successful upload")
     parser.add_argument("--processes_nb", "-p", type=int,
                         default=1,
-                        help="The number of client processes that will upload the images of the ingest job.")
+                        help="The number of client processes that will upload the images of the ingest job. "
+                             "Each process caches decoded slices, using up to --slice-cache-mb divided by the "
+                             "number of processes.")
+    parser.add_argument("--asyncio", "-A",
+                        action="store_true",
+                        default=False,
+                        help="Flag indicating if worker processes should use the asyncio engine, which processes and uploads many tiles concurrently from a single process. Requires Python 3.")
+    parser.add_argument("--ledger",
+                        default=None,
+                        help="Path to the local ledger of uploaded tiles, used to skip tiles already uploaded when resuming a job. Defaults to the engine's \"ledger\" setting, or ~/.boss-ingest/upload_ledger.sqlite")
+    parser.add_argument("--no-ledger",
+                        action="store_true",
+                        default=False,
+                        help="Flag indicating if uploads should not be recorded in the local ledger.")
+    parser.add_argument("--failure-journal",
+                        default=None,
+                        help="Path to the journal of tiles that failed to upload after all retries, one JSON object per line. Defaults to the engine's \"failure_journal\" setting, or ~/.boss-ingest/failed_tiles.jsonl")
+    parser.add_argument("--slice-cache-mb", type=float,
+                        default=None,
+                        help="Total memory in MB for caching decoded image slices, split evenly across the worker processes. Without it, each worker process uses the tile processor's \"slice_cache_mb\" parameter, or 64 MB, so the cache costs that much memory per process. 0 disables caching")
+    parser.add_argument("--metrics-file",
+                        default=None,
+                        help="Path of a file to write job and worker metrics to in the Prometheus text format, e.g. for the node exporter's textfile collector")
+    parser.add_argument("--metrics-port", type=int,
+                        default=None,
+                        help="Port to serve job and worker metrics on in the Prometheus text format, at http://localhost:<port>/metrics")
+    parser.add_argument("--stall-timeout", type=float,
+                        default=None,
+                        help="Seconds a worker process may go without progress before it is killed and replaced. Defaults to the engine's \"stall_timeout\" setting, or 300")
+    parser.add_argument("--max-restarts", type=int,
+                        default=10,
+                        help="The number of stalled or crashed worker processes that may be replaced. (Default = 10)")
     parser.add_argument("config_file", nargs='?', help="Path to the ingest job configuration file")
 
     return parser
@@ -196,6 +264,11 @@ def main(configuration=None, parser_args=None):
             print("Error: Ingest Job Configuration File is required")
             sys.exit(1)
 
+    if args.asyncio and sys.version_info < (3, 5):
+        parser.print_usage()
+        print("Error: The asyncio engine requires Python 3.5 or newer")
+        sys.exit(1)
+
     # Setup logging
     log_level = logging.getLevelName(args.log_level.upper())
     if not args.log_file:
@@ -245,6 +318,13 @@ def main(configuration=None, parser_args=None):
 
     else:
         # Trying to create or join an ingest
+        if args.asyncio and (engine.schedule_by_source or engine.adaptive_concurrency):
+            # The asyncio engine has its own task scheduling and concurrency, so these settings would be ignored
+            parser.print_usage()
+            print("Error: The schedule_by_source and adaptive_concurrency engine settings aren't supported by the "
+                  "asyncio engine. Remove them from the configuration or run without --asyncio")
+            sys.exit(1)
+
         if args.job_id is None:
             # Creating a new session - make sure the user wants to do this.
             print_estimated_job(config_file=args.config_file, configuration=configuration)
@@ -285,27 +365,56 @@ def main(configuration=None, parser_args=None):
         # Join job
         engine.join()
 
+    # Every worker records its uploads in the same ledger
+    if args.no_ledger:
+        ledger_path = None
+    else:
+        ledger_path = args.ledger or engine.ledger_path or os.path.join(os.path.expanduser("~/.boss-ingest"),
+                                                                        "upload_ledger.sqlite")
+    failure_journal = args.failure_journal or engine.failure_journal or os.path.join(
+        os.path.expanduser("~/.boss-ingest"), "failed_tiles.jsonl")
+
+    # The workers share one memory budget for decoded slices
+    slice_cache_mb = None
+    if args.slice_cache_mb is not None:
+        slice_cache_mb = args.slice_cache_mb / float(max(1, args.processes_nb))
+
     # Create worker processes
-    workers = []
-    for i in range(args.processes_nb):
-        new_pipe = mp.Pipe(False)
+    def start_worker():
+        new_pipe = mp.Pipe()
         new_process = mp.Process(target=worker_process_run, 
                                  args=(args.api_token, engine.ingest_job_id, new_pipe[0]),
-                                 kwargs={'config_file': args.config_file, 'configuration': configuration}
+                                 kwargs={'config_file': args.config_file, 'configuration': configuration,
+                                         'use_asyncio': args.asyncio, 'ledger_path': ledger_path,
+                                         'job_info': engine.get_job_info(), 'failure_journal': failure_journal,
+                                         'slice_cache_mb': slice_cache_mb}
                                  )
-        workers.append((new_process, new_pipe[1]))
         new_process.start()
+        return new_process, new_pipe[1]
+
+    workers = []
+    for i in range(args.processes_nb):
+        workers.append(start_worker())
 
         # Sleep to slowly ramp up load on lambda
         time.sleep(.5)
 
+    if args.stall_timeout:
+        engine.stall_timeout = args.stall_timeout
+    supervisor = WorkerSupervisor(start_worker, workers, engine.stall_timeout, args.max_restarts)
+
+    exporter = None
+    if args.metrics_file or args.metrics_port is not None:
+        exporter = MetricsExporter(args.metrics_file, args.metrics_port)
+        exporter.start()
+
     # Start the main process engine
     start_time = time.time()
     should_run = True
     job_complete = False
     while should_run:
         try:
-            engine.monitor(workers)
+            engine.monitor(workers, exporter, supervisor)
             # run will end if no more jobs are available, join other processes
             should_run = False
             job_complete = True
@@ -325,13 +434,19 @@ def main(configuration=None, parser_args=None):
 
             # notify the worker processes that they should stop execution
             for _, worker_pipe in workers:
-                worker_pipe.send(should_run)
+                worker_pipe.send(("should_run", should_run))
 
     always_log_info("Waiting for worker processes to close...\n")
     time.sleep(1)  # Make sure workers have cleaned up
     for worker_process, worker_pipe in workers:
-        worker_process.join()
+        # Keep reading stats so a worker sending its final report doesn't block on a full pipe
+        while worker_process.is_alive():
+            engine.receive_worker_messages(workers, 0, exporter)
+            worker_process.join(1)
         worker_pipe.close()
+    if exporter:
+        exporter.write()
+        exporter.stop()
 
     if job_complete:
         # If auto-complete, mark the job as complete and cleanup
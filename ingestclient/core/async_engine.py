@@ -0,0 +1,199 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""An asyncio based upload engine. Requires Python 3."""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .engine import Engine
+from .upload import UploadResult
+
+
+class AsyncEngine(Engine):
+    def __init__(self, config_file=None, backend_api_token=None, ingest_job_id=None, configuration=None):
+        """
+        An upload engine that receives tasks, processes tiles, uploads and refreshes credentials concurrently
+        from a single process
+
+        Path and tile processors are called from one dedicated thread so plugins see the same serial calls they do
+        under Engine. Blocking boto3 and REST calls run on a separate pool of I/O threads.
+
+        Args:
+            config_file (str): Absolute path to a config file
+            ingest_job_id (int): ID of the ingest job you want to work on
+            backend_api_token (str): The authorization token for the Backend if used
+            configuration(ingestclient.core.config.Configuration): A pre-loaded configuration instance
+        """
+        self.async_concurrency = 32  # Number of tiles being processed or uploaded at once
+        self.process_threads = 1  # Threads calling the path and tile processors. Plugins must be thread-safe if > 1
+        Engine.__init__(self, config_file=config_file, backend_api_token=backend_api_token,
+                        ingest_job_id=ingest_job_id, configuration=configuration)
+
+    def configure(self, configuration):
+        """
+        Method to apply a configuration and setup the workflow engine
+        Args:
+            configuration (Configuration)
+
+        Returns:
+            None
+        """
+        Engine.configure(self, configuration)
+
+        engine_params = self.config.get_engine_params()
+        self.async_concurrency = engine_params.get("async_concurrency", self.async_concurrency)
+        self.process_threads = engine_params.get("process_threads", self.process_threads)
+
+        # Tasks are processed as they arrive and uploads are bounded by async_concurrency instead
+        unsupported = [name for name in ("schedule_by_source", "adaptive_concurrency") if getattr(self, name)]
+        if unsupported:
+            logger = logging.getLogger('ingest-client')
+            logger.warning("(pid={}) The asyncio engine doesn't support {}, ignoring".format(
+                os.getpid(), " or ".join(unsupported)))
+            for name in unsupported:
+                setattr(self, name, False)
+
+    def run(self):
+        """Method to run the upload loop
+
+        Returns:
+
+        """
+        self.check_ready()
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._run())
+        finally:
+            loop.close()
+
+    async def _run(self):
+        """Upload loop coroutine
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_event_loop()
+        process_pool = ThreadPoolExecutor(self.process_threads)
+        io_pool = ThreadPoolExecutor(self.async_concurrency + 2)
+        tasks = asyncio.Queue(maxsize=self.async_concurrency)
+
+        workers = [loop.create_task(self._worker(tasks, process_pool, io_pool))
+                   for _ in range(self.async_concurrency)]
+        self.open_journal()
+        self.open_ledger()
+        self.start_heartbeat()
+        self.start_credential_refresher()
+        try:
+            await self._receive(tasks, io_pool)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await loop.run_in_executor(io_pool, self.stop_credential_refresher)
+            await loop.run_in_executor(io_pool, self.stop_heartbeat)
+            await loop.run_in_executor(io_pool, self.release_in_progress)
+            await loop.run_in_executor(io_pool, self.backend.release_buffered_tasks)
+            await loop.run_in_executor(io_pool, self.close_ledger)
+            self.set_stage("done")
+            self.log_stats(force=True)
+            self.report_stats(force=True)
+            process_pool.shutdown()
+            io_pool.shutdown()
+
+    async def _receive(self, tasks, io_pool):
+        """Coroutine to feed upload tasks to the workers until the queue stays empty
+
+        Args:
+            tasks(asyncio.Queue): The queue of tasks for the workers
+            io_pool(concurrent.futures.Executor): The executor for blocking I/O
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_event_loop()
+        wait_cnt = 0
+        while True:
+            self.receive_master_messages()
+            self.set_stage("receive")
+            start_time = time.time()
+            task = await loop.run_in_executor(io_pool, self.backend.get_task, self.task_prefetch)
+            self.metrics.observe("receive", time.time() - start_time)
+            self.log_stats()
+            self.report_stats()
+            if task[2]:
+                wait_cnt = 0
+                self.drained_checks = 0
+                if not await loop.run_in_executor(io_pool, self.skip_completed_tasks, [task]):
+                    continue
+                self.begin_tasks([task])
+                await tasks.put(task)
+            else:
+                wait_cnt += 1
+                self.set_stage("wait")
+                if wait_cnt >= self.msg_wait_iterations:
+                    break
+                if not self.in_progress and await loop.run_in_executor(io_pool, self.check_job_done):
+                    break
+
+                # A long poll already waited for tasks, so only wait out the rest of the interval
+                await asyncio.sleep(max(0, self.idle_poll_interval - (time.time() - start_time)))
+
+        # Signal the workers to finish up
+        for _ in range(self.async_concurrency):
+            await tasks.put(None)
+
+    async def _worker(self, tasks, process_pool, io_pool):
+        """Coroutine to process and upload tiles
+
+        Args:
+            tasks(asyncio.Queue): The queue of tasks to process
+            process_pool(concurrent.futures.Executor): The executor for the path and tile processors
+            io_pool(concurrent.futures.Executor): The executor for blocking I/O
+
+        Returns:
+            None
+        """
+        loop = asyncio.get_event_loop()
+        logger = logging.getLogger('ingest-client')
+        retry_policy = self.get_retry_policy()
+        while True:
+            task = await tasks.get()
+            if task is None:
+                return
+
+            message_id, receipt_handle, msg = task
+            start_time = time.time()
+            try:
+                key_parts, handle, num_bytes, upload_metadata = await loop.run_in_executor(
+                    process_pool, self.process_task, message_id, receipt_handle, msg)
+
+                start_time = time.time()
+                response, error, attempts = await loop.run_in_executor(io_pool, retry_policy.call,
+                                                                       self.backend.put_tile, msg['tile_key'],
+                                                                       handle, upload_metadata)
+                result = UploadResult((msg['tile_key'], key_parts, receipt_handle), response, error,
+                                      time.time() - start_time, num_bytes, attempts)
+            except Exception as e:
+                # Record the task as failed so it is released after a backoff and this worker keeps running
+                result = self.get_failed_task_result(task, e, time.time() - start_time)
+
+            try:
+                await loop.run_in_executor(io_pool, self._handle_upload_results, [result])
+            except Exception:
+                # The task stays in progress and is released when the upload loop stops
+                logger.exception("(pid={}) Failed to finish task {}".format(os.getpid(), msg['tile_key']))
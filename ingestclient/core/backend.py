@@ -15,17 +15,23 @@
 import six
 from abc import ABCMeta, abstractmethod
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 import json
-import boto3
 import hashlib
 from six.moves import configparser
 import time
 import botocore
 from pkg_resources import resource_filename
 import os
+import math
+import uuid
+from collections import deque
 
 from ..utils import WaitPrinter
 from ..utils.log import always_log_info
+from ..utils.encoder import TileBuffer
+from ..utils.aws import ClientFactory, DEFAULT_REGION
 
 
 @six.add_metaclass(ABCMeta)
@@ -43,6 +49,22 @@ class Backend(object):
         self.queue = None
         self.s3 = None
         self.bucket = None
+        self.s3_clients = None  # Creates the per-thread S3 clients tiles are uploaded with
+        self.sqs_clients = None  # Creates the per-thread SQS clients that change and delete tasks
+
+        # Optional boto3 tuning: region, endpoint_url, max_pool_connections, retry_mode, max_attempts,
+        # connect_timeout and read_timeout
+        self.aws_params = config.get("client", {}).get("backend", {}).get("aws", {}) if config else {}
+
+        # Prefetched upload tasks as (message_id, receipt_handle, body, visibility_deadline) tuples
+        self.task_buffer = deque()
+        self.visibility_timeout = 30  # The SQS default, replaced with the queue's value once connected
+        self.visibility_margin = 30  # Seconds of visibility a buffered task must have left to be handed out as-is
+        self.task_interval = None  # Average seconds between tasks handed out from the buffer, to size prefetches
+        self.last_handout = None
+        self.connect_attempts = 6  # Tries to read the upload queue with new credentials before giving up on them
+        self.receive_attempts = 6  # Tries to receive tasks through transient errors before giving up
+        self.receive_wait_time = 20  # Seconds a receive waits for tasks on an empty queue (SQS long polling)
 
     @abstractmethod
     def setup(self):
@@ -58,6 +80,17 @@ class Backend(object):
         """
         return NotImplemented
 
+    def get_identity(self):
+        """
+        Method to get a name for the ingest service this backend talks to
+
+        Job IDs are only unique within an ingest service, so the identity qualifies them, e.g. in the upload ledger.
+
+        Returns:
+            (str)
+        """
+        return ""
+
     @abstractmethod
     def create(self, data):
         """
@@ -136,52 +169,260 @@ class Backend(object):
         return NotImplemented
 
     @abstractmethod
-    def get_task(self):
+    def get_task(self, num_messages=10, wait=True):
         """
         Method to get an upload task
 
         Args:
+            num_messages(int): Number of messages to prefetch from the upload task queue when the buffer is empty
+            wait(bool): Wait up to receive_wait_time seconds for a task if none is available
 
         Returns:
-            None
+            (str, str, dict): message_id, receipt_handle, message contents
 
 
         """
         return NotImplemented
 
-    def setup_upload_queue(self, credentials, upload_queue, region="us-east-1"):
+    def get_task_batch(self, max_tasks, num_messages=10):
+        """
+        Method to get several upload tasks at once, receiving from the queue until max_tasks are collected or no
+        more tasks are available. Only waits for tasks if there are none at all
+
+        Args:
+            max_tasks(int): The maximum number of tasks to return
+            num_messages(int): Number of messages to prefetch from the upload task queue per request
+
+        Returns:
+            (list((str, str, dict))): message_id, receipt_handle, message contents of each task
+        """
+        tasks = []
+        while len(tasks) < max_tasks:
+            message_id, receipt_handle, msg = self.get_task(num_messages, wait=not tasks)
+            if not msg:
+                break
+            tasks.append((message_id, receipt_handle, msg))
+
+        return tasks
+
+    def get_visibility_margin(self):
+        """
+        Method to get the visibility a buffered task must have left to be handed out without extending it
+
+        The margin is at most a third of the queue's visibility timeout, so freshly received tasks don't need
+        extending even on queues with a short timeout.
+
+        Returns:
+            (int): Seconds
+        """
+        return min(self.visibility_margin, self.visibility_timeout // 3)
+
+    def get_prefetch_depth(self, num_messages):
+        """
+        Method to limit how many tasks are prefetched, so the buffer is drained before their visibility runs out
+
+        Args:
+            num_messages(int): The number of tasks requested
+
+        Returns:
+            (int): The number of tasks to receive
+        """
+        if not self.task_interval:
+            return num_messages
+        usable = self.visibility_timeout - self.get_visibility_margin()
+        return max(1, min(num_messages, int(usable / self.task_interval)))
+
+    def change_task_visibility(self, receipt_handles, timeout):
+        """
+        Method to set the visibility timeout of several upload tasks, batching the requests
+
+        Safe to call from any thread, e.g. the visibility heartbeat, since each thread uses its own SQS client.
+
+        Args:
+            receipt_handles(list(str)): Receipt handles of the tasks to update
+            timeout(int): The new visibility timeout in seconds. 0 makes the tasks immediately visible again
+
+        Returns:
+            (list(str)): Receipt handles that could not be updated
+        """
+        failed = []
+        receipt_handles = list(receipt_handles)
+        sqs = self.sqs_clients.client('sqs')
+        queue_url = self.queue.url
+        for start in range(0, len(receipt_handles), 10):
+            entries = [{"Id": str(idx), "ReceiptHandle": handle, "VisibilityTimeout": int(timeout)}
+                       for idx, handle in enumerate(receipt_handles[start:start + 10])]
+            try:
+                response = sqs.change_message_visibility_batch(QueueUrl=queue_url, Entries=entries)
+            except botocore.exceptions.ClientError:
+                failed.extend(receipt_handles[start:start + 10])
+                continue
+
+            for failure in response.get("Failed", []):
+                failed.append(entries[int(failure["Id"])]["ReceiptHandle"])
+
+        return failed
+
+    def delete_tasks(self, receipt_handles):
+        """
+        Method to remove several upload tasks from the queue, batching the requests
+
+        Safe to call from any thread, since each thread uses its own SQS client.
+
+        Args:
+            receipt_handles(list(str)): Receipt handles of the tasks to delete
+
+        Returns:
+            (list(str)): Receipt handles that could not be deleted
+        """
+        failed = []
+        receipt_handles = list(receipt_handles)
+        sqs = self.sqs_clients.client('sqs')
+        queue_url = self.queue.url
+        for start in range(0, len(receipt_handles), 10):
+            entries = [{"Id": str(idx), "ReceiptHandle": handle}
+                       for idx, handle in enumerate(receipt_handles[start:start + 10])]
+            try:
+                response = sqs.delete_message_batch(QueueUrl=queue_url, Entries=entries)
+            except botocore.exceptions.ClientError:
+                failed.extend(receipt_handles[start:start + 10])
+                continue
+
+            for failure in response.get("Failed", []):
+                failed.append(entries[int(failure["Id"])]["ReceiptHandle"])
+
+        return failed
+
+    def release_buffered_tasks(self):
+        """
+        Method to make all prefetched but unprocessed tasks visible on the upload queue again
+
+        Returns:
+            None
+        """
+        if not self.task_buffer:
+            return
+
+        receipt_handles = [task[1] for task in self.task_buffer]
+        self.task_buffer.clear()
+        self.change_task_visibility(receipt_handles, 0)
+
+    def connect(self, ingest_job_id, credentials, upload_queue, tile_bucket):
+        """
+        Method to connect to the upload queue and tile bucket of a joined ingest job
+
+        Lets a process use the credentials another process received when it joined, without joining itself. When
+        renewing credentials the new connections are built and checked before they replace the old ones, so
+        requests in progress finish on the old connections.
+
+        Args:
+            ingest_job_id(int): The ID of the job
+            credentials(dict): AWS credentials
+            upload_queue(str): The URL for the upload SQS queue
+            tile_bucket(str): The name of the tile bucket
+
+        Returns:
+            None
+        """
+        self.setup_upload_queue(credentials, upload_queue)
+        self.setup_tile_bucket(credentials, tile_bucket)
+
+    def setup_upload_queue(self, credentials, upload_queue, region=None):
         """
         Method to create a connection to the upload task queue
 
         Args:
             credentials(dict): AWS credentials
             upload_queue(str): The URL for the upload SQS queue
-            region(str): The AWS region where the SQS queue exists
+            region(str): The AWS region where the SQS queue exists, if not the "region" of the backend's "aws"
+                         parameters or us-east-1
 
         Returns:
             None
 
         """
-        self.sqs = boto3.resource('sqs', region_name=region, aws_access_key_id=credentials["access_key"],
-                                  aws_secret_access_key=credentials["secret_key"])
-        self.queue = self.sqs.Queue(url=upload_queue)
+        # A session per set of credentials, since the default session can't be shared with a background refresh
+        sqs_clients = ClientFactory.from_params(self.aws_params, credentials, region or DEFAULT_REGION)
+        sqs = sqs_clients.resource('sqs')
+        queue = sqs.Queue(url=upload_queue)
+
+        # Prefetched tasks are tracked against the queue's visibility timeout. Reading it also checks new
+        # credentials, which can take a few seconds to become valid
+        visibility_timeout = self.visibility_timeout
+        for attempt in range(self.connect_attempts):
+            try:
+                visibility_timeout = int(queue.attributes["VisibilityTimeout"])
+                break
+            except botocore.exceptions.ClientError:
+                if attempt + 1 < self.connect_attempts:
+                    time.sleep(min(2 ** attempt, 15))
+                elif self.queue is not None:
+                    # Keep using the current credentials, they are renewed before they expire
+                    raise Exception("(pid={}) New credentials failed to become valid".format(os.getpid()))
+                else:
+                    # Without the queue's visibility timeout prefetched tasks could expire while buffered
+                    raise Exception("(pid={}) Could not read the upload queue attributes".format(os.getpid()))
+            except (KeyError, ValueError):
+                always_log_info("(pid={}) Could not read the upload queue visibility timeout, assuming {} "
+                                "seconds".format(os.getpid(), self.visibility_timeout))
+                break
+
+        # Each assignment is atomic, so other threads see either the old or the new queue
+        self.sqs = sqs
+        self.sqs_clients = sqs_clients
+        self.visibility_timeout = visibility_timeout
+        self.queue = queue
 
-    def setup_tile_bucket(self, credentials, tile_bucket, region="us-east-1"):
+    def setup_tile_bucket(self, credentials, tile_bucket, region=None):
         """
         Method to create a connection to the tile bucket
 
         Args:
             credentials(dict): AWS credentials
             tile_bucket(str): The name of the bucket
-            region(str): The AWS region where the SQS queue exists
+            region(str): The AWS region where the bucket exists, if not the "region" of the backend's "aws"
+                         parameters or us-east-1
 
         Returns:
             None
 
         """
-        self.s3 = boto3.resource('s3', region_name=region, aws_access_key_id=credentials["access_key"],
-                                 aws_secret_access_key=credentials["secret_key"])
-        self.bucket = self.s3.Bucket(tile_bucket)
+        s3_clients = ClientFactory.from_params(self.aws_params, credentials, region or DEFAULT_REGION)
+        s3 = s3_clients.resource('s3')
+        bucket = s3.Bucket(tile_bucket)
+
+        # Uploads in flight keep the client they started with
+        self.s3_clients = s3_clients
+        self.s3 = s3
+        self.bucket = bucket
+
+    def put_tile(self, tile_key, body, metadata):
+        """
+        Method to upload a tile to the tile bucket
+
+        Each upload thread uses its own client, with a connection pool sized for concurrent uploads
+
+        Args:
+            tile_key(str): The object key of the tile
+            body(TileBuffer|file-like): The encoded tile, or a handle positioned at the start of the data
+            metadata(dict): Object metadata to store with the tile
+
+        Returns:
+            (dict): The put_object response
+        """
+        kwargs = {}
+        if isinstance(body, TileBuffer):
+            # Send the bytes as they are, with the MD5 the tile processor already computed
+            kwargs["ContentMD5"] = body.content_md5
+            body = body.data
+
+        return self.s3_clients.client('s3').put_object(ACL='private',
+                                                       Body=body,
+                                                       Bucket=self.bucket.name,
+                                                       Key=tile_key,
+                                                       Metadata=metadata,
+                                                       StorageClass='STANDARD',
+                                                       **kwargs)
 
     @abstractmethod
     def encode_tile_key(self, project_info, resolution, x_index, y_index, z_index, t_index=0):
@@ -263,6 +504,8 @@ class Backend(object):
         """
         if backend_str == "BossBackend":
             return BossBackend(config_data)
+        elif backend_str == "LocalBackend":
+            return LocalBackend(config_data)
         else:
             return ValueError("Unsupported Backend: {}".format(backend_str))
 
@@ -283,11 +526,18 @@ class BossBackend(Backend):
         self.api_version = "latest"
         self.validate_ssl = True
         self.credential_timeout = 3300  # Currently credentials expire in 1 hr, so renew after 55 minutes
+        self.session = None
+        self.request_timeout = (10, 60)  # Seconds to connect to the ingest service and to wait for each response
+        self.request_retries = 5  # Retries of idempotent requests that fail to connect or get a server error
+        self.request_backoff = 0.5  # Seconds of backoff before the second retry, doubled per retry
 
     def setup(self, api_token=None):
         """
         Method to configure the backend based on configuration parameters in the config file
 
+        The optional "request_timeout", "request_retries" and "request_backoff" backend parameters tune the
+        requests to the ingest service, and "receive_wait_time" the long polling of the upload queue.
+
         Args:
 
         Returns:
@@ -295,8 +545,16 @@ class BossBackend(Backend):
 
 
         """
-        self.host = "{}://{}".format(self.config["client"]["backend"]["protocol"],
-                                     self.config["client"]["backend"]["host"])
+        backend_config = self.config["client"]["backend"]
+        self.host = "{}://{}".format(backend_config["protocol"], backend_config["host"])
+        self.request_timeout = backend_config.get("request_timeout", self.request_timeout)
+        if isinstance(self.request_timeout, list):
+            # A [connect, read] pair from the JSON config
+            self.request_timeout = tuple(self.request_timeout)
+        self.request_retries = backend_config.get("request_retries", self.request_retries)
+        self.request_backoff = backend_config.get("request_backoff", self.request_backoff)
+        self.receive_wait_time = backend_config.get("receive_wait_time", self.receive_wait_time)
+        self.session = self.create_session()
 
         # If API token not provided, load API credentials from intern locations as needed.
         if not api_token:
@@ -320,6 +578,43 @@ class BossBackend(Backend):
         self.api_headers = {'Authorization': 'Token ' + api_token, 'Accept': 'application/json',
                             'content-type': 'application/json'}
 
+    def get_identity(self):
+        """
+        Method to get a name for the ingest service this backend talks to
+
+        Returns:
+            (str): The ingest service's URL
+        """
+        return self.host or ""
+
+    def create_session(self):
+        """
+        Method to create the HTTP session used for requests to the ingest service
+
+        The session keeps connections to the service open between requests. GET and DELETE requests, which are
+        idempotent, are retried with exponential backoff when they fail to connect, time out or get a throttling or
+        server error response. Creating a job or marking it complete is not retried.
+
+        Returns:
+            (requests.Session)
+        """
+        retry_params = {"total": self.request_retries,
+                        "backoff_factor": self.request_backoff,
+                        "status_forcelist": (429, 500, 502, 503, 504),
+                        "raise_on_status": False}
+        idempotent = frozenset(["GET", "HEAD", "OPTIONS", "DELETE"])
+        try:
+            retry = Retry(allowed_methods=idempotent, **retry_params)
+        except TypeError:
+            # urllib3 before 1.26
+            retry = Retry(method_whitelist=idempotent, **retry_params)
+
+        session = requests.Session()
+        adapter = HTTPAdapter(max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
     def create(self, config_dict):
         """
         Method to upload the config data to the backend to create an ingest job
@@ -333,8 +628,8 @@ class BossBackend(Backend):
 
         """
         always_log_info("Submitting ingest job configuration for creation...")
-        r = requests.post('{}/{}/ingest/'.format(self.host, self.api_version), json=config_dict,
-                          headers=self.api_headers, verify=self.validate_ssl)
+        r = self.session.post('{}/{}/ingest/'.format(self.host, self.api_version), json=config_dict,
+                              headers=self.api_headers, verify=self.validate_ssl, timeout=self.request_timeout)
 
         if r.status_code != 201:
             msg = r.json()
@@ -364,8 +659,8 @@ class BossBackend(Backend):
         """
         wp = WaitPrinter()
         while True:
-            r = requests.get('{}/{}/ingest/{}'.format(self.host, self.api_version, ingest_job_id),
-                             headers=self.api_headers, verify=self.validate_ssl)
+            r = self.session.get('{}/{}/ingest/{}'.format(self.host, self.api_version, ingest_job_id),
+                                 headers=self.api_headers, verify=self.validate_ssl, timeout=self.request_timeout)
 
             if r.status_code != 200:
                 raise Exception("Failed to join ingest job: {}".format(r.text))
@@ -397,8 +692,7 @@ class BossBackend(Backend):
                     params["OBJECTIO_CONFIG"] = result["OBJECTIO_CONFIG"]
                     params["resource"] = result["resource"]
 
-                    self.setup_upload_queue(creds, queue, region="us-east-1")
-                    self.setup_tile_bucket(creds, tile_bucket, region="us-east-1")
+                    self.connect(ingest_job_id, creds, queue, tile_bucket)
 
                     return job_status, creds, queue, tile_bucket, params, num_tiles
 
@@ -414,8 +708,8 @@ class BossBackend(Backend):
 
 
         """
-        r = requests.delete('{}/{}/ingest/{}'.format(self.host, self.api_version, ingest_job_id),
-                            headers=self.api_headers, verify=self.validate_ssl)
+        r = self.session.delete('{}/{}/ingest/{}'.format(self.host, self.api_version, ingest_job_id),
+                                headers=self.api_headers, verify=self.validate_ssl, timeout=self.request_timeout)
 
         if r.status_code != 204:
             raise Exception("Failed to cancel ingest job: {}".format(r.json()))
@@ -432,39 +726,109 @@ class BossBackend(Backend):
 
 
         """
-        r = requests.post('{}/{}/ingest/{}/complete'.format(self.host, self.api_version, ingest_job_id),
-                          headers=self.api_headers, verify=self.validate_ssl)
+        r = self.session.post('{}/{}/ingest/{}/complete'.format(self.host, self.api_version, ingest_job_id),
+                              headers=self.api_headers, verify=self.validate_ssl, timeout=self.request_timeout)
 
         if r.status_code != 204:
             raise Exception("Failed to complete ingest job: {}".format(r.json()))
 
-    def get_task(self, num_messages=1):
+    def get_task(self, num_messages=10, wait=True):
         """
         Method to get an upload task
 
+        Tasks are received from SQS in batches of up to num_messages (SQS caps this at 10) and handed out one at a
+        time from a local buffer. Fewer are received if, at the rate tasks are being handed out, the buffer wouldn't
+        drain before their visibility runs out. Buffered tasks whose visibility is about to expire are extended if
+        they are about to be processed, otherwise they are released back to the queue for other clients.
+
         Args:
-            num_messages(int): Number of messages to pop off the upload task queue
+            num_messages(int): Number of messages to prefetch from the upload task queue when the buffer is empty
+            wait(bool): Long poll the queue for up to receive_wait_time seconds if it is empty
 
         Returns:
             (str, str, dict): message_id, receipt_handle, message contents
         """
-        try_cnt = 0
-        while try_cnt < 19:
+        buffered = bool(self.task_buffer)
+        if not buffered:
+            self._receive_tasks(self.get_prefetch_depth(num_messages), self.receive_wait_time if wait else 0)
+
+        self._expire_buffered_tasks()
+
+        if not self.task_buffer:
+            return None, None, None
+
+        # Time the handouts of buffered tasks, which are paced by how fast the caller processes them
+        now = time.time()
+        if buffered and self.last_handout is not None:
+            interval = now - self.last_handout
+            self.task_interval = interval if self.task_interval is None else 0.8 * self.task_interval + 0.2 * interval
+        self.last_handout = now
+
+        message_id, receipt_handle, body, deadline = self.task_buffer.popleft()
+        return message_id, receipt_handle, json.loads(body)
+
+    def _receive_tasks(self, num_messages, wait_time=0):
+        """
+        Method to fill the task buffer from the upload task queue
+
+        Errors receiving from the queue are retried with a backoff, up to receive_attempts tries.
+
+        Args:
+            num_messages(int): Number of messages to request, clamped to the 1-10 range SQS supports
+            wait_time(int): Seconds to wait for messages if the queue is empty, up to the 20 SQS supports
+
+        Returns:
+            None
+        """
+        num_messages = max(1, min(10, num_messages))
+        wait_time = max(0, min(20, int(wait_time)))
+        for attempt in range(self.receive_attempts):
+            queue = self.queue
             try:
-                msg = self.queue.receive_messages(MaxNumberOfMessages=1, WaitTimeSeconds=1)
+                msgs = queue.receive_messages(MaxNumberOfMessages=num_messages, WaitTimeSeconds=wait_time)
                 break
-            except botocore.exceptions.ClientError as e:
-                print("(pid={}) Waiting for credentials to be valid".format(os.getpid()))
-                try_cnt += 1
-                time.sleep(15)
+            except botocore.exceptions.ClientError:
+                if attempt + 1 >= self.receive_attempts:
+                    raise
+                if self.queue is queue:
+                    # Throttling, a service error or credentials that aren't valid yet. Back off and try again
+                    always_log_info("(pid={}) Failed to receive upload tasks, retrying".format(os.getpid()))
+                    time.sleep(min(2 ** attempt, 15))
+                # Otherwise the credentials were renewed during the request, so retry right away
+
+        deadline = time.time() + self.visibility_timeout
+        for msg in msgs:
+            self.task_buffer.append((msg.message_id, msg.receipt_handle, msg.body, deadline))
+
+    def _expire_buffered_tasks(self):
+        """
+        Method to check the visibility deadline of buffered tasks
 
-                if try_cnt >= 20:
-                    raise Exception("(pid={}) Credentials failed to be come valid".format(os.getpid()))
+        Tasks that have already become visible again are dropped since another client may be processing them. The
+        next task to be handed out is extended if it is close to its deadline, and any other task close to its
+        deadline is released so it doesn't sit in this client's buffer while other clients go idle.
 
-        if msg:
-            return msg[0].message_id, msg[0].receipt_handle, json.loads(msg[0].body)
-        else:
-            return None, None, None
+        Returns:
+            None
+        """
+        now = time.time()
+        while self.task_buffer and self.task_buffer[0][3] <= now:
+            self.task_buffer.popleft()
+
+        if not self.task_buffer:
+            return
+
+        margin = self.get_visibility_margin()
+        message_id, receipt_handle, body, deadline = self.task_buffer[0]
+        if deadline - now < margin:
+            if not self.change_task_visibility([receipt_handle], self.visibility_timeout):
+                self.task_buffer[0] = (message_id, receipt_handle, body, now + self.visibility_timeout)
+
+        expiring = [task for task in list(self.task_buffer)[1:] if task[3] - now < margin]
+        if expiring:
+            for task in expiring:
+                self.task_buffer.remove(task)
+            self.change_task_visibility([task[1] for task in expiring], 0)
 
     def get_job_status(self, ingest_job_id):
         """
@@ -476,8 +840,8 @@ class BossBackend(Backend):
         Returns:
             (int)
         """
-        r = requests.get('{}/{}/ingest/{}/status'.format(self.host, self.api_version, ingest_job_id),
-                         headers=self.api_headers, verify=self.validate_ssl)
+        r = self.session.get('{}/{}/ingest/{}/status'.format(self.host, self.api_version, ingest_job_id),
+                             headers=self.api_headers, verify=self.validate_ssl, timeout=self.request_timeout)
 
         if r.status_code != 200:
             raise Exception("Failed to get ingest job status: {}".format(r.text))
@@ -583,3 +947,363 @@ class BossBackend(Backend):
         result["t_index"] = int(parts[9])
 
         return result
+
+
+class LocalBackend(BossBackend):
+    def __init__(self, config):
+        """
+        A class to stand in for the Boss ingest service, SQS and S3 using local directories
+
+        Each job is a directory under the backend "host", which is a local path (use "file" as the protocol):
+
+            <host>/<job id>/job.json     job status, tile count and configuration
+            <host>/<job id>/queue/       one file per visible upload task
+            <host>/<job id>/inflight/    received tasks, named by receipt handle. The file modification time is the
+                                         time the task becomes visible again
+            <host>/<job id>/bucket/      uploaded tiles, named by tile key
+            <host>/<job id>/metadata/    the object metadata of each tile, as JSON
+
+        Tasks are claimed by renaming their file, so several processes can share a job. Uploading a tile deletes its
+        task, as the Boss tile upload lambda does. Tile and chunk keys are the same as the Boss uses, with the job ID
+        standing in for the collection ID and 0 for the experiment and channel IDs.
+
+        Args:
+            config (dict): Dictionary of parameters from the config file
+        """
+        BossBackend.__init__(self, config)
+        self.root = None
+        self.job_dir = None
+        self.visibility_timeout = 300
+        self.credential_timeout = 3300
+        self.z_chunk_size = 16  # Number of z tiles in an ingest chunk
+
+        self._visible = deque()
+
+    def setup(self, api_token=None):
+        """
+        Method to configure the backend based on configuration parameters in the config file
+
+        Args:
+            api_token(str): Ignored
+
+        Returns:
+            None
+        """
+        self.root = os.path.abspath(os.path.expanduser(self.config["client"]["backend"]["host"]))
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    def get_identity(self):
+        """
+        Method to get a name for the ingest service this backend talks to
+
+        Returns:
+            (str): The URL of the root directory
+        """
+        return "file://{}".format(self.root)
+
+    def _job_path(self, ingest_job_id, *parts):
+        """Method to get a path within a job's directory"""
+        return os.path.join(self.root, str(ingest_job_id), *parts)
+
+    def _read_job(self, ingest_job_id):
+        """Method to load a job's job.json"""
+        try:
+            with open(self._job_path(ingest_job_id, "job.json"), 'rt') as job_file:
+                return json.load(job_file)
+        except (IOError, OSError):
+            raise Exception("Ingest job {} not found in {}".format(ingest_job_id, self.root))
+
+    def _write_job(self, ingest_job_id, job):
+        """Method to replace a job's job.json atomically"""
+        tmp_path = self._job_path(ingest_job_id, "job.json.{}".format(os.getpid()))
+        with open(tmp_path, 'wt') as job_file:
+            json.dump(job, job_file)
+        os.rename(tmp_path, self._job_path(ingest_job_id, "job.json"))
+
+    def create(self, config_dict):
+        """
+        Method to create an ingest job and fill its upload queue with a task for every tile in the job's extent
+
+        Args:
+            config_dict(dict): config data
+
+        Returns:
+            (int): The returned ingest_job_id
+        """
+        existing = [int(name) for name in os.listdir(self.root) if name.isdigit()]
+        ingest_job_id = max(existing) + 1 if existing else 1
+        while True:
+            try:
+                os.mkdir(self._job_path(ingest_job_id))
+                break
+            except OSError:
+                # Another process created this job first
+                ingest_job_id += 1
+
+        for name in ["queue", "inflight", "bucket", "metadata"]:
+            os.mkdir(self._job_path(ingest_job_id, name))
+        self._write_job(ingest_job_id, {"status": 0, "tile_count": 0, "config": config_dict})
+
+        always_log_info("Populating local upload queue for ingest job {}...".format(ingest_job_id))
+        tile_count = self._populate_queue(ingest_job_id, config_dict)
+        self._write_job(ingest_job_id, {"status": 1, "tile_count": tile_count, "config": config_dict})
+
+        return ingest_job_id
+
+    def _populate_queue(self, ingest_job_id, config_dict):
+        """
+        Method to write an upload task for every tile in the job's extent
+
+        Args:
+            ingest_job_id(int): The ID of the job
+            config_dict(dict): config data
+
+        Returns:
+            (int): The number of tasks written
+        """
+        job = config_dict["ingest_job"]
+        project_info = [ingest_job_id, 0, 0]
+
+        ranges = {}
+        for dim in ["x", "y", "z", "t"]:
+            start, stop = job["extent"][dim]
+            tile_size = job["tile_size"][dim]
+            ranges[dim] = range(start // tile_size, int(math.ceil(stop / float(tile_size))))
+
+        z_tiles = list(ranges["z"])
+        count = 0
+        for t_index in ranges["t"]:
+            for z_start in range(0, len(z_tiles), self.z_chunk_size):
+                chunk = z_tiles[z_start:z_start + self.z_chunk_size]
+                for y_index in ranges["y"]:
+                    for x_index in ranges["x"]:
+                        chunk_key = self.encode_chunk_key(len(chunk), project_info, job["resolution"], x_index,
+                                                          y_index, chunk[0] // self.z_chunk_size, t_index)
+                        for z_index in chunk:
+                            tile_key = self.encode_tile_key(project_info, job["resolution"], x_index, y_index,
+                                                            z_index, t_index)
+                            msg = {"job_id": ingest_job_id, "chunk_key": chunk_key, "tile_key": tile_key}
+                            count += 1
+                            with open(self._job_path(ingest_job_id, "queue", "{:012d}".format(count)),
+                                      'wt') as msg_file:
+                                json.dump(msg, msg_file)
+
+        return count
+
+    def join(self, ingest_job_id):
+        """
+        Method to join an ingest job upload
+
+        Job Status: {0: Preparing, 1: Uploading, 2: Complete, 3: Deleted}
+
+        Args:
+            ingest_job_id(int): The ID of the job you'd like to resume processing
+
+        Returns:
+            (int, dict, str, str, dict, int): The job status, placeholder credentials, the queue directory, the bucket
+                                              directory, config_params to pass along during upload via metadata,
+                                              and tile count
+        """
+        job = self._read_job(ingest_job_id)
+
+        queue = self._job_path(ingest_job_id, "queue")
+        tile_bucket = self._job_path(ingest_job_id, "bucket")
+        self.connect(ingest_job_id, None, queue, tile_bucket)
+        params = {"upload_queue": queue,
+                  "ingest_queue": None,
+                  "ingest_lambda": None,
+                  "KVIO_SETTINGS": None,
+                  "STATEIO_CONFIG": None,
+                  "OBJECTIO_CONFIG": None,
+                  "resource": job["config"].get("database")}
+
+        return job["status"], {"access_key": "local", "secret_key": "local"}, queue, tile_bucket, params, \
+            job["tile_count"]
+
+    def connect(self, ingest_job_id, credentials, upload_queue, tile_bucket):
+        """
+        Method to connect to the directories of a joined ingest job
+
+        Args:
+            ingest_job_id(int): The ID of the job
+            credentials(dict): Ignored
+            upload_queue(str): Ignored, the queue is in the job directory
+            tile_bucket(str): Ignored, the bucket is in the job directory
+
+        Returns:
+            None
+        """
+        self.job_dir = self._job_path(ingest_job_id)
+        self._visible.clear()
+
+    def cancel(self, ingest_job_id):
+        """
+        Method to cancel an ingest job, dropping its remaining tasks
+
+        Args:
+            ingest_job_id(int): The ID of the job you'd like to cancel
+
+        Returns:
+            None
+        """
+        job = self._read_job(ingest_job_id)
+        job["status"] = 3
+        self._write_job(ingest_job_id, job)
+        for name in ["queue", "inflight"]:
+            for msg_name in os.listdir(self._job_path(ingest_job_id, name)):
+                try:
+                    os.remove(self._job_path(ingest_job_id, name, msg_name))
+                except OSError:
+                    pass
+
+    def complete(self, ingest_job_id):
+        """
+        Method to complete an ingest job
+
+        Args:
+            ingest_job_id(int): The ID of the job you'd like to complete
+
+        Returns:
+            None
+        """
+        job = self._read_job(ingest_job_id)
+        job["status"] = 2
+        self._write_job(ingest_job_id, job)
+
+    def get_job_status(self, ingest_job_id):
+        """
+        Method to get the job status
+
+        Args:
+            ingest_job_id(int): The ID of the job you'd like to resume processing
+
+        Returns:
+            (dict): The job "status", the "current_message_count" of tasks left and the "total_message_count"
+        """
+        job = self._read_job(ingest_job_id)
+        remaining = (len(os.listdir(self._job_path(ingest_job_id, "queue"))) +
+                     len(os.listdir(self._job_path(ingest_job_id, "inflight"))))
+        return {"id": ingest_job_id,
+                "status": job["status"],
+                "current_message_count": remaining,
+                "total_message_count": job["tile_count"]}
+
+    def _receive_tasks(self, num_messages, wait_time=0):
+        """
+        Method to fill the task buffer by claiming visible tasks
+
+        A task is claimed by setting its visibility deadline as the file's modification time and renaming it into
+        the inflight directory under a new receipt handle. Only one process can rename a file, so a failed rename
+        means another process claimed the task first. Inflight tasks whose deadline has passed are visible again.
+
+        Args:
+            num_messages(int): Number of tasks to claim
+            wait_time(int): Ignored, tasks are claimed without waiting
+
+        Returns:
+            None
+        """
+        if not self._visible:
+            # List the queue once and claim from the listing until it runs out
+            queue = os.path.join(self.job_dir, "queue")
+            self._visible.extend(os.path.join(queue, name) for name in sorted(os.listdir(queue)))
+
+            inflight = os.path.join(self.job_dir, "inflight")
+            now = time.time()
+            for name in os.listdir(inflight):
+                path = os.path.join(inflight, name)
+                try:
+                    if os.path.getmtime(path) <= now:
+                        self._visible.append(path)
+                except OSError:
+                    pass
+
+        deadline = time.time() + self.visibility_timeout
+        claimed = 0
+        while self._visible and claimed < num_messages:
+            path = self._visible.popleft()
+            message_id = os.path.basename(path).split(".")[0]
+            receipt_handle = "{}.{}".format(message_id, uuid.uuid4().hex)
+            inflight_path = os.path.join(self.job_dir, "inflight", receipt_handle)
+            try:
+                os.utime(path, (deadline, deadline))
+                os.rename(path, inflight_path)
+                with open(inflight_path, 'rt') as msg_file:
+                    body = msg_file.read()
+            except (IOError, OSError):
+                continue
+
+            self.task_buffer.append((message_id, receipt_handle, body, deadline))
+            claimed += 1
+
+    def change_task_visibility(self, receipt_handles, timeout):
+        """
+        Method to set the visibility timeout of several upload tasks
+
+        Args:
+            receipt_handles(list(str)): Receipt handles of the tasks to update
+            timeout(int): The new visibility timeout in seconds. 0 makes the tasks immediately visible again
+
+        Returns:
+            (list(str)): Receipt handles that could not be updated
+        """
+        failed = []
+        deadline = time.time() + timeout
+        for receipt_handle in receipt_handles:
+            path = os.path.join(self.job_dir, "inflight", receipt_handle)
+            try:
+                if timeout <= 0:
+                    os.rename(path, os.path.join(self.job_dir, "queue", receipt_handle.split(".")[0]))
+                else:
+                    os.utime(path, (deadline, deadline))
+            except OSError:
+                failed.append(receipt_handle)
+
+        return failed
+
+    def delete_tasks(self, receipt_handles):
+        """
+        Method to remove several upload tasks from the queue
+
+        Args:
+            receipt_handles(list(str)): Receipt handles of the tasks to delete
+
+        Returns:
+            (list(str)): Receipt handles that could not be deleted
+        """
+        failed = []
+        for receipt_handle in receipt_handles:
+            try:
+                os.remove(os.path.join(self.job_dir, "inflight", receipt_handle))
+            except OSError:
+                failed.append(receipt_handle)
+
+        return failed
+
+    def put_tile(self, tile_key, body, metadata):
+        """
+        Method to store a tile in the bucket directory and delete its upload task
+
+        Args:
+            tile_key(str): The object key of the tile
+            body(TileBuffer|file-like): The encoded tile, or a handle positioned at the start of the data
+            metadata(dict): Object metadata to store with the tile
+
+        Returns:
+            (dict): The ETag of the tile, as put_object returns it
+        """
+        tile = TileBuffer.from_handle(body)
+        tile_path = os.path.join(self.job_dir, "bucket", tile_key)
+        tmp_path = "{}.{}".format(tile_path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as tile_file:
+            tile_file.write(tile.data)
+        os.rename(tmp_path, tile_path)
+
+        with open(os.path.join(self.job_dir, "metadata", tile_key), 'wt') as metadata_file:
+            json.dump(metadata, metadata_file)
+
+        if metadata.get("receipt_handle"):
+            self.delete_tasks([metadata["receipt_handle"]])
+
+        return {"ETag": '"{}"'.format(hashlib.md5(tile.view).hexdigest())}
@@ -421,6 +421,14 @@ class Configuration(object):
         params["ingest_job"] = self.config_data["ingest_job"]
         return params
 
+    def get_engine_params(self):
+        """Method to get the optional engine tuning parameter dictionary
+
+        Returns:
+            (dict): Dictionary of params from the "engine" section of the client config, empty if not provided
+        """
+        return self.config_data["client"].get("engine", {})
+
     def get_validator(self):
         """
         Method to get a validator instance based on the configuration
@@ -0,0 +1,86 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import os
+import threading
+
+
+class CredentialRefresher(object):
+    def __init__(self, engine, interval=10, on_refresh=None):
+        """
+        A class to renew an engine's credentials in the background, before they expire
+
+        A background thread wakes every `interval` seconds and calls engine.renew_credentials(), which joins the
+        ingest job again once the credentials are older than the backend's credential_timeout, or applies
+        credentials pushed by the master process. The backend builds its new connections before swapping them in,
+        so the task loop and in-flight uploads keep using the old, still valid, connections until then. A failed
+        renewal is logged and tried again on the next wake-up.
+
+        Args:
+            engine(ingestclient.core.engine.Engine): The engine whose credentials are renewed
+            interval(float): Seconds between checks
+            on_refresh(callable): Called without arguments after each renewal, if given
+        """
+        self.engine = engine
+        self.interval = interval
+        self.on_refresh = on_refresh
+        self.refreshes = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Method to start the refresh thread
+
+        Returns:
+            None
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Method to stop the refresh thread, waiting for a renewal in progress to finish
+
+        Returns:
+            None
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def refresh(self):
+        """Method to renew the credentials if they are due
+
+        Returns:
+            (bool): True if the credentials were renewed
+        """
+        if not self.engine.renew_credentials():
+            return False
+
+        self.refreshes += 1
+        if self.on_refresh:
+            self.on_refresh()
+        return True
+
+    def _run(self):
+        """Refresh thread main loop"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.getLogger('ingest-client').warning("(pid={}) Credential renewal failed, retrying: {}".format(
+                    os.getpid(), e))
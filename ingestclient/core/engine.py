@@ -11,17 +11,24 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from six.moves import input
+from six.moves import input, queue
 import logging
 import datetime
 import json
+import threading
 import time
 from ..utils.log import always_log_info
+from ..utils.encoder import TileBuffer
 import os
 from math import floor
 import random
 from .config import Configuration, ConfigFileError
-from collections import deque
+from .upload import AimdController, FailureJournal, RetryPolicy, UploadExecutor, UploadResult
+from .heartbeat import VisibilityHeartbeat
+from .credentials import CredentialRefresher
+from .metrics import EngineMetrics
+from ..utils.ledger import UploadLedger, UPLOADED, FAILED
+from collections import deque, OrderedDict
 
 
 class Engine(object):
@@ -36,13 +43,62 @@ class Engine(object):
             configuration(ingestclient.core.config.Configuration): A pre-loaded configuration instance
         """
         self.config = None
-        self.msg_wait_iterations = 20  # Each iteration waits for 10 seconds for incoming messages
+        self.msg_wait_iterations = 20  # Empty receives, at least idle_poll_interval apart, before giving up on the job
+        self.idle_poll_interval = 10  # Minimum seconds between receives while the upload queue is empty
+        self.wait_for_master = False  # Leave deciding when the job is done to the master process
+        self.done_confirmations = 2  # Consecutive checks that must find the job drained before stopping
+        self.drained_checks = 0
+        self.job_done = threading.Event()  # Set once the job has no tasks left, e.g. when the master signals it
+        self.retry_deadline = 0  # When the tasks of failed uploads released by this engine are all visible again
+        self.hidden_task_deadline = 0  # When the tasks held by workers that were stopped or died are visible again
+        self.task_prefetch = 10  # Number of upload tasks to receive from the queue per request
+        self.upload_threads = 4  # Number of concurrent tile uploads
+        self.max_upload_bytes_in_flight = 64 * 1024 * 1024  # Encoded tile bytes allowed to wait on uploads
+        self.schedule_by_source = False  # Group received tasks by source file so each is read once
+        self.schedule_batch_size = 50  # Number of tasks to group at once when scheduling by source
+        self.adaptive_concurrency = False  # Adjust concurrent uploads from S3 latency and throttling
+        self.max_upload_threads = 32  # Upper bound on concurrent uploads when adaptive
+        self.visibility_heartbeat = True  # Keep tasks hidden on the upload queue while they are worked on
+        self.heartbeat_interval = 10  # Seconds between visibility heartbeats
+        self.heartbeat = None
+        self.failed_task_delay = 5  # Seconds before a task whose upload failed is visible again, doubled per failure
+        self.max_failed_task_delay = 300  # Upper bound on the failed task delay
+        self.in_progress = set()  # Receipt handles of received tasks that haven't finished uploading
+        self.failure_counts = {}  # Number of failed uploads of each tile key
+        self.upload_attempts = 5  # Number of times an upload is tried before its task is released
+        self.retry_base_delay = 0.5  # Seconds of backoff before the first upload retry, doubled per retry
+        self.retry_max_delay = 20  # Upper bound on the upload retry backoff
+        self.failure_journal = None  # File to record tiles that failed all upload attempts in, None to not record
+        self.journal = None
+        self.ledger_path = None  # SQLite ledger of finished uploads, used to skip completed tiles on resume
+        self.ledger = None
+        self.metrics = EngineMetrics()
+        self.stats_log_interval = 300  # Seconds between logged metrics summaries, 0 to disable
+        self.last_stats_log = time.time()
+        self.stats_reporter = None  # Called with a message tag and payload to report progress and stats
+        self.credential_source = None  # Called to get job info pushed by the master process, in place of joining
+        self.master_pipe = None  # A worker's end of its pipe to the master process, only read by the upload loop
+        self.pushed_job_info = queue.Queue()  # Job info the master pushed, waiting for the credential refresher
+        self.credential_refresh_interval = 10  # Seconds between background checks for due or pushed credentials
+        self.credential_refresher = None
+        self.progress_report_interval = 5  # Seconds between compact progress reports
+        self.stats_report_interval = 30  # Seconds between full metrics reports
+        self.last_progress_report = 0
+        self.last_stats_report = 0
+        self.stage = "start"  # What the upload loop is currently doing
+        self.tasks_processed = 0  # Tasks run through the path and tile processors, so long stages show progress
+        self.stage_start = time.time()
+        self.stall_timeout = 300  # Seconds a worker may go without progress before it is considered stalled
+        self.worker_stats = {}  # The latest stats reported by each worker process, by pid
+        self.worker_progress = {}  # The latest progress of each worker process and when it last advanced, by pid
+        self.executor = None
         self.backend = None
         self.validator = None
         self.tile_processor = None
         self.path_processor = None
         self.backend_api_token = backend_api_token
         self.credential_create_time = None
+        self.credential_lock = threading.Lock()  # Keeps the job info consistent while it is renewed in the background
 
         # Properties of ingest after creation
         self.credentials = None
@@ -109,11 +165,41 @@ class Engine(object):
         # Setup tile processor
         self.tile_processor = self.config.tile_processor_class
         self.tile_processor.setup(self.config.get_tile_processor_params())
+        if getattr(self.tile_processor, "encoder", None) is not None:
+            self.tile_processor.encoder.metrics = self.metrics
 
         # Setup path processor
         self.path_processor = self.config.path_processor_class
         self.path_processor.setup(self.config.get_path_processor_params())
 
+        # Apply optional engine tuning
+        engine_params = self.config.get_engine_params()
+        self.task_prefetch = engine_params.get("task_prefetch", self.task_prefetch)
+        self.upload_threads = engine_params.get("upload_threads", self.upload_threads)
+        self.max_upload_bytes_in_flight = engine_params.get("max_upload_bytes_in_flight",
+                                                            self.max_upload_bytes_in_flight)
+        self.schedule_by_source = engine_params.get("schedule_by_source", self.schedule_by_source)
+        self.schedule_batch_size = engine_params.get("schedule_batch_size", self.schedule_batch_size)
+        self.adaptive_concurrency = engine_params.get("adaptive_concurrency", self.adaptive_concurrency)
+        self.max_upload_threads = engine_params.get("max_upload_threads", self.max_upload_threads)
+        self.visibility_heartbeat = engine_params.get("visibility_heartbeat", self.visibility_heartbeat)
+        self.heartbeat_interval = engine_params.get("heartbeat_interval", self.heartbeat_interval)
+        self.failed_task_delay = engine_params.get("failed_task_delay", self.failed_task_delay)
+        self.max_failed_task_delay = engine_params.get("max_failed_task_delay", self.max_failed_task_delay)
+        self.upload_attempts = engine_params.get("upload_attempts", self.upload_attempts)
+        self.retry_base_delay = engine_params.get("retry_base_delay", self.retry_base_delay)
+        self.retry_max_delay = engine_params.get("retry_max_delay", self.retry_max_delay)
+        self.failure_journal = engine_params.get("failure_journal", self.failure_journal)
+        self.ledger_path = engine_params.get("ledger", self.ledger_path)
+        self.stats_log_interval = engine_params.get("stats_log_interval", self.stats_log_interval)
+        self.progress_report_interval = engine_params.get("progress_report_interval", self.progress_report_interval)
+        self.stats_report_interval = engine_params.get("stats_report_interval", self.stats_report_interval)
+        self.stall_timeout = engine_params.get("stall_timeout", self.stall_timeout)
+        self.idle_poll_interval = engine_params.get("idle_poll_interval", self.idle_poll_interval)
+        self.done_confirmations = engine_params.get("done_confirmations", self.done_confirmations)
+        self.credential_refresh_interval = engine_params.get("credential_refresh_interval",
+                                                             self.credential_refresh_interval)
+
     def setup(self):
         """Method to setup the Engine by finishing configuring subclasses and validating the schema"""
         logger = logging.getLogger('ingest-client')
@@ -159,12 +245,150 @@ class Engine(object):
 
 
         """
-        self.job_status, self.credentials, self.upload_job_queue, self.tile_bucket, self.job_params, self.tile_count = self.backend.join(self.ingest_job_id)
+        job_info = self.backend.join(self.ingest_job_id)
+        with self.credential_lock:
+            self.job_status, self.credentials, self.upload_job_queue, self.tile_bucket, self.job_params, self.tile_count = job_info
 
-        # Set cred time
-        self.credential_create_time = datetime.datetime.now()
+            # Set cred time
+            self.credential_create_time = datetime.datetime.now()
         always_log_info("(pid={}) JOINED INGEST JOB: {}".format(os.getpid(), self.ingest_job_id))
 
+    def get_job_info(self):
+        """
+        Method to get what joining the ingest job returned, to hand to worker processes
+
+        Returns:
+            (int, dict, str, str, dict, int): The job status, AWS credentials, SQS upload_job_queue, tile bucket name,
+                                              job params and tile count
+        """
+        with self.credential_lock:
+            return (self.job_status, self.credentials, self.upload_job_queue, self.tile_bucket, self.job_params,
+                    self.tile_count)
+
+    def set_job_info(self, job_info):
+        """
+        Method to use the job info and credentials another engine received when it joined the ingest job
+
+        Connects the backend to the upload queue and tile bucket without a request to the ingest service.
+
+        Args:
+            job_info(tuple): The other engine's get_job_info()
+
+        Returns:
+            None
+        """
+        job_status, credentials, upload_job_queue, tile_bucket, job_params, tile_count = job_info
+        self.backend.connect(self.ingest_job_id, credentials, upload_job_queue, tile_bucket)
+        with self.credential_lock:
+            self.job_status, self.credentials, self.upload_job_queue, self.tile_bucket, self.job_params, self.tile_count = job_info
+            self.credential_create_time = datetime.datetime.now()
+
+    def attach_master(self, pipe):
+        """
+        Method to run as a worker of a master process, which pushes renewed credentials and signals the job's end
+
+        Args:
+            pipe(multiprocessing.Connection): The worker's end of its pipe to the master process
+
+        Returns:
+            None
+        """
+        self.master_pipe = pipe
+        self.credential_source = self.get_pushed_job_info
+        self.wait_for_master = True
+
+    def receive_master_messages(self):
+        """
+        Method to handle the messages the master process sent, without waiting for more
+
+        Only the upload loop calls this, so the pipe has a single reader. Pushed credentials are queued for the
+        credential refresher to apply.
+
+        Returns:
+            None
+        """
+        if not self.master_pipe:
+            return
+
+        while self.master_pipe.poll():
+            tag, payload = self.master_pipe.recv()
+            if tag == "credentials":
+                self.pushed_job_info.put(payload)
+            elif tag == "job_done":
+                self.job_done.set()
+
+    def get_pushed_job_info(self):
+        """
+        Method to get the latest job info pushed by the master process
+
+        Returns:
+            (tuple): The master's get_job_info(), or None if nothing new was pushed
+        """
+        latest = None
+        while True:
+            try:
+                latest = self.pushed_job_info.get_nowait()
+            except queue.Empty:
+                return latest
+
+    def renew_credentials(self):
+        """
+        Method to renew credentials before they expire
+
+        An engine with a credential_source uses the job info it returns, if any, instead of joining again.
+
+        Returns:
+            (bool): True if the credentials were renewed
+        """
+        if self.credential_source:
+            job_info = self.credential_source()
+            if job_info is None:
+                return False
+            self.set_job_info(job_info)
+            always_log_info("(pid={}) Credentials refreshed successfully".format(os.getpid()))
+            return True
+
+        if (datetime.datetime.now() - self.credential_create_time).total_seconds() > self.backend.credential_timeout:
+            logging.getLogger('ingest-client').warning(
+                "(pid={}) Credentials are expiring soon, attempting to renew credentials".format(os.getpid()))
+            self.join()
+            always_log_info("(pid={}) Credentials refreshed successfully".format(os.getpid()))
+            return True
+        return False
+
+    def push_credentials(self, workers):
+        """
+        Method to send the current job info and credentials to worker processes
+
+        Args:
+            workers(list((multiprocessing.Process, multiprocessing.Connection))): The worker processes and the master's
+                                                                                end of their pipes
+
+        Returns:
+            None
+        """
+        self.send_to_workers(workers, "credentials", self.get_job_info())
+
+    def send_to_workers(self, workers, tag, payload):
+        """
+        Method to send a message to worker processes
+
+        Args:
+            workers(list((multiprocessing.Process, multiprocessing.Connection))): The worker processes and the master's
+                                                                                end of their pipes
+            tag(str): The message type
+            payload(object): The message contents
+
+        Returns:
+            None
+        """
+        for _, pipe in list(workers):
+            try:
+                pipe.send((tag, payload))
+            except (IOError, OSError, ValueError):
+                # The worker exited and closed its end of the pipe
+                continue
+
     def cancel(self):
         """
         Method to cancel an ingest job
@@ -191,9 +415,35 @@ class Engine(object):
         """
         self.backend.complete(self.ingest_job_id)
 
-    def monitor(self, workers):
+    def monitor(self, workers, exporter=None, supervisor=None):
         """Method to monitor the progress of the ingest job
 
+        Args:
+            workers(list((multiprocessing.Process, multiprocessing.Connection))): The worker processes and the master's
+                                                                                end of their pipes
+            exporter(ingestclient.core.exporter.MetricsExporter): Publishes job and worker metrics, if given
+            supervisor(ingestclient.core.supervisor.WorkerSupervisor): Replaces stalled and crashed workers in
+                                                                       `workers`, if given
+
+        Returns:
+            None
+        """
+        # Workers get their credentials from the master instead of each joining the job
+        self.start_credential_refresher(on_refresh=lambda: self.push_credentials(workers))
+        try:
+            self._monitor(workers, exporter, supervisor)
+        finally:
+            self.stop_credential_refresher()
+
+    def _monitor(self, workers, exporter, supervisor):
+        """Monitor loop
+
+        Args:
+            workers(list((multiprocessing.Process, multiprocessing.Connection))): The worker processes and the master's
+                                                                                end of their pipes
+            exporter(ingestclient.core.exporter.MetricsExporter): Publishes job and worker metrics, if given
+            supervisor(ingestclient.core.supervisor.WorkerSupervisor): Replaces stalled and crashed workers, if given
+
         Returns:
             None
         """
@@ -204,12 +454,26 @@ class Engine(object):
         print_time = time.time()
         avg_tile_rate = 0
         while True:
-            if (datetime.datetime.now() - self.credential_create_time).total_seconds() > self.backend.credential_timeout:
-                logger.warning("(pid={}) Credentials are expiring soon, attempting to renew credentials".format(os.getpid()))
-                self.join()
-                always_log_info("(pid={}) Credentials refreshed successfully".format(os.getpid()))
+            with self.metrics.timer("status"):
+                status = self.backend.get_job_status(self.ingest_job_id)
+            if exporter:
+                exporter.update_job(status)
+                exporter.update_worker("master", self.get_stats(counts=True))
+                exporter.write()
+
+            # Tell idle workers to stop as soon as the queue is drained, instead of letting them wait it out. Tasks
+            # held by lost workers don't show in the status until they are visible again, so wait for those too
+            if not self.job_done.is_set():
+                if (time.time() >= self.hidden_task_deadline and self.is_job_drained(status) and
+                        self.are_workers_idle(workers)):
+                    self.drained_checks += 1
+                else:
+                    self.drained_checks = 0
+                if self.drained_checks >= self.done_confirmations:
+                    always_log_info("No upload tasks left. Stopping worker processes")
+                    self.job_done.set()
+                    self.send_to_workers(workers, "job_done", True)
 
-            status = self.backend.get_job_status(self.ingest_job_id)
             if status:
                 if last_task_count is None:
                     last_task_count = status["current_message_count"]
@@ -223,11 +487,25 @@ class Engine(object):
             if (time.time() - print_time) > 30:
                 print_time = time.time()
                 # Print an update every 30 seconds
+                for pid in self.get_stalled_workers(workers):
+                    progress = self.worker_progress[pid]["progress"]
+                    logger.warning("Worker pid={} has made no progress in {:.0f} seconds (stage: {})".format(
+                        pid, time.time() - self.worker_progress[pid]["advanced"], progress["stage"]))
+
                 if status:
                     if status["current_message_count"] != 0:
-                        log_str = "Uploading ~{:.2f} tiles/min".format(avg_tile_rate * 6)
+                        local_rate = self.get_local_throughput()
+                        if local_rate > 0:
+                            # Workers report exactly what this client uploaded, the queue depth mixes all clients
+                            log_str = "Uploading {:.2f} tiles/min from {} workers".format(local_rate * 60,
+                                                                                       len(self.worker_progress))
+                        else:
+                            log_str = "Uploading ~{:.2f} tiles/min".format(avg_tile_rate * 6)
                         log_str += " - Approx {:d} of {:d} tiles remaining".format(status["current_message_count"],
                                                                                    status["total_message_count"])
+                        if local_rate > 0:
+                            log_str += " - ETA {:.2f} minutes".format(status["current_message_count"] /
+                                                                      local_rate / 60)
                         log_str += " - Elapsed time {:.2f} minutes".format((time.time() - start_time) / 60)
                         always_log_info(log_str)
                     else:
@@ -236,8 +514,10 @@ class Engine(object):
                 else:
                     always_log_info("Uploading in progress: Elapsed time {:.2f} minutes".format((time.time() - start_time) / 60))
 
-            # Wait to loop
-            time.sleep(10)
+            # Collect worker stats while waiting to loop
+            self.receive_worker_messages(workers, 10, exporter)
+            if supervisor:
+                supervisor.check(self, exporter)
 
             # Check to see if worker processes have all ended
             alive_cnt = 0
@@ -249,13 +529,195 @@ class Engine(object):
                 # if no processes are alive you are done (or something broke)! Bail.
                 break
 
-    def run(self):
-        """Method to run the upload loop
+    def receive_worker_messages(self, workers, timeout, exporter=None):
+        """Method to collect the messages worker processes send over their pipes
+
+        Workers send ("progress", Engine.get_progress()) and ("stats", Engine.get_stats(counts=True)) tuples. The
+        latest of each are kept in worker_progress and worker_stats by pid.
+
+        Args:
+            workers(list((multiprocessing.Process, multiprocessing.Connection))): The worker processes and the master's
+                                                                                end of their pipes
+            timeout(float): Seconds to keep collecting messages
+            exporter(ingestclient.core.exporter.MetricsExporter): Updated with each worker's stats, if given
 
         Returns:
+            None
+        """
+        deadline = time.time() + timeout
+        while True:
+            for process, pipe in workers:
+                try:
+                    while pipe.poll():
+                        tag, payload = pipe.recv()
+                        if tag == "progress":
+                            self.update_worker_progress(process.pid, payload)
+                        elif tag == "stats":
+                            self.worker_stats[process.pid] = payload
+                            if exporter:
+                                exporter.update_worker(process.pid, payload)
+                except (EOFError, IOError, OSError):
+                    # The worker exited and closed its end of the pipe
+                    continue
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(1, remaining))
+
+        if exporter:
+            exporter.write()
+
+    def update_worker_progress(self, pid, progress):
+        """Method to record a worker's progress report
+
+        Args:
+            pid(int): The worker's pid
+            progress(dict): The worker's Engine.get_progress()
+
+        Returns:
+            None
+        """
+        now = time.time()
+        previous = self.worker_progress.get(pid)
+        entry = {"progress": progress, "received": now, "advanced": now, "first": progress}
+        if previous:
+            entry["first"] = previous["first"]
+            last = previous["progress"]
+            if (progress["tiles"] == last["tiles"] and progress["errors"] == last["errors"] and
+                    progress.get("processed") == last.get("processed") and progress["stage"] == last["stage"]):
+                entry["advanced"] = previous["advanced"]
+        self.worker_progress[pid] = entry
+
+    def get_local_throughput(self):
+        """Method to compute the upload rate of this client's workers from their progress reports
+
+        Returns:
+            (float): Tiles per second, summed over workers
+        """
+        rate = 0.0
+        for entry in self.worker_progress.values():
+            first = entry["first"]
+            last = entry["progress"]
+            elapsed = last["time"] - first["time"]
+            if elapsed > 0:
+                rate += (last["tiles"] - first["tiles"]) / elapsed
+        return rate
+
+    def are_workers_idle(self, workers):
+        """Method to check if every live worker has reported it is waiting for tasks with none left to finish
+
+        Args:
+            workers(list((multiprocessing.Process, multiprocessing.Connection))): The worker processes and the master's
+                                                                                end of their pipes
+
+        Returns:
+            (bool)
+        """
+        for process, _ in workers:
+            if not process.is_alive():
+                continue
+            entry = self.worker_progress.get(process.pid)
+            if not entry:
+                return False
+            progress = entry["progress"]
+            if (progress["stage"] not in ("wait", "done") or progress["in_progress"] or
+                    progress.get("retry_seconds", 0) > 0):
+                return False
+        return True
+
+    def wait_for_hidden_tasks(self):
+        """Method to hold off deciding the job is done until the tasks of a lost worker are visible again
+
+        A worker that was stopped or died doesn't release the tasks it received, so they stay hidden on the upload
+        queue, and out of the job status, until their visibility timeout runs out.
+
+        Returns:
+            None
+        """
+        self.hidden_task_deadline = max(self.hidden_task_deadline, time.time() + self.backend.visibility_timeout)
+
+    def is_job_drained(self, status):
+        """Method to check if a job status shows no upload tasks left
+
+        Args:
+            status(dict): The backend's get_job_status() response
+
+        Returns:
+            (bool)
+        """
+        if not status:
+            return False
+        if status.get("status") in (2, 3):
+            # Complete or deleted
+            return True
+        return status.get("current_message_count") == 0
+
+    def check_job_done(self):
+        """Method to decide if the upload loop should stop, called while the upload queue is empty
+
+        The job is done once the master process signals it. An engine running on its own checks the job status
+        instead, and stops once done_confirmations checks in a row find no tasks left. Either way it keeps going
+        until the tasks of its own failed uploads are visible again.
+
+        Returns:
+            (bool)
+        """
+        if time.time() < self.retry_deadline:
+            return False
+        if self.job_done.is_set():
+            return True
+        if self.wait_for_master:
+            return False
+
+        try:
+            status = self.backend.get_job_status(self.ingest_job_id)
+        except Exception as e:
+            logging.getLogger('ingest-client').warning("(pid={}) Could not get the job status: {}".format(
+                os.getpid(), e))
+            return False
+
+        if self.is_job_drained(status):
+            self.drained_checks += 1
+        else:
+            self.drained_checks = 0
+        if self.drained_checks >= self.done_confirmations:
+            self.job_done.set()
+        return self.job_done.is_set()
+
+    def get_stalled_workers(self, workers):
+        """Method to find workers that stopped making progress
+
+        A live worker is stalled if it hasn't reported for stall_timeout seconds, or if its tile counts, processed
+        tasks and stage haven't changed for stall_timeout seconds while it isn't waiting for tasks. Workers report
+        after each processed task and queued upload, so a long stage that is still getting through tasks isn't
+        mistaken for a stall.
+
+        Args:
+            workers(list((multiprocessing.Process, multiprocessing.Connection))): The worker processes and the master's
+                                                                                end of their pipes
+
+        Returns:
+            (list(int)): pids of the stalled workers
+        """
+        now = time.time()
+        stalled = []
+        for process, _ in workers:
+            entry = self.worker_progress.get(process.pid)
+            if not entry or not process.is_alive():
+                continue
+            if now - entry["received"] > self.stall_timeout:
+                stalled.append(process.pid)
+            elif entry["progress"]["stage"] != "wait" and now - entry["advanced"] > self.stall_timeout:
+                stalled.append(process.pid)
+        return stalled
+
+    def check_ready(self):
+        """Method to make sure the engine has joined a job that is ready for uploading
 
+        Returns:
+            None
         """
-        # Set up logger
         logger = logging.getLogger('ingest-client')
 
         # Make sure you are joined
@@ -274,69 +736,581 @@ class Engine(object):
             logger.warning(msg)
             raise Exception(msg)
 
-        # Do some work
-        wait_cnt = 0
-        while True:
-            # Check if you need to renew credentials
-            if (datetime.datetime.now() - self.credential_create_time).total_seconds() > self.backend.credential_timeout:
-                logger.warning("(pid={}) Credentials are expiring soon, attempting to renew credentials".format(os.getpid()))
-                self.join()
-                always_log_info("(pid={}) Credentials refreshed successfully".format(os.getpid()))
-
-            # Get a task
-            message_id, receipt_handle, msg = self.backend.get_task()
-
-            if not msg:
-                time.sleep(10)
-                wait_cnt += 1
-                if wait_cnt < self.msg_wait_iterations:
-                    continue
-                else:
-                    break
+    def locate_task(self, msg):
+        """Method to decode an upload task's tile key and run the path processor
 
-            wait_cnt = 0
-            key_parts = self.backend.decode_tile_key(msg['tile_key'])
-            logger.info("(pid={}) Processing Task -  X:{} Y:{} Z:{} T:{}".format(os.getpid(),
-                                                                                 key_parts["x_index"],
-                                                                                 key_parts["y_index"],
-                                                                                 key_parts["z_index"],
-                                                                                 key_parts["t_index"]))
+        Args:
+            msg(dict): The upload task's message contents
+
+        Returns:
+            (dict, str): The decoded tile key and the file path containing the tile
+        """
+        logger = logging.getLogger('ingest-client')
+
+        key_parts = self.backend.decode_tile_key(msg['tile_key'])
+        logger.info("(pid={}) Processing Task -  X:{} Y:{} Z:{} T:{}".format(os.getpid(),
+                                                                             key_parts["x_index"],
+                                                                             key_parts["y_index"],
+                                                                             key_parts["z_index"],
+                                                                             key_parts["t_index"]))
 
-            # Call path processor
+        # Call path processor
+        with self.metrics.timer("path"):
             filename = self.path_processor.process(key_parts["x_index"],
                                                    key_parts["y_index"],
                                                    key_parts["z_index"],
                                                    key_parts["t_index"])
 
-            # Call tile processor
-            handle = self.tile_processor.process(filename,
-                                                 key_parts["x_index"],
-                                                 key_parts["y_index"],
-                                                 key_parts["z_index"],
-                                                 key_parts["t_index"])
+        return key_parts, filename
+
+    def prepare_upload(self, message_id, receipt_handle, msg, handle):
+        """Method to size a processed tile and build its object metadata
+
+        Args:
+            message_id(str): The upload task's message ID
+            receipt_handle(str): The upload task's receipt handle
+            msg(dict): The upload task's message contents
+            handle(TileBuffer|file-like): The tile returned by the tile processor
+
+        Returns:
+            (TileBuffer, int, dict): The tile, the size of the tile data and the object metadata for the upload
+        """
+        metadata = {'chunk_key': msg['chunk_key'],
+                    'ingest_job': self.ingest_job_id,
+                    'parameters': self.job_params,
+                    }
+        # Tile processors that still return file handles are wrapped without copying BytesIO contents
+        tile = TileBuffer.from_handle(handle)
+
+        return tile, tile.num_bytes, {'message_id': message_id,
+                                   'receipt_handle': receipt_handle,
+                                   'metadata': json.dumps(metadata, separators=(',', ':'))}
+
+    def process_task(self, message_id, receipt_handle, msg):
+        """Method to run the path and tile processors for an upload task
+
+        Args:
+            message_id(str): The upload task's message ID
+            receipt_handle(str): The upload task's receipt handle
+            msg(dict): The upload task's message contents
+
+        Returns:
+            (dict, TileBuffer, int, dict): The decoded tile key, the tile data,
+                                          the size of the tile data and the object metadata for the upload
+        """
+        key_parts, filename = self.locate_task(msg)
+
+        # Call tile processor
+        start_time = time.time()
+        encode_seconds = self.metrics.thread_seconds("encode")
+        handle = self.tile_processor.process(filename,
+                                             key_parts["x_index"],
+                                             key_parts["y_index"],
+                                             key_parts["z_index"],
+                                             key_parts["t_index"])
+        self.metrics.observe("read", time.time() - start_time - (self.metrics.thread_seconds("encode") -
+                                                                 encode_seconds))
+
+        handle, num_bytes, upload_metadata = self.prepare_upload(message_id, receipt_handle, msg, handle)
+        return key_parts, handle, num_bytes, upload_metadata
+
+    def process_tasks(self, tasks):
+        """Method to run the path and tile processors for several upload tasks, one at a time
+
+        Args:
+            tasks(list((str, str, dict))): message_id, receipt_handle, message contents of each task
 
+        Returns:
+            (list((str, str, dict, dict, TileBuffer, int, dict)), list(UploadResult)): For each processed task, the
+                message_id, receipt_handle, message contents, then the same values returned by process_task(). Then
+                the failed results of tasks that couldn't be processed
+        """
+        processed = []
+        failed = []
+        for task in tasks:
+            start_time = time.time()
             try:
-                metadata = {'chunk_key': msg['chunk_key'],
-                            'ingest_job': self.ingest_job_id,
-                            'parameters': self.job_params,
-                            }
-                handle.seek(0)
-                response = self.backend.bucket.put_object(ACL='private',
-                                                          Body=handle,
-                                                          Key=msg['tile_key'],
-                                                          Metadata={
-                                                              'message_id': message_id,
-                                                              'receipt_handle': receipt_handle,
-                                                              'metadata': json.dumps(metadata, separators=(',', ':'))
-                                                          },
-                                                          StorageClass='STANDARD')
-                logger.info("(pid={}) Successfully wrote file: {}".format(os.getpid(), response.key))
+                processed.append(task + self.process_task(*task))
+            except Exception as e:
+                failed.append(self.get_failed_task_result(task, e, time.time() - start_time))
+            self.tasks_processed += 1
+            self.report_stats()
+
+        return processed, failed
+
+    def process_tasks_by_source(self, tasks):
+        """Method to run the path and tile processors for several upload tasks, reading each source file once
 
+        Tasks are grouped by the file the path processor resolves them to, and each group is ordered by chunk key
+        so tiles of the same cuboid are uploaded together. Each group is handed to the tile processor's
+        process_batch() in a single call, so if it fails every task of the group fails.
+
+        Args:
+            tasks(list((str, str, dict))): message_id, receipt_handle, message contents of each task
+
+        Returns:
+            (list((str, str, dict, dict, TileBuffer, int, dict)), list(UploadResult)): For each processed task, the
+                message_id, receipt_handle, message contents, then the same values returned by process_task(). Then
+                the failed results of tasks that couldn't be processed
+        """
+        groups = OrderedDict()
+        failed = []
+        for task in tasks:
+            try:
+                key_parts, filename = self.locate_task(task[2])
+            except Exception as e:
+                failed.append(self.get_failed_task_result(task, e))
+                self.tasks_processed += 1
+                continue
+            groups.setdefault(filename, []).append(task + (key_parts,))
+
+        results = []
+        for filename, group in groups.items():
+            group.sort(key=lambda task: task[2]['chunk_key'])
+            start_time = time.time()
+            encode_seconds = self.metrics.thread_seconds("encode")
+            try:
+                handles = self.tile_processor.process_batch(filename, [(key_parts["x_index"],
+                                                                        key_parts["y_index"],
+                                                                        key_parts["z_index"],
+                                                                        key_parts["t_index"])
+                                                                       for _, _, _, key_parts in group])
             except Exception as e:
-                logger.error("(pid={}) Upload Failed -  X:{} Y:{} Z:{} T:{} - {}".format(os.getpid(),
-                                                                                         key_parts["x_index"],
-                                                                                         key_parts["y_index"],
-                                                                                         key_parts["z_index"],
-                                                                                         key_parts["t_index"],
-                                                                                         e))
+                duration = time.time() - start_time
+                failed.extend(self.get_failed_task_result(task[:3], e, duration / len(group)) for task in group)
+                self.tasks_processed += len(group)
+                self.report_stats()
+                continue
+
+            # The source is read once for the whole group, so each tile is charged an equal share
+            read_seconds = time.time() - start_time - (self.metrics.thread_seconds("encode") - encode_seconds)
+            for _ in group:
+                self.metrics.observe("read", read_seconds / len(group))
+
+            for (message_id, receipt_handle, msg, key_parts), handle in zip(group, handles):
+                handle, num_bytes, upload_metadata = self.prepare_upload(message_id, receipt_handle, msg, handle)
+                results.append((message_id, receipt_handle, msg, key_parts, handle, num_bytes, upload_metadata))
+            self.tasks_processed += len(group)
+            self.report_stats()
+
+        return results, failed
+
+    def get_failed_task_result(self, task, error, duration=0):
+        """Method to turn a task that couldn't be processed, e.g. an unreadable tile, into a failed upload
+
+        Called from the except block, so the error is logged with its traceback. Handing the result to
+        _handle_upload_results() counts the error, records it in the failure journal and releases the task after
+        get_failed_task_delay(), so the upload loop keeps going and the tile is retried later.
+
+        Args:
+            task((str, str, dict)): The message_id, receipt_handle and message contents of the task
+            error(Exception): The error
+            duration(float): Seconds spent on the task
+
+        Returns:
+            (ingestclient.core.upload.UploadResult)
+        """
+        message_id, receipt_handle, msg = task
+        logging.getLogger('ingest-client').error("(pid={}) Failed to process task {}".format(os.getpid(),
+                                                                                          msg['tile_key']),
+                                                 exc_info=True)
+        try:
+            key_parts = self.backend.decode_tile_key(msg['tile_key'])
+        except Exception:
+            key_parts = None
+        return UploadResult((msg['tile_key'], key_parts, receipt_handle), None, error, duration, 0, 1)
+
+    def run(self):
+        """Method to run the upload loop
+
+        Returns:
+
+        """
+        # Make sure you are joined
+        self.check_ready()
+
+        # Do some work
+        wait_cnt = 0
+        controller = None
+        if self.adaptive_concurrency:
+            # Start enough threads for the upper bound and let the controller decide how many upload at once
+            executor = UploadExecutor(self.backend.put_tile, max(self.max_upload_threads, self.upload_threads),
+                                      self.max_upload_bytes_in_flight, self.get_retry_policy())
+            executor.set_max_active(self.upload_threads)
+            controller = AimdController(executor)
+        else:
+            executor = UploadExecutor(self.backend.put_tile, self.upload_threads, self.max_upload_bytes_in_flight,
+                                      self.get_retry_policy())
+        executor.start()
+        self.executor = executor
+        self.open_journal()
+        self.open_ledger()
+        self.start_heartbeat()
+        self.start_credential_refresher()
+        try:
+            while True:
+                self.receive_master_messages()
+
+                # Get tasks
+                self.set_stage("receive")
+                receive_start = time.time()
+                with self.metrics.timer("receive"):
+                    if self.schedule_by_source:
+                        tasks = self.backend.get_task_batch(self.schedule_batch_size, self.task_prefetch)
+                    else:
+                        task = self.backend.get_task(self.task_prefetch)
+                        tasks = [task] if task[2] else []
+
+                if not tasks:
+                    # Let outstanding uploads finish while waiting for more tasks
+                    self.set_stage("wait")
+                    self._handle_upload_results(executor.wait(), controller)
+                    self.report_stats()
+                    wait_cnt += 1
+                    if self.check_job_done() or wait_cnt >= self.msg_wait_iterations:
+                        break
+
+                    # A long poll already waited for tasks, so only wait out the rest of the interval
+                    time.sleep(max(0, self.idle_poll_interval - (time.time() - receive_start)))
+                    continue
 
+                wait_cnt = 0
+                self.drained_checks = 0
+                tasks = self.skip_completed_tasks(tasks)
+                if not tasks:
+                    continue
+                self.begin_tasks(tasks)
+
+                self.set_stage("process")
+                if self.schedule_by_source:
+                    processed, failed = self.process_tasks_by_source(tasks)
+                else:
+                    processed, failed = self.process_tasks(tasks)
+                # Tasks that couldn't be processed are released to be retried later, without stopping the loop
+                self._handle_upload_results(failed)
+
+                self.set_stage("upload")
+                for message_id, receipt_handle, msg, key_parts, handle, num_bytes, upload_metadata in processed:
+                    # Queue the upload, blocking while too many bytes are already in flight
+                    executor.submit((msg['tile_key'], key_parts, receipt_handle), num_bytes,
+                                    msg['tile_key'], handle, upload_metadata)
+                    # Record uploads as they finish so a stage held up by the byte budget still shows progress
+                    self._handle_upload_results(executor.completed(), controller)
+                    self.report_stats()
+
+                self._handle_upload_results(executor.completed(), controller)
+                self.log_stats()
+                self.report_stats()
+        finally:
+            # Finish in-flight uploads, then hand any prefetched tasks back to the queue so other clients don't
+            # wait out their visibility timeout
+            self._handle_upload_results(executor.wait(), controller)
+            executor.shutdown()
+            self.stop_credential_refresher()
+            self.stop_heartbeat()
+            self.release_in_progress()
+            self.backend.release_buffered_tasks()
+            self.close_ledger()
+            self.executor = None
+            self.set_stage("done")
+            self.log_stats(force=True)
+            self.report_stats(force=True)
+
+    def get_stats(self, counts=False):
+        """Method to get the engine's throughput and per-stage latency metrics
+
+        Args:
+            counts(bool): Include the bucket counts of each stage histogram
+
+        Returns:
+            (dict): "uptime" in seconds, "counters" of tiles, errors, bytes_in (raw tile data) and bytes_out
+                    (uploaded), and for each stage the count, sum, mean, max, p50, p95 and p99 in seconds.
+                    "gauges" holds the tasks in progress and uploads in flight, and "cache" the slice cache
+                    counters if the tile processor has one
+        """
+        stats = self.metrics.snapshot(counts)
+        stats["pid"] = os.getpid()
+        stats["gauges"] = {"in_progress": len(self.in_progress),
+                           "uploads_in_flight": self.executor.num_in_flight if self.executor else 0}
+
+        slice_cache = getattr(self.tile_processor, "slice_cache", None)
+        if slice_cache is not None:
+            stats["cache"] = slice_cache.stats()
+        return stats
+
+    def get_progress(self):
+        """Method to get a compact summary of the engine's progress
+
+        Returns:
+            (dict): pid, the "time" of the summary, "tiles", "errors" and "bytes_out" so far, tasks "in_progress",
+                    tasks "processed" so far, "retry_seconds" until released failed tasks are visible again, the current "stage" and the
+                    "stage_seconds" spent in it
+        """
+        counters = self.metrics.snapshot()["counters"]
+        now = time.time()
+        return {"pid": os.getpid(),
+                "time": now,
+                "tiles": counters["tiles"],
+                "errors": counters["errors"],
+                "bytes_out": counters["bytes_out"],
+                "in_progress": len(self.in_progress),
+                "processed": self.tasks_processed,
+                "retry_seconds": max(0, self.retry_deadline - now),
+                "stage": self.stage,
+                "stage_seconds": now - self.stage_start}
+
+    def set_stage(self, stage):
+        """Method to record what the upload loop is doing, as reported in get_progress()
+
+        Args:
+            stage(str): e.g. receive, process, upload or wait
+
+        Returns:
+            None
+        """
+        if stage != self.stage:
+            self.stage = stage
+            self.stage_start = time.time()
+
+    def report_stats(self, force=False):
+        """Method to send progress and metrics to stats_reporter
+
+        ("progress", get_progress()) is sent every progress_report_interval seconds and
+        ("stats", get_stats(counts=True)) every stats_report_interval seconds.
+
+        Args:
+            force(bool): Report both now, even if their intervals haven't passed
+
+        Returns:
+            None
+        """
+        if not self.stats_reporter:
+            return
+
+        now = time.time()
+        if force or now - self.last_progress_report >= self.progress_report_interval:
+            self.last_progress_report = now
+            self.stats_reporter("progress", self.get_progress())
+        if force or now - self.last_stats_report >= self.stats_report_interval:
+            self.last_stats_report = now
+            self.stats_reporter("stats", self.get_stats(counts=True))
+
+    def log_stats(self, force=False):
+        """Method to log a summary of the engine metrics every stats_log_interval seconds
+
+        Args:
+            force(bool): Log now, even if disabled or the interval hasn't passed
+
+        Returns:
+            None
+        """
+        now = time.time()
+        if force or (self.stats_log_interval and now - self.last_stats_log >= self.stats_log_interval):
+            self.last_stats_log = now
+            always_log_info("(pid={}) {}".format(os.getpid(), self.metrics.summary()))
+
+    def open_ledger(self):
+        """Method to open the upload ledger, if one is configured and it isn't open yet
+
+        Returns:
+            None
+        """
+        if self.ledger_path and not self.ledger:
+            self.ledger = UploadLedger(self.ledger_path)
+
+    def open_journal(self):
+        """Method to start recording failed tiles in the failure journal, if one is configured
+
+        Returns:
+            None
+        """
+        if self.failure_journal and not self.journal:
+            self.journal = FailureJournal(self.failure_journal)
+
+    def close_ledger(self):
+        """Method to close the upload ledger, if it is open
+
+        Returns:
+            None
+        """
+        if self.ledger:
+            self.ledger.close()
+            self.ledger = None
+
+    def skip_completed_tasks(self, tasks):
+        """Method to drop tasks whose tile the ledger records as already uploaded
+
+        The tasks of completed tiles are deleted from the upload queue, as the tile's earlier upload would have done.
+
+        Args:
+            tasks(list((str, str, dict))): The message_id, receipt_handle and message of each task
+
+        Returns:
+            (list((str, str, dict))): The tasks that still need to be uploaded
+        """
+        if not self.ledger:
+            return tasks
+
+        remaining = []
+        completed = []
+        for task in tasks:
+            if self.ledger.is_uploaded(self.ingest_job_id, task[2]['tile_key'], self.backend.get_identity()):
+                completed.append(task[1])
+            else:
+                remaining.append(task)
+
+        if completed:
+            always_log_info("(pid={}) Skipping {} tiles already in the upload ledger".format(os.getpid(),
+                                                                                           len(completed)))
+            self.backend.delete_tasks(completed)
+
+        return remaining
+
+    def begin_tasks(self, tasks):
+        """Method to record that received tasks are being worked on
+
+        Args:
+            tasks(list((str, str, dict))): The message_id, receipt_handle and message of each task
+
+        Returns:
+            None
+        """
+        for task in tasks:
+            self.in_progress.add(task[1])
+            if self.heartbeat:
+                self.heartbeat.track(task[1])
+
+    def release_in_progress(self):
+        """Method to make tasks that were received but never finished uploading visible on the queue again
+
+        Called when the upload loop stops, e.g. when interrupted, so other clients can pick the tasks up right away
+        instead of waiting out their visibility timeout.
+
+        Returns:
+            None
+        """
+        if not self.in_progress:
+            return
+
+        logger = logging.getLogger('ingest-client')
+        logger.warning("(pid={}) Releasing {} unfinished tasks".format(os.getpid(), len(self.in_progress)))
+        self.backend.change_task_visibility(list(self.in_progress), 0)
+        self.in_progress.clear()
+
+    def start_heartbeat(self):
+        """Method to start keeping in-progress tasks hidden on the upload queue, if enabled
+
+        Returns:
+            None
+        """
+        if self.visibility_heartbeat:
+            self.heartbeat = VisibilityHeartbeat(self.backend, self.heartbeat_interval)
+            self.heartbeat.start()
+
+    def stop_heartbeat(self):
+        """Method to stop the visibility heartbeat
+
+        Returns:
+            None
+        """
+        if self.heartbeat:
+            self.heartbeat.stop()
+            self.heartbeat = None
+
+    def start_credential_refresher(self, on_refresh=None):
+        """Method to start renewing credentials in the background
+
+        Args:
+            on_refresh(callable): Called without arguments after each renewal, if given
+
+        Returns:
+            None
+        """
+        self.credential_refresher = CredentialRefresher(self, self.credential_refresh_interval, on_refresh)
+        self.credential_refresher.start()
+
+    def stop_credential_refresher(self):
+        """Method to stop renewing credentials in the background
+
+        Returns:
+            None
+        """
+        if self.credential_refresher:
+            self.credential_refresher.stop()
+            self.credential_refresher = None
+
+    def _handle_upload_results(self, results, controller=None):
+        """Method to log the outcome of finished uploads
+
+        Args:
+            results(list(ingestclient.core.upload.UploadResult)): The finished uploads
+            controller(ingestclient.core.upload.AimdController): Controller to adapt upload concurrency, if enabled
+
+        Returns:
+            None
+        """
+        if controller:
+            controller.update(results)
+
+        logger = logging.getLogger('ingest-client')
+        failed = {}
+        entries = []
+        for result in results:
+            tile_key, key_parts, receipt_handle = result.context
+            self.metrics.observe("upload", result.duration)
+            self.in_progress.discard(receipt_handle)
+            if self.heartbeat:
+                self.heartbeat.untrack(receipt_handle)
+
+            if result.error is None:
+                self.failure_counts.pop(tile_key, None)
+                self.metrics.increment("tiles")
+                self.metrics.increment("bytes_out", result.num_bytes)
+                logger.info("(pid={}) Successfully wrote file: {}".format(os.getpid(), tile_key))
+                etag = result.response.get("ETag") if isinstance(result.response, dict) else None
+                entries.append((tile_key, UPLOADED, etag, result.num_bytes, result.duration, result.attempts))
+            else:
+                if key_parts is None:
+                    # The tile key couldn't be decoded
+                    logger.error("(pid={}) Upload Failed - {} - {}".format(os.getpid(), tile_key, result.error))
+                else:
+                    logger.error("(pid={}) Upload Failed -  X:{} Y:{} Z:{} T:{} - {}".format(os.getpid(),
+                                                                                             key_parts["x_index"],
+                                                                                             key_parts["y_index"],
+                                                                                             key_parts["z_index"],
+                                                                                             key_parts["t_index"],
+                                                                                             result.error))
+                self.metrics.increment("errors")
+                if self.journal and key_parts is not None:
+                    self.journal.record(tile_key, key_parts, result.error, result.attempts)
+                entries.append((tile_key, FAILED, None, result.num_bytes, result.duration, result.attempts))
+                failed.setdefault(self.get_failed_task_delay(tile_key), []).append(receipt_handle)
+
+        if self.ledger:
+            self.ledger.record(self.ingest_job_id, entries, self.backend.get_identity())
+
+        # Make failed tasks visible again after a backoff instead of the queue's full visibility timeout
+        for delay, receipt_handles in failed.items():
+            self.backend.change_task_visibility(receipt_handles, delay)
+            self.retry_deadline = max(self.retry_deadline, time.time() + delay)
+
+    def get_retry_policy(self):
+        """Method to create the retry policy for uploads
+
+        Returns:
+            (ingestclient.core.upload.RetryPolicy)
+        """
+        return RetryPolicy(self.upload_attempts, self.retry_base_delay, self.retry_max_delay)
+
+    def get_failed_task_delay(self, tile_key):
+        """Method to count a failed upload and compute how long its task should stay hidden
+
+        Args:
+            tile_key(str): The tile key of the failed upload
+
+        Returns:
+            (int): The delay in seconds, doubling with each failure of the same tile up to max_failed_task_delay
+        """
+        failures = self.failure_counts.get(tile_key, 0) + 1
+        self.failure_counts[tile_key] = failures
+        return int(min(self.failed_task_delay * 2 ** (failures - 1), self.max_failed_task_delay))
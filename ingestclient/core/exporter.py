@@ -0,0 +1,229 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from six.moves import BaseHTTPServer
+from collections import OrderedDict
+import logging
+import os
+import socket
+import threading
+import time
+
+from .metrics import BUCKETS
+
+
+class MetricsExporter(object):
+    def __init__(self, file_path=None, port=None, host="127.0.0.1"):
+        """
+        A class to publish the metrics of the master and worker processes in the Prometheus text format
+
+        Metrics can be written to a file, e.g. for the node exporter's textfile collector, and/or served over HTTP
+        at http://<host>:<port>/metrics.
+
+        Args:
+            file_path(str): File to write the metrics to on each update. None to not write a file
+            port(int): Port to serve the metrics on. None to not serve them
+            host(str): Address to serve the metrics on
+        """
+        self.file_path = file_path
+        self.port = port
+        self.host = host
+
+        self.workers = OrderedDict()
+        self.job_status = None
+        self.hostname = socket.gethostname()
+
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Method to start serving metrics over HTTP, if a port was given
+
+        Returns:
+            None
+        """
+        if self.port is None:
+            return
+
+        exporter = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.getLogger('ingest-client').debug("Metrics request: " + format % args)
+
+        self._server = BaseHTTPServer.HTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Method to stop serving metrics
+
+        Returns:
+            None
+        """
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
+
+    def update_worker(self, worker, stats):
+        """Method to record the latest metrics of a worker
+
+        Args:
+            worker(str): Identifies the worker, e.g. its pid, or "master" for the master process
+            stats(dict): The worker's Engine.get_stats(counts=True)
+
+        Returns:
+            None
+        """
+        now = time.time()
+        with self._lock:
+            previous = self.workers.get(str(worker))
+            rates = {"tiles": 0.0, "bytes_out": 0.0}
+            if previous:
+                elapsed = stats["uptime"] - previous["stats"]["uptime"]
+                if elapsed > 0:
+                    for counter in rates:
+                        rates[counter] = (stats["counters"][counter] -
+                                          previous["stats"]["counters"][counter]) / elapsed
+            self.workers[str(worker)] = {"stats": stats, "rates": rates, "time": now}
+
+    def forget(self, worker):
+        """Method to stop publishing the metrics of a worker, e.g. once it was replaced
+
+        Args:
+            worker(str): Identifies the worker, e.g. its pid
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.workers.pop(str(worker), None)
+
+    def update_job(self, status):
+        """Method to record the latest job status
+
+        Args:
+            status(dict): The backend's get_job_status() response
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.job_status = status
+
+    def write(self):
+        """Method to write the metrics file, if configured, replacing it atomically
+
+        Returns:
+            None
+        """
+        if not self.file_path:
+            return
+
+        tmp_path = "{}.{}".format(self.file_path, os.getpid())
+        with open(tmp_path, 'wt') as metrics_file:
+            metrics_file.write(self.render())
+        os.rename(tmp_path, self.file_path)
+
+    def render(self):
+        """Method to format the metrics in the Prometheus text format
+
+        Returns:
+            (str)
+        """
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for labels, value in samples:
+                label_str = ",".join('{}="{}"'.format(key, val) for key, val in labels)
+                lines.append("{}{{{}}} {}".format(name, label_str, repr(float(value))))
+
+        with self._lock:
+            workers = [(("host", self.hostname), ("worker", worker)) for worker in self.workers]
+            entries = list(self.workers.values())
+            job_status = self.job_status
+
+        if job_status:
+            host = (("host", self.hostname),)
+            metric("ingest_job_tiles_remaining", "gauge", "Upload tasks left on the queue, from all clients",
+                   [(host, job_status.get("current_message_count", 0))])
+            metric("ingest_job_tiles_total", "gauge", "Upload tasks in the ingest job",
+                   [(host, job_status.get("total_message_count", 0))])
+
+        for counter, help_text in [("tiles", "Tiles uploaded"),
+                                   ("errors", "Uploads that failed after all retries"),
+                                   ("bytes_in", "Raw tile bytes encoded"),
+                                   ("bytes_out", "Encoded tile bytes uploaded")]:
+            metric("ingest_worker_{}_total".format(counter), "counter", help_text,
+                   [(labels, entry["stats"]["counters"].get(counter, 0)) for labels, entry in zip(workers, entries)])
+
+        metric("ingest_worker_tiles_per_second", "gauge", "Tiles uploaded per second since the last report",
+               [(labels, entry["rates"]["tiles"]) for labels, entry in zip(workers, entries)])
+        metric("ingest_worker_bytes_per_second", "gauge", "Bytes uploaded per second since the last report",
+               [(labels, entry["rates"]["bytes_out"]) for labels, entry in zip(workers, entries)])
+        metric("ingest_worker_uploads_in_flight", "gauge", "Uploads submitted but not finished",
+               [(labels, entry["stats"].get("gauges", {}).get("uploads_in_flight", 0))
+                for labels, entry in zip(workers, entries)])
+        metric("ingest_worker_tasks_in_progress", "gauge", "Received tasks not yet finished",
+               [(labels, entry["stats"].get("gauges", {}).get("in_progress", 0))
+                for labels, entry in zip(workers, entries)])
+
+        cache_samples = {"hits": [], "misses": []}
+        for labels, entry in zip(workers, entries):
+            cache = entry["stats"].get("cache")
+            if cache:
+                for counter in cache_samples:
+                    cache_samples[counter].append((labels, cache[counter]))
+        if cache_samples["hits"]:
+            metric("ingest_worker_slice_cache_hits_total", "counter", "Decoded slice cache hits",
+                   cache_samples["hits"])
+            metric("ingest_worker_slice_cache_misses_total", "counter", "Decoded slice cache misses",
+                   cache_samples["misses"])
+
+        lines.append("# HELP ingest_worker_stage_seconds Time spent per tile in each stage")
+        lines.append("# TYPE ingest_worker_stage_seconds histogram")
+        for labels, entry in zip(workers, entries):
+            for stage, summary in entry["stats"]["stages"].items():
+                stage_labels = labels + (("stage", stage),)
+                label_str = ",".join('{}="{}"'.format(key, val) for key, val in stage_labels)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, summary.get("counts", [])):
+                    cumulative += count
+                    lines.append('ingest_worker_stage_seconds_bucket{{{},le="{:.6g}"}} {}'.format(label_str, bound,
+                                                                                               cumulative))
+                lines.append('ingest_worker_stage_seconds_bucket{{{},le="+Inf"}} {}'.format(label_str,
+                                                                                         summary["count"]))
+                lines.append("ingest_worker_stage_seconds_sum{{{}}} {}".format(label_str, repr(float(summary["sum"]))))
+                lines.append("ingest_worker_stage_seconds_count{{{}}} {}".format(label_str, summary["count"]))
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,131 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import os
+import threading
+import time
+
+
+class VisibilityHeartbeat(object):
+    def __init__(self, backend, interval=10):
+        """
+        A class to keep upload tasks hidden on the upload queue while they are being worked on
+
+        A background thread wakes every `interval` seconds and, in batched requests, extends the visibility timeout
+        of every tracked task that could become visible again before the next two wake-ups. The backend makes the
+        requests with the heartbeat thread's own SQS client rather than the upload loop's.
+
+        Tasks are handed out by the backend with at least backend.get_visibility_margin() seconds of visibility
+        left, so that is assumed when a task starts being tracked.
+
+        Args:
+            backend(ingestclient.core.backend.Backend): The backend that owns the upload queue
+            interval(float): Seconds between heartbeats
+        """
+        self.backend = backend
+        self.interval = interval
+        self.extensions = 0
+
+        self._deadlines = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Method to start the heartbeat thread
+
+        Returns:
+            None
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Method to stop the heartbeat thread and forget all tracked tasks
+
+        Returns:
+            None
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._deadlines.clear()
+
+    def track(self, receipt_handle):
+        """Method to start keeping a task hidden
+
+        Args:
+            receipt_handle(str): The task's receipt handle
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._deadlines[receipt_handle] = time.time() + self.backend.get_visibility_margin()
+
+    def untrack(self, receipt_handle):
+        """Method to stop keeping a task hidden, once it is finished with
+
+        Args:
+            receipt_handle(str): The task's receipt handle
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._deadlines.pop(receipt_handle, None)
+
+    def beat(self):
+        """Method to extend the visibility of tracked tasks that are close to becoming visible
+
+        Returns:
+            (int): The number of tasks extended
+        """
+        now = time.time()
+        with self._lock:
+            due = [handle for handle, deadline in self._deadlines.items() if deadline - now <= 2 * self.interval]
+        if not due:
+            return 0
+
+        timeout = self.backend.visibility_timeout
+        failed = set(self.backend.change_task_visibility(due, timeout))
+        if failed:
+            # Typically the task was already deleted after its upload. Either way it can't be kept hidden
+            logging.getLogger('ingest-client').warning("(pid={}) Could not extend visibility of {} tasks".format(
+                os.getpid(), len(failed)))
+
+        with self._lock:
+            for handle in due:
+                if handle not in self._deadlines:
+                    continue
+                if handle in failed:
+                    del self._deadlines[handle]
+                else:
+                    self._deadlines[handle] = now + timeout
+
+        self.extensions += len(due) - len(failed)
+        return len(due) - len(failed)
+
+    def _run(self):
+        """Heartbeat thread main loop"""
+        while not self._stop.wait(self.interval):
+            try:
+                self.beat()
+            except Exception as e:
+                logging.getLogger('ingest-client').warning("(pid={}) Visibility heartbeat failed: {}".format(
+                    os.getpid(), e))
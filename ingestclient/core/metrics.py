@@ -0,0 +1,228 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from collections import OrderedDict
+from contextlib import contextmanager
+import bisect
+import threading
+import time
+
+
+# Upper bounds of the latency buckets in seconds, from 1 ms to about 17 minutes in steps of 2^(1/4)
+BUCKETS = tuple(0.001 * 2 ** (idx / 4.0) for idx in range(81))
+
+# Stages of a tile's trip through the engine. "read" is the tile processor's time outside the encoder, which
+# covers reading and decoding the source data
+STAGES = ("receive", "path", "read", "encode", "upload")
+
+COUNTERS = ("tiles", "errors", "bytes_in", "bytes_out")
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        """
+        A fixed-bucket histogram of durations
+
+        Percentiles are estimated as the upper bound of the bucket they fall in, so they are at most 19% high.
+
+        Args:
+            buckets(tuple(float)): Ascending bucket upper bounds. Larger values go into an overflow bucket
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """Method to add a value
+
+        Args:
+            value(float): The value
+
+        Returns:
+            None
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """Method to add the values of another histogram with the same buckets
+
+        Args:
+            other(Histogram): The histogram to add
+
+        Returns:
+            None
+        """
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction):
+        """Method to estimate a percentile
+
+        Args:
+            fraction(float): The percentile as a fraction, e.g. 0.95
+
+        Returns:
+            (float): The estimate, or 0 if the histogram is empty
+        """
+        if not self.count:
+            return 0.0
+
+        rank = fraction * self.count
+        cumulative = 0
+        for idx, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                if idx == len(self.buckets):
+                    return self.max
+                return min(self.buckets[idx], self.max)
+        return self.max
+
+    def to_dict(self, counts=False):
+        """Method to summarize the histogram
+
+        Args:
+            counts(bool): Include the per-bucket "counts", e.g. to export or merge the histogram elsewhere
+
+        Returns:
+            (dict): count, sum, mean, max, p50, p95 and p99
+        """
+        summary = {"count": self.count,
+                   "sum": self.total,
+                   "mean": self.total / self.count if self.count else 0.0,
+                   "max": self.max,
+                   "p50": self.percentile(0.5),
+                   "p95": self.percentile(0.95),
+                   "p99": self.percentile(0.99)}
+        if counts:
+            summary["counts"] = list(self.counts)
+        return summary
+
+
+class EngineMetrics(object):
+    def __init__(self):
+        """
+        A class to collect the per-stage latencies and byte counts of an upload engine
+
+        Safe to update from the engine's processing and upload threads.
+        """
+        self.start_time = time.time()
+        self.stages = OrderedDict((stage, Histogram()) for stage in STAGES)
+        self.counters = OrderedDict((counter, 0) for counter in COUNTERS)
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, stage, seconds):
+        """Method to record the duration of a stage
+
+        Args:
+            stage(str): The stage name
+            seconds(float): The duration
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].observe(seconds)
+
+        totals = self._thread_totals()
+        totals[stage] = totals.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, stage):
+        """Context manager to record the duration of a block as a stage
+
+        Args:
+            stage(str): The stage name
+        """
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.time() - start_time)
+
+    def thread_seconds(self, stage):
+        """Method to get the time the calling thread has spent in a stage
+
+        Lets a caller subtract a nested stage, like encoding within tile processing, from the time of the call.
+
+        Args:
+            stage(str): The stage name
+
+        Returns:
+            (float): Seconds since the metrics were created
+        """
+        return self._thread_totals().get(stage, 0.0)
+
+    def increment(self, counter, value=1):
+        """Method to add to a counter
+
+        Args:
+            counter(str): The counter name
+            value(int): The amount to add
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def snapshot(self, counts=False):
+        """Method to get the current metrics
+
+        Args:
+            counts(bool): Include the bucket counts of each histogram
+
+        Returns:
+            (dict): "uptime" in seconds, "counters" and a summary of each stage's histogram in "stages"
+        """
+        with self._lock:
+            return {"uptime": time.time() - self.start_time,
+                    "counters": dict(self.counters),
+                    "stages": OrderedDict((stage, histogram.to_dict(counts))
+                                          for stage, histogram in self.stages.items())}
+
+    def summary(self):
+        """Method to format the metrics as a single log line
+
+        Returns:
+            (str)
+        """
+        stats = self.snapshot()
+        counters = stats["counters"]
+        uptime = max(stats["uptime"], 1e-9)
+        parts = ["{} tiles ({:.2f}/s), {} errors, {:.1f} MB in, {:.1f} MB out ({:.2f} MB/s)".format(
+            counters["tiles"], counters["tiles"] / uptime, counters["errors"], counters["bytes_in"] / 1024.0 / 1024,
+            counters["bytes_out"] / 1024.0 / 1024, counters["bytes_out"] / 1024.0 / 1024 / uptime)]
+        for stage, summary in stats["stages"].items():
+            if summary["count"]:
+                parts.append("{} p50/p95/p99 {:.0f}/{:.0f}/{:.0f} ms".format(stage, summary["p50"] * 1000,
+                                                                             summary["p95"] * 1000,
+                                                                             summary["p99"] * 1000))
+        return " - ".join(parts)
+
+    def _thread_totals(self):
+        """Method to get the calling thread's time per stage"""
+        totals = getattr(self._local, "totals", None)
+        if totals is None:
+            totals = self._local.totals = {}
+        return totals
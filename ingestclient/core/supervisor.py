@@ -0,0 +1,173 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import os
+import signal
+import time
+
+from ..utils.log import always_log_info
+
+
+class WorkerSupervisor(object):
+    def __init__(self, start_worker, workers, stall_timeout=300, max_restarts=10):
+        """
+        A class to replace worker processes that hang or crash
+
+        A worker is replaced if it is stalled, as judged by Engine.get_stalled_workers(), or if it never reports
+        progress within stall_timeout seconds of starting. Workers that exit with a non-zero exit code are
+        restarted, unless the job is over, e.g. completed or cancelled, which also makes workers exit with an
+        error. Workers that exit cleanly have run out of tasks and are left alone. No workers are replaced once the
+        master has signalled the job is done. Tasks held by a killed or crashed worker become visible again once
+        their visibility timeout runs out, and the master doesn't consider the job done before then.
+
+        Args:
+            start_worker(callable): Called without arguments to start a worker, returning its
+                                    (multiprocessing.Process, multiprocessing.Connection)
+            workers(list((multiprocessing.Process, multiprocessing.Connection))): The running workers. Updated in
+                                                                                place as workers are replaced
+            stall_timeout(float): Seconds without progress before a worker is replaced
+            max_restarts(int): The number of workers that may be replaced over the life of the client
+        """
+        self.start_worker = start_worker
+        self.workers = workers
+        self.stall_timeout = stall_timeout
+        self.max_restarts = max_restarts
+        self.restarts = 0
+
+        now = time.time()
+        self.started = dict((process.pid, now) for process, _ in workers)
+
+    def check(self, engine, exporter=None):
+        """Method to replace stalled and crashed workers
+
+        Args:
+            engine(ingestclient.core.engine.Engine): The master engine, holding the workers' progress reports
+            exporter(ingestclient.core.exporter.MetricsExporter): Stops publishing the metrics of replaced and
+                                                                  dropped workers, if given
+
+        Returns:
+            (list(int)): pids of the workers that were replaced
+        """
+        if engine.job_done.is_set():
+            # The workers are finishing up and exit on their own
+            return []
+
+        logger = logging.getLogger('ingest-client')
+        now = time.time()
+        stalled = set(engine.get_stalled_workers(self.workers))
+
+        replaced = []
+        job_over = None
+        for process, pipe in list(self.workers):
+            if process.pid in stalled:
+                reason = "stalled"
+            elif (process.is_alive() and process.pid not in engine.worker_progress and
+                  now - self.started.get(process.pid, now) > self.stall_timeout):
+                reason = "has not reported since it started"
+            elif not process.is_alive() and process.exitcode:
+                # Any tasks it held stay hidden until their visibility runs out
+                engine.wait_for_hidden_tasks()
+                if job_over is None:
+                    job_over = self.is_job_over(engine)
+                if job_over:
+                    # Workers refuse to start on a completed or cancelled job, and there is nothing left to do
+                    self.forget_worker(engine, process, pipe, exporter)
+                    continue
+                reason = "crashed with exit code {}".format(process.exitcode)
+            else:
+                continue
+
+            if self.restarts >= self.max_restarts:
+                logger.warning("Worker pid={} {}, but the limit of {} worker restarts was reached".format(
+                    process.pid, reason, self.max_restarts))
+                if process.is_alive():
+                    continue
+                # Forget it so it isn't reported again
+                self.forget_worker(engine, process, pipe, exporter)
+                continue
+
+            always_log_info("Worker pid={} {}. Starting a replacement".format(process.pid, reason))
+            self.stop_worker(process)
+            engine.wait_for_hidden_tasks()
+
+            new_worker = self.start_worker()
+            self.workers[self.workers.index((process, pipe))] = new_worker
+            self.forget_worker(engine, process, pipe, exporter)
+            self.started[new_worker[0].pid] = time.time()
+            self.restarts += 1
+            replaced.append(process.pid)
+
+        return replaced
+
+    def forget_worker(self, engine, process, pipe, exporter=None):
+        """Method to stop tracking a worker that exited or was stopped
+
+        Args:
+            engine(ingestclient.core.engine.Engine): The master engine
+            process(multiprocessing.Process): The worker
+            pipe(multiprocessing.Connection): The master's end of the worker's pipe
+            exporter(ingestclient.core.exporter.MetricsExporter): Stops publishing the worker's metrics, if given
+
+        Returns:
+            None
+        """
+        if (process, pipe) in self.workers:
+            self.workers.remove((process, pipe))
+        pipe.close()
+        engine.worker_progress.pop(process.pid, None)
+        engine.worker_stats.pop(process.pid, None)
+        self.started.pop(process.pid, None)
+        if exporter:
+            exporter.forget(process.pid)
+
+    @staticmethod
+    def is_job_over(engine):
+        """Method to check if the job was completed or cancelled, or has no tasks left
+
+        Tasks held by lost workers are hidden from the job status, so the job isn't considered out of tasks until
+        they are visible again.
+
+        Args:
+            engine(ingestclient.core.engine.Engine): The master engine
+
+        Returns:
+            (bool): False if the job status couldn't be read
+        """
+        try:
+            status = engine.backend.get_job_status(engine.ingest_job_id)
+        except Exception as e:
+            logging.getLogger('ingest-client').warning("Could not get the job status: {}".format(e))
+            return False
+        if status and status.get("status") in (2, 3):
+            return True
+        return time.time() >= engine.hidden_task_deadline and engine.is_job_drained(status)
+
+    @staticmethod
+    def stop_worker(process, timeout=5):
+        """Method to stop a worker process, killing it if it doesn't exit after being terminated
+
+        Args:
+            process(multiprocessing.Process): The worker
+            timeout(float): Seconds to wait for the worker to exit after each signal
+
+        Returns:
+            None
+        """
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout)
+        if process.is_alive() and hasattr(signal, "SIGKILL"):
+            os.kill(process.pid, signal.SIGKILL)
+            process.join(timeout)
+        process.join(0)
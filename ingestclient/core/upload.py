@@ -0,0 +1,409 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from six.moves import queue
+from collections import namedtuple
+from botocore.exceptions import ClientError
+import datetime
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from ..utils.log import always_log_info
+
+
+UploadResult = namedtuple("UploadResult", ["context", "response", "error", "duration", "num_bytes", "attempts"])
+UploadResult.__new__.__defaults__ = (1,)
+
+
+class UploadExecutor(object):
+    def __init__(self, upload_fn, num_threads=4, max_bytes_in_flight=64 * 1024 * 1024, retry_policy=None):
+        """
+        A class to run tile uploads on a bounded pool of threads so reading and encoding the next tile overlaps
+        with the network transfer of previous ones
+
+        Args:
+            upload_fn(callable): The function performing an upload. Must be safe to call from multiple threads
+            num_threads(int): The number of uploads that may be in flight at once
+            max_bytes_in_flight(int): The byte budget of submitted but unfinished uploads. submit() blocks while
+                                      the budget is full
+            retry_policy(RetryPolicy): Retries failed uploads with the same arguments. None to only try once
+        """
+        self.upload_fn = upload_fn
+        self.retry_policy = retry_policy
+        self.num_threads = num_threads
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self.bytes_in_flight = 0
+        self.num_in_flight = 0
+        self.max_active = num_threads
+        self.num_active = 0
+
+        self._condition = threading.Condition()
+        self._tasks = queue.Queue()
+        self._results = queue.Queue()
+        self._threads = []
+
+    def start(self):
+        """Method to start the upload threads
+
+        Returns:
+            None
+        """
+        for _ in range(self.num_threads):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self):
+        """Method to stop the upload threads once the uploads already submitted have finished
+
+        Returns:
+            None
+        """
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def set_max_active(self, max_active):
+        """Method to limit how many of the upload threads may be transferring at once
+
+        Args:
+            max_active(int): The number of concurrent uploads, clamped to 1..num_threads
+
+        Returns:
+            (int): The applied limit
+        """
+        with self._condition:
+            self.max_active = max(1, min(max_active, self.num_threads))
+            self._condition.notify_all()
+            return self.max_active
+
+    def submit(self, context, num_bytes, *args, **kwargs):
+        """Method to queue an upload, blocking while the in-flight byte budget is full
+
+        A single upload larger than the whole budget is still accepted once nothing else is in flight.
+
+        Args:
+            context: Caller data returned unchanged with the UploadResult
+            num_bytes(int): The size of the upload, counted against the in-flight byte budget
+            *args: Positional arguments for upload_fn
+            **kwargs: Keyword arguments for upload_fn
+
+        Returns:
+            None
+        """
+        with self._condition:
+            while self.num_in_flight > 0 and self.bytes_in_flight + num_bytes > self.max_bytes_in_flight:
+                self._condition.wait()
+            self.bytes_in_flight += num_bytes
+            self.num_in_flight += 1
+
+        self._tasks.put((context, num_bytes, args, kwargs))
+
+    def completed(self):
+        """Method to collect the results of uploads that have finished, without blocking
+
+        Returns:
+            (list(UploadResult)): The finished uploads since the last call
+        """
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def wait(self):
+        """Method to block until every submitted upload has finished
+
+        Returns:
+            (list(UploadResult)): The finished uploads since the last call to completed() or wait()
+        """
+        with self._condition:
+            while self.num_in_flight > 0:
+                self._condition.wait()
+
+        return self.completed()
+
+    def _worker(self):
+        """Upload thread main loop"""
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+
+            context, num_bytes, args, kwargs = task
+            with self._condition:
+                while self.num_active >= self.max_active:
+                    self._condition.wait()
+                self.num_active += 1
+
+            start_time = time.time()
+            if self.retry_policy:
+                response, error, attempts = self.retry_policy.call(self.upload_fn, *args, **kwargs)
+            else:
+                response = None
+                error = None
+                attempts = 1
+                try:
+                    response = self.upload_fn(*args, **kwargs)
+                except Exception as e:
+                    error = e
+
+            self._results.put(UploadResult(context, response, error, time.time() - start_time, num_bytes, attempts))
+
+            with self._condition:
+                self.num_active -= 1
+                self.bytes_in_flight -= num_bytes
+                self.num_in_flight -= 1
+                self._condition.notify_all()
+
+
+# S3 error codes that mean requests are arriving faster than S3 will accept them
+THROTTLE_ERRORS = ("SlowDown", "503", "ServiceUnavailable", "RequestLimitExceeded", "Throttling",
+                   "ThrottlingException")
+
+
+def is_throttle_error(error):
+    """Method to check if an upload failed because S3 is throttling requests
+
+    Args:
+        error(Exception): The upload error
+
+    Returns:
+        (bool)
+    """
+    if isinstance(error, ClientError):
+        response = error.response
+        return (response.get("Error", {}).get("Code") in THROTTLE_ERRORS or
+                response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 503)
+    return False
+
+
+def is_retryable_error(error):
+    """Method to check if a failed upload may succeed when tried again
+
+    S3 errors are retried when S3 is throttling or reports a server side problem. Other errors, such as dropped
+    connections and timeouts, are assumed to be transient.
+
+    Args:
+        error(Exception): The upload error
+
+    Returns:
+        (bool)
+    """
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return (is_throttle_error(error) or status >= 500 or
+                error.response.get("Error", {}).get("Code") in ("RequestTimeout", "InternalError"))
+    return True
+
+
+class RetryPolicy(object):
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=20):
+        """
+        A class to retry failed uploads with capped exponential backoff and full jitter
+
+        Before attempt n+1 the upload waits a random time between 0 and min(max_delay, base_delay * 2 ** (n - 1))
+        seconds. The upload is called with the same arguments every time, so an encoded TileBuffer is sent again
+        as is instead of being read and encoded again.
+
+        Args:
+            max_attempts(int): The number of times an upload is tried before giving up
+            base_delay(float): Seconds of the backoff before the second attempt
+            max_delay(float): Upper bound on the backoff in seconds
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt):
+        """Method to compute the backoff after a failed attempt
+
+        Args:
+            attempt(int): The number of the attempt that failed, starting at 1
+
+        Returns:
+            (float): Seconds to wait
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, upload_fn, *args, **kwargs):
+        """Method to run an upload, retrying retryable errors
+
+        Args:
+            upload_fn(callable): The function performing the upload
+            *args: Positional arguments for upload_fn
+            **kwargs: Keyword arguments for upload_fn
+
+        Returns:
+            (object, Exception, int): The response, the error of the last attempt if every attempt failed (None
+                                      otherwise) and the number of attempts made
+        """
+        logger = logging.getLogger('ingest-client')
+        attempt = 1
+        while True:
+            try:
+                return upload_fn(*args, **kwargs), None, attempt
+            except Exception as e:
+                if attempt >= self.max_attempts or not is_retryable_error(e):
+                    return None, e, attempt
+
+                delay = self.get_delay(attempt)
+                logger.warning("(pid={}) Upload attempt {} failed, retrying in {:.1f}s - {}".format(os.getpid(),
+                                                                                                 attempt, delay, e))
+                time.sleep(delay)
+                attempt += 1
+
+
+class FailureJournal(object):
+    def __init__(self, file_path):
+        """
+        A class to record tiles that could not be uploaded, one JSON object per line
+
+        The file is appended to, and only created once the first failure is recorded, so several upload processes
+        can share it.
+
+        Args:
+            file_path(str): Path to the journal file
+        """
+        self.file_path = file_path
+        self._lock = threading.Lock()
+
+    def record(self, tile_key, key_parts, error, attempts):
+        """Method to record a tile that ran out of upload attempts
+
+        Args:
+            tile_key(str): The tile key
+            key_parts(dict): The decoded tile key
+            error(Exception): The error of the last attempt
+            attempts(int): The number of attempts made
+
+        Returns:
+            None
+        """
+        entry = {"time": datetime.datetime.now().isoformat(),
+                 "pid": os.getpid(),
+                 "tile_key": tile_key,
+                 "x_index": key_parts["x_index"],
+                 "y_index": key_parts["y_index"],
+                 "z_index": key_parts["z_index"],
+                 "t_index": key_parts["t_index"],
+                 "attempts": attempts,
+                 "error": str(error)}
+        with self._lock:
+            directory = os.path.dirname(self.file_path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.file_path, 'a') as journal:
+                journal.write(json.dumps(entry) + "\n")
+
+
+class AimdController(object):
+    def __init__(self, executor, window=20, latency_tolerance=2.0, increase=1, decrease_factor=0.5):
+        """
+        A class to adapt upload concurrency with additive-increase/multiplicative-decrease
+
+        After each window of finished uploads the number of concurrent uploads is grown by `increase` if the window
+        had no throttling and its mean latency stayed within `latency_tolerance` times the best window seen. It is
+        cut by `decrease_factor` otherwise. The first throttled upload of a window cuts concurrency right away and
+        starts a new window. Every change is logged.
+
+        Args:
+            executor(UploadExecutor): The executor to adjust. Concurrency ranges from 1 to its number of threads
+            window(int): The number of finished uploads per decision
+            latency_tolerance(float): How much slower than the best window a window may be before backing off
+            increase(int): Uploads added after a good window
+            decrease_factor(float): Fraction of concurrency kept after throttling or rising latency
+        """
+        self.executor = executor
+        self.window = window
+        self.latency_tolerance = latency_tolerance
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.best_latency = None
+
+        self._durations = []
+        self._errors = 0
+        self._backed_off = False
+
+    @property
+    def limit(self):
+        """The current number of concurrent uploads"""
+        return self.executor.max_active
+
+    def update(self, results):
+        """Method to feed finished uploads to the controller
+
+        Args:
+            results(list(UploadResult)): The finished uploads
+
+        Returns:
+            (int): The concurrency limit after any adjustment
+        """
+        for result in results:
+            if result.error is not None:
+                if is_throttle_error(result.error) and not self._backed_off:
+                    self._decrease("S3 throttled an upload: {}".format(result.error))
+                    self._backed_off = True
+                    continue
+                self._errors += 1
+            else:
+                self._durations.append(result.duration)
+
+            if len(self._durations) + self._errors >= self.window:
+                self._decide()
+
+        return self.limit
+
+    def _decide(self):
+        """Method to adjust concurrency at the end of a window"""
+        durations, errors = self._durations, self._errors
+        self._durations, self._errors = [], 0
+        self._backed_off = False
+        if not durations:
+            self._decrease("{} uploads failed".format(errors))
+            return
+
+        latency = sum(durations) / len(durations)
+        if self.best_latency is None or latency < self.best_latency:
+            self.best_latency = latency
+
+        if latency > self.best_latency * self.latency_tolerance:
+            self._decrease("mean upload latency {:.3f}s is over {:.1f}x the best {:.3f}s".format(
+                latency, self.latency_tolerance, self.best_latency))
+        elif errors:
+            self._decrease("{} uploads failed".format(errors))
+        else:
+            self._set_limit(self.limit + self.increase, "mean upload latency {:.3f}s".format(latency))
+
+    def _decrease(self, reason):
+        """Method to cut concurrency and start a new window"""
+        self._durations, self._errors = [], 0
+        self._set_limit(int(self.limit * self.decrease_factor), reason)
+
+    def _set_limit(self, limit, reason):
+        """Method to apply and log a new concurrency limit"""
+        previous = self.limit
+        limit = self.executor.set_max_active(limit)
+        if limit != previous:
+            always_log_info("(pid={}) Upload concurrency {} -> {}: {}".format(os.getpid(), previous, limit, reason))
+        else:
+            logging.getLogger('ingest-client').debug("(pid={}) Upload concurrency held at {}: {}".format(
+                os.getpid(), limit, reason))
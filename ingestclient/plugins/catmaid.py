@@ -12,11 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import absolute_import
-import six
 from PIL import Image
 import numpy as np
 import os
 
+from ..utils.encoder import TileEncoder
 from .path import PathProcessor
 from .tile import TileProcessor
 
@@ -85,6 +85,7 @@ class CatmaidFileImageStackZoomLevelTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, parameters["filetype"])
 
     def process(self, file_path, x_index, y_index, z_index, t_index=0):
         """
@@ -98,14 +99,13 @@ class CatmaidFileImageStackZoomLevelTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
         # Save img to png and return handle
         tile_data = Image.open(file_path)
 
-        output = six.BytesIO()
-        tile_data.save(output, format=self.parameters["filetype"].upper())
+        output = self.encoder.encode(tile_data)
 
         # Send handle back
         return output
@@ -174,6 +174,7 @@ class CatmaidDirectoryImageStackTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, parameters["filetype"])
 
     def process(self, file_path, x_index, y_index, z_index, t_index=0):
         """
@@ -187,14 +188,13 @@ class CatmaidDirectoryImageStackTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
         # Save img to png and return handle
         tile_data = Image.open(file_path)
 
-        output = six.BytesIO()
-        tile_data.save(output, format=self.parameters["filetype"].upper())
+        output = self.encoder.encode(tile_data)
 
         # Send handle back
         return output
@@ -263,6 +263,7 @@ class CatmaidFileImageStackTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, parameters["filetype"])
 
     def process(self, file_path, x_index, y_index, z_index, t_index=0):
         """
@@ -276,14 +277,13 @@ class CatmaidFileImageStackTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
         # Save img to png and return handle
         tile_data = Image.open(file_path)
 
-        output = six.BytesIO()
-        tile_data.save(output, format=self.parameters["filetype"].upper())
+        output = self.encoder.encode(tile_data)
 
         # Send handle back
         return output
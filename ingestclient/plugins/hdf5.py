@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import absolute_import
-import six
 from PIL import Image
 import re
 import os
@@ -21,13 +20,124 @@ import numpy as np
 from math import floor
 import botocore
 import logging
+from collections import OrderedDict
 
 
 from ..utils.filesystem import DynamicFilesystemAbsPath
+from ..utils.encoder import TileEncoder
 from .path import PathProcessor
 from .tile import TileProcessor
 
 
+class Hdf5FilePool(object):
+    """A bounded pool of open, read-only hdf5 files
+
+    Keeps the most recently used files open along with the dataset objects and small metadata arrays resolved from
+    them, closing the least recently used file when the pool is full.
+    """
+
+    def __init__(self, max_open_files=8, rdcc_nbytes=None):
+        """
+
+        Args:
+            max_open_files(int): The maximum number of files kept open
+            rdcc_nbytes(int): Size in bytes of the HDF5 chunk cache of each open file. The HDF5 default if None
+        """
+        self.max_open_files = max_open_files
+        self.rdcc_nbytes = rdcc_nbytes
+        self._files = OrderedDict()
+        self._datasets = {}
+        self._arrays = {}
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        """Method to create a pool from the optional "max_open_files" and "rdcc_nbytes" plugin parameters
+
+        Args:
+            parameters (dict): Parameters for the dataset to be processed
+
+        Returns:
+            (Hdf5FilePool)
+        """
+        return cls(parameters.get("max_open_files", 8), parameters.get("rdcc_nbytes"))
+
+    def get_file(self, file_path):
+        """Method to get an open file, opening it if needed
+
+        Args:
+            file_path(str): Absolute path to the hdf5 file
+
+        Returns:
+            (h5py.File): The open file
+        """
+        if file_path in self._files:
+            h5_file = self._files.pop(file_path)
+            self._files[file_path] = h5_file
+            return h5_file
+
+        if self.rdcc_nbytes is not None:
+            h5_file = h5py.File(file_path, 'r', rdcc_nbytes=self.rdcc_nbytes)
+        else:
+            h5_file = h5py.File(file_path, 'r')
+        self._files[file_path] = h5_file
+
+        while len(self._files) > self.max_open_files:
+            self._close(next(iter(self._files)))
+
+        return h5_file
+
+    def get_dataset(self, file_path, name):
+        """Method to get a dataset object, resolving it once per open file
+
+        Args:
+            file_path(str): Absolute path to the hdf5 file
+            name(str): The dataset name
+
+        Returns:
+            (h5py.Dataset): The dataset
+        """
+        h5_file = self.get_file(file_path)
+        key = (file_path, name)
+        if key not in self._datasets:
+            self._datasets[key] = h5_file[name]
+        return self._datasets[key]
+
+    def get_array(self, file_path, name):
+        """Method to read a small dataset, such as an offset or extent, into memory once per open file
+
+        Args:
+            file_path(str): Absolute path to the hdf5 file
+            name(str): The dataset name
+
+        Returns:
+            (numpy.ndarray): The dataset contents
+        """
+        key = (file_path, name)
+        if key not in self._arrays:
+            self._arrays[key] = np.array(self.get_dataset(file_path, name))
+        else:
+            self.get_file(file_path)
+        return self._arrays[key]
+
+    def close(self):
+        """Method to close every open file
+
+        Returns:
+            None
+        """
+        for file_path in list(self._files):
+            self._close(file_path)
+
+    def _close(self, file_path):
+        """Method to close a file and forget everything resolved from it"""
+        h5_file = self._files.pop(file_path)
+        for key in [k for k in self._datasets if k[0] == file_path]:
+            del self._datasets[key]
+        for key in [k for k in self._arrays if k[0] == file_path]:
+            del self._arrays[key]
+        h5_file.close()
+
+
 class Hdf5TimeSeriesPathProcessor(PathProcessor):
     """A Path processor for time-series, multi-channel data (e.g. calcium imaging)
 
@@ -115,6 +225,7 @@ class Hdf5TimeSeriesTileProcessor(TileProcessor):
         """Constructor to add custom class var"""
         TileProcessor.__init__(self)
         self.fs = None
+        self.h5_pool = None
 
     def setup(self, parameters):
         """ Method to load the file for uploading
@@ -134,7 +245,9 @@ class Hdf5TimeSeriesTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, "PNG")
         self.fs = DynamicFilesystemAbsPath(parameters['filesystem'], parameters)
+        self.h5_pool = Hdf5FilePool.from_parameters(parameters)
 
     def process(self, file_path, x_index, y_index, z_index, t_index=0):
         """
@@ -149,7 +262,7 @@ class Hdf5TimeSeriesTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
         file_path = self.fs.get_file(file_path)
@@ -160,21 +273,20 @@ class Hdf5TimeSeriesTileProcessor(TileProcessor):
                    self.parameters["ingest_job"]["tile_size"]["y"] * (y_index + 1)]
 
         # Open hdf5
-        h5_file = h5py.File(file_path, 'r')
+        dataset = self.h5_pool.get_dataset(file_path, self.parameters['dataset'])
 
         # Save sub-img to png and return handle
-        tile_data = np.array(h5_file[self.parameters['dataset']][t_index,
-                                                                 x_range[0]:x_range[1],
-                                                                 y_range[0]:y_range[1],
-                                                                 int(self.parameters['channel_index'])])
+        tile_data = np.array(dataset[t_index,
+                                     x_range[0]:x_range[1],
+                                     y_range[0]:y_range[1],
+                                     int(self.parameters['channel_index'])])
 
         tile_data = np.swapaxes(tile_data, 0, 1)
         tile_data = np.multiply(tile_data, self.parameters['scale_factor'])
         tile_data = tile_data.astype(np.uint16)
         upload_img = Image.fromarray(tile_data, 'I;16')
 
-        output = six.BytesIO()
-        upload_img.save(output, format=self.parameters["upload_format"].upper())
+        output = self.encoder.encode(upload_img)
 
         # Send handle back
         return output
@@ -192,6 +304,7 @@ class Hdf5TimeSeriesLabelTileProcessor(TileProcessor):
         """Constructor to add custom class var"""
         TileProcessor.__init__(self)
         self.fs = None
+        self.h5_pool = None
 
     def setup(self, parameters):
         """ Method to load the file for uploading
@@ -209,7 +322,9 @@ class Hdf5TimeSeriesLabelTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, "PNG")
         self.fs = DynamicFilesystemAbsPath(parameters['filesystem'], parameters)
+        self.h5_pool = Hdf5FilePool.from_parameters(parameters)
 
     def process(self, file_path, x_index, y_index, z_index, t_index=0):
         """
@@ -224,7 +339,7 @@ class Hdf5TimeSeriesLabelTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
         file_path = self.fs.get_file(file_path)
@@ -235,16 +350,15 @@ class Hdf5TimeSeriesLabelTileProcessor(TileProcessor):
                    self.parameters["ingest_job"]["tile_size"]["y"] * (y_index + 1)]
 
         # Open hdf5
-        h5_file = h5py.File(file_path, 'r')
+        dataset = self.h5_pool.get_dataset(file_path, self.parameters['dataset'])
 
         # Save sub-img to png and return handle
-        tile_data = np.array(h5_file[self.parameters['dataset']][x_range[0]:x_range[1], y_range[0]:y_range[1]])
+        tile_data = np.array(dataset[x_range[0]:x_range[1], y_range[0]:y_range[1]])
         tile_data = np.swapaxes(tile_data, 0, 1)
         tile_data = tile_data.astype(np.uint32)
         upload_img = Image.fromarray(tile_data, 'I')
 
-        output = six.BytesIO()
-        upload_img.save(output, format=self.parameters["upload_format"].upper())
+        output = self.encoder.encode(upload_img)
 
         # Send handle back
         return output
@@ -336,6 +450,7 @@ class Hdf5SliceTileProcessor(TileProcessor):
         """Constructor to add custom class var"""
         TileProcessor.__init__(self)
         self.fs = None
+        self.h5_pool = None
 
     def setup(self, parameters):
         """ Method to load the file for uploading
@@ -357,7 +472,9 @@ class Hdf5SliceTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, "PNG")
         self.fs = DynamicFilesystemAbsPath(parameters['filesystem'], parameters)
+        self.h5_pool = Hdf5FilePool.from_parameters(parameters)
 
     def process(self, file_path, x_index, y_index, z_index, t_index=0):
         """
@@ -371,26 +488,57 @@ class Hdf5SliceTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
         file_path = self.fs.get_file(file_path)
 
+        # Send handle back
+        return self._read_tile(file_path, x_index, y_index)
+
+    def process_batch(self, file_path, tile_indices):
+        """
+        Method to resolve the hdf5 file once and read several tiles from it
+
+        Args:
+            file_path(str): An absolute file path containing all of the tiles
+            tile_indices(list((int, int, int, int))): The (x_index, y_index, z_index, t_index) of each tile
+
+        Returns:
+            (list(TileBuffer)): The encoded tiles, in the order of tile_indices
+
+        """
+        file_path = self.fs.get_file(file_path)
+
+        return [self._read_tile(file_path, x_index, y_index) for x_index, y_index, _, _ in tile_indices]
+
+    def _read_tile(self, file_path, x_index, y_index):
+        """
+        Method to read a tile from an hdf5 file and encode it
+
+        Args:
+            file_path(str): An absolute path to the local hdf5 file
+            x_index(int): The tile index in the X dimension
+            y_index(int): The tile index in the Y dimension
+
+        Returns:
+            (TileBuffer): The encoded tile
+
+        """
         # Compute global range
         tile_x_range = [self.parameters["ingest_job"]["tile_size"]["x"] * x_index,
                         self.parameters["ingest_job"]["tile_size"]["x"] * (x_index + 1)]
         tile_y_range = [self.parameters["ingest_job"]["tile_size"]["y"] * y_index,
                         self.parameters["ingest_job"]["tile_size"]["y"] * (y_index + 1)]
 
-        # Open hdf5
-        h5_file = h5py.File(file_path, 'r')
-
         # Compute range in actual data, taking offsets into account
-        x_offset = h5_file[self.parameters['offset_name']][1]
-        y_offset = h5_file[self.parameters['offset_name']][0]
+        offset = self.h5_pool.get_array(file_path, self.parameters['offset_name'])
+        x_offset = offset[1]
+        y_offset = offset[0]
 
-        x_img_extent = h5_file[self.parameters['extent_name']][1]
-        y_img_extent = h5_file[self.parameters['extent_name']][0]
+        extent = self.h5_pool.get_array(file_path, self.parameters['extent_name'])
+        x_img_extent = extent[1]
+        y_img_extent = extent[0]
 
         x_frame_offset = x_offset + self.parameters['offset_origin_x']
         y_frame_offset = y_offset + self.parameters['offset_origin_x']
@@ -420,17 +568,16 @@ class Hdf5SliceTileProcessor(TileProcessor):
         img_x_index_stop = max(0, x2 - x_frame_offset)
 
         tile_data[y1-tile_y_range[0]:y2-tile_y_range[0],
-                  x1 - tile_x_range[0]:x2 - tile_x_range[0]] = np.array(h5_file[self.parameters['data_name']][
+                  x1 - tile_x_range[0]:x2 - tile_x_range[0]] = np.array(self.h5_pool.get_dataset(
+                                                                        file_path, self.parameters['data_name'])[
                                                                         img_y_index_start:img_y_index_stop,
                                                                         img_x_index_start:img_x_index_stop])
 
         tile_data = tile_data.astype(datatype)
         upload_img = Image.fromarray(tile_data)
 
-        output = six.BytesIO()
-        upload_img.save(output, format=self.parameters["upload_format"].upper())
+        output = self.encoder.encode(upload_img)
 
-        # Send handle back
         return output
 
 
@@ -521,6 +668,7 @@ class Hdf5ChunkTileProcessor(TileProcessor):
         """Constructor to add custom class var"""
         TileProcessor.__init__(self)
         self.fs = None
+        self.h5_pool = None
 
     def setup(self, parameters):
         """ Method to load the file for uploading
@@ -539,7 +687,9 @@ class Hdf5ChunkTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, "PNG")
         self.fs = DynamicFilesystemAbsPath(parameters['filesystem'], parameters)
+        self.h5_pool = Hdf5FilePool.from_parameters(parameters)
 
     def process(self, file_path, x_index, y_index, z_index, t_index=0):
         """
@@ -553,7 +703,7 @@ class Hdf5ChunkTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
         if self.parameters['datatype'] == "uint8":
@@ -569,13 +719,13 @@ class Hdf5ChunkTileProcessor(TileProcessor):
             file_path = self.fs.get_file(file_path)
 
             # Open hdf5
-            h5_file = h5py.File(file_path, 'r')
+            dataset = self.h5_pool.get_dataset(file_path, self.parameters['data_name'])
 
             # Compute z-index (plugin assumes xy extent fits in a tile)
             z_index = z_index % self.parameters['z_chunk_size']
 
             # Allocate Tile
-            tile_data = np.array(h5_file[self.parameters['data_name']][z_index, :, :], dtype=datatype, order='C')
+            tile_data = np.array(dataset[z_index, :, :], dtype=datatype, order='C')
 
         except botocore.exceptions.ClientError as err:
             logger = logging.getLogger('ingest-client')
@@ -589,8 +739,7 @@ class Hdf5ChunkTileProcessor(TileProcessor):
             tile_data = np.zeros((512, 512), dtype=datatype, order="C")
 
         upload_img = Image.fromarray(tile_data)
-        output = six.BytesIO()
-        upload_img.save(output, format=self.parameters["upload_format"].upper())
+        output = self.encoder.encode(upload_img)
 
         # Send handle back
         return output
@@ -648,6 +797,7 @@ class Hdf5SingleFileTileProcessor(TileProcessor):
         """Constructor to add custom class var"""
         TileProcessor.__init__(self)
         self.fs = None
+        self.h5_pool = None
 
     def setup(self, parameters):
         """ Method to load the file for uploading
@@ -669,7 +819,9 @@ class Hdf5SingleFileTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, "PNG")
         self.fs = DynamicFilesystemAbsPath(parameters['filesystem'], parameters)
+        self.h5_pool = Hdf5FilePool.from_parameters(parameters)
 
     def process(self, file_path, x_index, y_index, z_index, t_index=0):
         """
@@ -683,7 +835,7 @@ class Hdf5SingleFileTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
         file_path = self.fs.get_file(file_path)
@@ -695,7 +847,7 @@ class Hdf5SingleFileTileProcessor(TileProcessor):
                           self.parameters["ingest_job"]["tile_size"]["y"] * (y_index + 1)]
 
         # Open hdf5
-        h5_file = h5py.File(file_path, 'r')
+        dataset = self.h5_pool.get_dataset(file_path, self.parameters['data_name'])
 
         # Compute range in actual data, taking offsets into account
         x_offset = self.parameters['offset_x']
@@ -710,8 +862,8 @@ class Hdf5SingleFileTileProcessor(TileProcessor):
         tile_x_range = [0, x_tile_size]
         tile_y_range = [0, y_tile_size]
 
-        h5_max_x = h5_file[self.parameters['data_name']].shape[2]
-        h5_max_y = h5_file[self.parameters['data_name']].shape[1]
+        h5_max_x = dataset.shape[2]
+        h5_max_y = dataset.shape[1]
 
         if h5_x_range[0] < 0:
             # insert sub-region into tile
@@ -748,7 +900,7 @@ class Hdf5SingleFileTileProcessor(TileProcessor):
         if h5_z_slice >= 0:
             # Copy sub-img to tile, save, return
             tile_data[tile_y_range[0]:tile_y_range[1],
-                      tile_x_range[0]:tile_x_range[1]] = np.array(h5_file[self.parameters['data_name']][
+                      tile_x_range[0]:tile_x_range[1]] = np.array(dataset[
                                                                           h5_z_slice,
                                                                           h5_y_range[0]:h5_y_range[1],
                                                                           h5_x_range[0]:h5_x_range[1]])
@@ -756,8 +908,7 @@ class Hdf5SingleFileTileProcessor(TileProcessor):
         tile_data = tile_data.astype(datatype)
         upload_img = Image.fromarray(tile_data)
 
-        output = six.BytesIO()
-        upload_img.save(output, format=self.parameters["upload_format"].upper())
+        output = self.encoder.encode(upload_img)
 
         # Send handle back
         return output
@@ -12,13 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import absolute_import
-import six
 from PIL import Image
 from intern.remote.boss import BossRemote
 from intern.resource.boss.resource import ChannelResource
 import numpy as np
 import time
 
+from ..utils.encoder import TileEncoder
 from .path import PathProcessor
 from .tile import TileProcessor
 
@@ -89,6 +89,7 @@ class InternTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, "TIFF")
         self.remote = BossRemote()
         self.channel = ChannelResource(self.parameters["channel"],
                                        self.parameters["collection"],
@@ -107,7 +108,7 @@ class InternTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
         # Compute cutout args
@@ -136,8 +137,7 @@ class InternTileProcessor(TileProcessor):
 
         # Save sub-img to png and return handle
         upload_img = Image.fromarray(np.squeeze(data))
-        output = six.BytesIO()
-        upload_img.save(output, format="TIFF")
+        output = self.encoder.encode(upload_img)
 
         # Send handle back
         return output
@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import absolute_import
-import six
 from PIL import Image
 import numpy as np
 from math import floor
@@ -20,6 +19,8 @@ import os
 import re
 
 from ..utils.filesystem import DynamicFilesystemAbsPath
+from ..utils.tiff import TiffReader, TiffReaderPool
+from ..utils.encoder import TileEncoder
 from .path import PathProcessor
 from .tile import TileProcessor
 
@@ -38,23 +39,12 @@ def load_tiff_multipage(tiff_filename, dtype='uint16'):
     if not os.path.isfile(tiff_filename):
         raise IOError('File not found: {}'.format(tiff_filename))
 
-    # load the data from multi-layer TIF files
-    data = Image.open(tiff_filename)
+    # load the data from multi-layer TIF files, one page at a time into a preallocated array
+    with TiffReader(tiff_filename) as reader:
+        im = np.empty((len(reader),) + reader.shape(0), dtype=dtype)
+        for page in range(len(reader)):
+            im[page, :, :] = reader.read(page)
 
-    im = []
-    while True:
-        # Get all slices from file
-        img_slice = np.array(data, dtype=dtype)
-        if img_slice.ndim == 2:
-            img_slice = img_slice[np.newaxis, ...]
-        im.append(img_slice)
-
-        try:
-            data.seek(data.tell()+1)
-        except EOFError:
-            break  # end of file
-
-    im = np.concatenate(im, axis=0)
     return im
 
 
@@ -103,13 +93,14 @@ class SingleTimeTiffPathProcessor(PathProcessor):
 
 class SingleTimeTiffTileProcessor(TileProcessor):
     """A Tile processor for a file where a multi-page TIFF contains all time points for a single z-slice"""
+
     def __init__(self):
         """Constructor to add custom class var"""
         TileProcessor.__init__(self)
-        self.data = None
+        self.readers = None
 
     def setup(self, parameters):
-        """ Method to load the file for uploading - a very naive approach
+        """ Method to load the file for uploading
 
         MUST HAVE THE CUSTOM PARAMETER: "datatype": "<uint8|uint16>"
 
@@ -120,7 +111,8 @@ class SingleTimeTiffTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
-        self.data = {}
+        self.encoder = TileEncoder.from_parameters(parameters, "TIFF")
+        self.readers = TiffReaderPool(parameters.get("max_open_files", 8))
 
     def process(self, file_path, x_index, y_index, z_index, t_index=0):
         """
@@ -134,28 +126,23 @@ class SingleTimeTiffTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
-        # Load the file into memory
-        if "z_{}".format(z_index) not in self.data:
-            # storing slices in tyx
-            self.data["z_{}".format(z_index)] = load_tiff_multipage(file_path, dtype=self.parameters["datatype"])
-
-        im = self.data["z_{}".format(z_index)][t_index, :, :]
-
         # Compute matrix indices
         x_start = self.parameters["ingest_job"]["tile_size"]["x"] * x_index
         x_stop = self.parameters["ingest_job"]["tile_size"]["x"] * (x_index + 1)
         y_start = self.parameters["ingest_job"]["tile_size"]["y"] * y_index
         y_stop = self.parameters["ingest_job"]["tile_size"]["y"] * (y_index + 1)
 
-        # TODO: Verify handles will be closed properly and memory reclaimed
+        # Read only the tile from the time point's page
+        im = self.readers.get(file_path).read(t_index, (y_start, y_stop), (x_start, x_stop))
+        im = np.ascontiguousarray(im, dtype=self.parameters["datatype"])
+
         # Save img to png and return handle
-        tile_data = Image.fromarray(im[y_start:y_stop, x_start:x_stop], 'I;16')
+        tile_data = Image.fromarray(im, 'I;16')
 
-        output = six.BytesIO()
-        tile_data.save(output, format="TIFF")
+        output = self.encoder.encode(tile_data)
 
         # Send handle back
         return output
@@ -243,6 +230,7 @@ class TiffMultiFileHyperStackTileProcessor(TileProcessor):
         """Constructor to add custom class var"""
         TileProcessor.__init__(self)
         self.fs = None
+        self.readers = None
 
     def setup(self, parameters):
         """ Method to load the file for uploading
@@ -262,7 +250,9 @@ class TiffMultiFileHyperStackTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, "TIFF")
         self.fs = DynamicFilesystemAbsPath(parameters['filesystem'], parameters)
+        self.readers = TiffReaderPool(parameters.get("max_open_files", 8))
 
     def process(self, file_path, x_index, y_index, z_index, t_index=0):
         """
@@ -276,25 +266,22 @@ class TiffMultiFileHyperStackTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
         file_path = self.fs.get_file(file_path)
 
-        # Open Tiff Hyper-Stack
-        tiff_file = Image.open(file_path)
-
         # Compute frame Number
         frame_num = ((self.parameters["num_z_slices"] * self.parameters["num_channels"]) * t_index) + \
                     (z_index * self.parameters["num_channels"]) + (self.parameters["channel_index"])
 
-        tiff_file.seek(frame_num % self.parameters["time_chunk_size"])
-
-        tile_data = np.array(tiff_file, dtype=np.uint16)
+        # Read only the frame from the Tiff Hyper-Stack
+        tiff_file = self.readers.get(file_path)
+        tile_data = np.ascontiguousarray(tiff_file.read(frame_num % self.parameters["time_chunk_size"]),
+                                         dtype=np.uint16)
         upload_img = Image.fromarray(tile_data, 'I;16')
 
-        output = six.BytesIO()
-        upload_img.save(output, format="TIFF")
+        output = self.encoder.encode(upload_img)
 
         # Send handle back
         return output
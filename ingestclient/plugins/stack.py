@@ -12,12 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import absolute_import
-import six
 from PIL import Image
+import numpy as np
 import re
 import os
 
 from ..utils.filesystem import DynamicFilesystem
+from ..utils.tiff import TiffReaderPool
+from ..utils.encoder import TileEncoder
 from .path import PathProcessor
 from .tile import TileProcessor
 
@@ -105,6 +107,7 @@ class ZindexStackTileProcessor(TileProcessor):
         """Constructor to add custom class var"""
         TileProcessor.__init__(self)
         self.fs = None
+        self.readers = None
 
     def setup(self, parameters):
         """ Method to load the file for uploading
@@ -121,7 +124,9 @@ class ZindexStackTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, canonical_extension(parameters["extension"]))
         self.fs = DynamicFilesystem(parameters['filesystem'], parameters)
+        self.readers = TiffReaderPool(parameters.get("max_open_files", 8))
 
     def process(self, file_path, x_index, y_index, z_index, t_index=0):
         """
@@ -136,24 +141,132 @@ class ZindexStackTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
+        # Decode only the strips or tiles under the tile if possible
+        reader = self._get_region_reader(file_path)
+        if reader:
+            return self._read_tile(reader, x_index, y_index)
+
         # Load tile
+        tile_data = self.get_slice(file_path, None, lambda: self._load_image(file_path))
+
+        # Send handle back
+        return self._crop_tile(tile_data, x_index, y_index)
+
+    def process_batch(self, file_path, tile_indices):
+        """
+        Method to load the image file once and cut out several tiles from it
+
+        Args:
+            file_path(str): An absolute file path containing all of the tiles
+            tile_indices(list((int, int, int, int))): The (x_index, y_index, z_index, t_index) of each tile
+
+        Returns:
+            (list(TileBuffer)): The encoded tiles, in the order of tile_indices
+
+        """
+        reader = self._get_region_reader(file_path)
+        if reader:
+            return [self._read_tile(reader, x_index, y_index) for x_index, y_index, _, _ in tile_indices]
+
+        tile_data = self.get_slice(file_path, None, lambda: self._load_image(file_path))
+
+        return [self._crop_tile(tile_data, x_index, y_index) for x_index, y_index, _, _ in tile_indices]
+
+    def _get_region_reader(self, file_path):
+        """
+        Method to get a reader that can decode tile sized regions of an image file
+
+        Only TIFF images stored as uncompressed or Deflate compressed strips or tiles, with grayscale or 8-bit RGB
+        samples, can be partially decoded. Other images are decoded whole and cropped.
+
+        Args:
+            file_path(str): An absolute file path
+
+        Returns:
+            (ingestclient.utils.tiff.TiffReader): The reader, or None if the image must be fully decoded
+        """
+        if canonical_extension(self.parameters["extension"]) != "TIFF":
+            return None
+
+        reader = self.readers.get(file_path, lambda: self.fs.get_file(file_path))
+        if not reader.can_read_region(0):
+            return None
+
+        ifd = reader.pages[0]
+        dtype = reader.dtype(0).newbyteorder('=')
+        if ifd.get("photometric") == 1 and ifd["samples_per_pixel"] == 1:
+            return reader if dtype in (np.uint8, np.uint16, np.int32, np.float32) else None
+        if ifd.get("photometric") == 2 and ifd["samples_per_pixel"] == 3:
+            return reader if dtype == np.uint8 else None
+        return None
+
+    def _read_tile(self, reader, x_index, y_index):
+        """
+        Method to decode a tile from an image file and encode it
+
+        Args:
+            reader(ingestclient.utils.tiff.TiffReader): The open image file
+            x_index(int): The tile index in the X dimension
+            y_index(int): The tile index in the Y dimension
+
+        Returns:
+            (TileBuffer): The encoded tile
+
+        """
+        tile_width = self.parameters["ingest_job"]["tile_size"]["x"]
+        tile_height = self.parameters["ingest_job"]["tile_size"]["y"]
+        region = reader.read(0, (tile_height * y_index, tile_height * (y_index + 1)),
+                             (tile_width * x_index, tile_width * (x_index + 1)))
+
+        # Pad tiles on the edge of the image like PIL.Image.crop does
+        tile_data = np.zeros((tile_height, tile_width) + region.shape[2:], dtype=region.dtype.newbyteorder('='))
+        tile_data[:region.shape[0], :region.shape[1]] = region
+
+        upload_img = Image.fromarray(tile_data)
+        output = self.encoder.encode(upload_img)
+
+        return output
+
+    def _load_image(self, file_path):
+        """
+        Method to read and fully decode an image file
+
+        Args:
+            file_path(str): An absolute file path
+
+        Returns:
+            (PIL.Image.Image): The decoded image
+        """
         file_handle = self.fs.get_file(file_path)
+        tile_data = Image.open(file_handle)
+        tile_data.load()
+        return tile_data
+
+    def _crop_tile(self, tile_data, x_index, y_index):
+        """
+        Method to cut a tile out of a loaded image and encode it
 
+        Args:
+            tile_data(PIL.Image.Image): The full image
+            x_index(int): The tile index in the X dimension
+            y_index(int): The tile index in the Y dimension
+
+        Returns:
+            (TileBuffer): The encoded tile
+
+        """
         x_range = [self.parameters["ingest_job"]["tile_size"]["x"] * x_index,
                    self.parameters["ingest_job"]["tile_size"]["x"] * (x_index + 1)]
         y_range = [self.parameters["ingest_job"]["tile_size"]["y"] * y_index,
                    self.parameters["ingest_job"]["tile_size"]["y"] * (y_index + 1)]
 
         # Save sub-img to png and return handle
-        tile_data = Image.open(file_handle)
         upload_img = tile_data.crop((x_range[0], y_range[0], x_range[1], y_range[1]))
-        output = six.BytesIO()
-        upload_img.save(output, format=canonical_extension(self.parameters["extension"]))
+        output = self.encoder.encode(upload_img)
 
-        # Send handle back
         return output
 
 EXTENSIONS =  {
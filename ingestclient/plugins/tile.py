@@ -16,6 +16,12 @@ from abc import ABCMeta, abstractmethod
 import numpy as np
 from PIL import Image
 
+from ..utils.cache import SliceCache
+from ..utils.encoder import TileEncoder
+
+# Memory budget of each process's decoded slice cache when neither the configuration nor the client sets one
+DEFAULT_SLICE_CACHE_MB = 64
+
 
 @six.add_metaclass(ABCMeta)
 class TileProcessor(object):
@@ -26,6 +32,9 @@ class TileProcessor(object):
         Args:
         """
         self.parameters = None
+        self.slice_cache = None
+        self.slice_cache_mb = None  # Overrides the "slice_cache_mb" parameter, e.g. with a client's share of a total
+        self.encoder = None
 
     @abstractmethod
     def setup(self, parameters):
@@ -45,7 +54,10 @@ class TileProcessor(object):
     @abstractmethod
     def process(self, file_path, x_index, y_index, z_index, t_index=None):
         """
-        Method to take a file path and tile indices and return a file handle to the correct data
+        Method to take a file path and tile indices and return the encoded tile
+
+        Processors should return the TileBuffer made by self.encoder, which carries the tile's length and MD5 so
+        it can be uploaded without copies. A file handle to the encoded data is still accepted.
 
         Args:
             file_path(str): An absolute file path for the specified tile
@@ -55,11 +67,56 @@ class TileProcessor(object):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer|io.BufferedReader): The encoded tile
 
         """
         return NotImplemented
 
+    def process_batch(self, file_path, tile_indices):
+        """
+        Method to return several encoded tiles that all come from the same file
+
+        The default calls process() for each tile. Processors that can read or decode the source once and cut out
+        every tile should override this.
+
+        Args:
+            file_path(str): An absolute file path containing all of the tiles
+            tile_indices(list((int, int, int, int))): The (x_index, y_index, z_index, t_index) of each tile
+
+        Returns:
+            (list(TileBuffer|io.BufferedReader)): The encoded tiles, in the order of tile_indices
+
+        """
+        return [self.process(file_path, x_index, y_index, z_index, t_index)
+                for x_index, y_index, z_index, t_index in tile_indices]
+
+
+    def get_slice(self, file_path, frame, loader):
+        """
+        Method to get a decoded slice through the processor's LRU slice cache
+
+        The cache is created on first use. Its memory budget is slice_cache_mb if set, otherwise the optional
+        "slice_cache_mb" parameter, which defaults to DEFAULT_SLICE_CACHE_MB. The budget applies to each worker
+        process. Set it to 0 to disable caching.
+
+        Args:
+            file_path(str): The file containing the slice
+            frame: Identifies the slice within the file, e.g. a page or time index. None for the whole file
+            loader(callable): Called without arguments to decode the slice on a miss
+
+        Returns:
+            (numpy.ndarray|PIL.Image.Image): The decoded slice
+        """
+        if self.slice_cache is None:
+            cache_mb = self.slice_cache_mb
+            if cache_mb is None:
+                cache_mb = DEFAULT_SLICE_CACHE_MB
+                if self.parameters and "slice_cache_mb" in self.parameters:
+                    cache_mb = self.parameters["slice_cache_mb"]
+            self.slice_cache = SliceCache(int(cache_mb * 1024 * 1024))
+
+        return self.slice_cache.get(file_path, frame, loader)
+
 
 class TestTileProcessor(TileProcessor):
     """Example processor for unit tests"""
@@ -114,6 +171,7 @@ class TestRandomTileProcessor(TileProcessor):
             None
         """
         self.parameters = parameters
+        self.encoder = TileEncoder.from_parameters(parameters, "TIFF")
 
     def process(self, file_path, x_index, y_index, z_index, t_index=None):
         """
@@ -127,13 +185,12 @@ class TestRandomTileProcessor(TileProcessor):
             t_index(int): The time index
 
         Returns:
-            (io.BufferedReader): A file handle for the specified tile
+            (TileBuffer): The encoded tile
 
         """
         tile = np.random.randint(1, 254, size=(self.parameters["ingest_job"]["tile_size"]["y"],
                                                self.parameters["ingest_job"]["tile_size"]["x"]), dtype=np.uint8)
         tile_data = Image.fromarray(tile)
-        output = six.BytesIO()
-        tile_data.save(output, format="TIFF")
+        output = self.encoder.encode(tile_data)
 
         return output
@@ -0,0 +1,74 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.utils.aws import ClientFactory
+
+import os
+import threading
+import unittest
+
+try:
+    import mock
+except ImportError:
+    from unittest import mock
+
+
+class TestClientFactory(unittest.TestCase):
+
+    def test_config(self):
+        """Test clients are created with the tuned configuration"""
+        factory = ClientFactory.from_params({"max_pool_connections": 64, "retry_mode": "standard",
+                                             "max_attempts": 3, "read_timeout": 5, "unknown": True},
+                                            {"access_key": "key", "secret_key": "secret"}, region="us-west-2")
+        client = factory.client("s3")
+
+        assert client.meta.region_name == "us-west-2"
+        assert client.meta.config.max_pool_connections == 64
+        assert client.meta.config.retries == {"mode": "standard", "total_max_attempts": 3}
+        assert client.meta.config.read_timeout == 5
+        assert client._request_signer._credentials.access_key == "key"
+
+    def test_region(self):
+        """Test a configured region takes precedence and boto3 resolves the region if none is given"""
+        assert ClientFactory.from_params({"region": "eu-west-1"}, region="us-west-2").region == "eu-west-1"
+
+        with mock.patch.dict(os.environ, {"AWS_DEFAULT_REGION": "ap-southeast-2"}):
+            factory = ClientFactory.from_params()
+            assert factory.region is None
+            assert factory.client("s3").meta.region_name == "ap-southeast-2"
+
+    def test_endpoint(self):
+        """Test endpoints can be set for all services or per service"""
+        factory = ClientFactory(region="us-east-1", endpoint_url="http://localhost:9000")
+        assert factory.client("s3").meta.endpoint_url == "http://localhost:9000"
+        assert factory.client("sqs").meta.endpoint_url == "http://localhost:9000"
+
+        factory = ClientFactory(region="us-east-1", endpoint_url={"s3": "http://localhost:9000"})
+        assert factory.client("s3").meta.endpoint_url == "http://localhost:9000"
+        assert "amazonaws.com" in factory.client("sqs").meta.endpoint_url
+
+    def test_per_thread(self):
+        """Test clients and resources are reused within a thread but not shared between threads"""
+        factory = ClientFactory()
+        client = factory.client("s3")
+        resource = factory.resource("s3")
+        assert factory.client("s3") is client
+        assert factory.resource("s3") is resource
+        assert resource is not client
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(factory.client("s3")))
+        thread.start()
+        thread.join()
+        assert other[0] is not client
@@ -13,14 +13,24 @@
 # limitations under the License.
 from __future__ import absolute_import
 from ingestclient.core.backend import BossBackend, Backend
+from ingestclient.core.heartbeat import VisibilityHeartbeat
 from ingestclient.test.aws import Setup
+from ingestclient.utils.encoder import TileBuffer
 
+import copy
 import os
 import unittest
 import json
 import responses
 from pkg_resources import resource_filename
 import six
+import threading
+import time
+import botocore
+try:
+    import mock
+except ImportError:
+    from unittest import mock
 
 
 class ResponsesMixin(object):
@@ -82,6 +92,47 @@ class BossBackendTestMixin(object):
         b.setup_upload_queue(self.aws_creds, self.queue_url)
 
         assert b.queue.url == self.queue_url
+        assert b.queue.meta.client.meta.region_name == "us-east-1"
+
+    def test_setup_upload_queue_unreadable(self):
+        """Test connecting to an upload queue whose attributes can't be read fails instead of guessing"""
+        b = BossBackend(self.example_config_data)
+        b.setup(self.api_token)
+        b.connect_attempts = 1
+
+        with self.assertRaises(Exception):
+            b.setup_upload_queue(self.aws_creds, self.queue_url + "-missing")
+        assert b.queue is None
+
+    def test_receive_tasks_retry(self):
+        """Test transient errors receiving tasks are retried"""
+        b = BossBackend(self.example_config_data)
+        b.setup(self.api_token)
+        self.setup_helper.add_tasks(self.aws_creds["access_key"], self.aws_creds['secret_key'], self.queue_url, b)
+        b.join(23)
+
+        error = botocore.exceptions.ClientError({"Error": {"Code": "ThrottlingException"}}, "ReceiveMessage")
+        receive_messages = b.queue.receive_messages
+        failures = []
+
+        def flaky_receive(**kwargs):
+            if len(failures) < 2:
+                failures.append(kwargs)
+                raise error
+            return receive_messages(**kwargs)
+
+        b.queue.receive_messages = flaky_receive
+        with mock.patch("time.sleep") as sleep:
+            b._receive_tasks(1)
+        assert len(failures) == 2
+        assert sleep.call_count == 2
+        assert len(b.task_buffer) == 1
+
+        failures[:] = []
+        b.receive_attempts = 2
+        with mock.patch("time.sleep"):
+            with self.assertRaises(botocore.exceptions.ClientError):
+                b._receive_tasks(1)
 
     def test_create(self):
         """Test creating an ingest job - mock server response"""
@@ -110,6 +161,27 @@ class BossBackendTestMixin(object):
         assert 'STATEIO_CONFIG' in params
         assert 'ingest_queue' in params
 
+    def test_session(self):
+        """Test requests to the ingest service share a session that retries idempotent requests"""
+        config_data = copy.deepcopy(self.example_config_data)
+        config_data["client"]["backend"]["request_timeout"] = [5, 30]
+        config_data["client"]["backend"]["request_retries"] = 2
+        config_data["client"]["backend"]["request_backoff"] = 0
+        b = BossBackend(config_data)
+        b.setup(self.api_token)
+        assert b.request_timeout == (5, 30)
+
+        responses.add(responses.GET, 'https://api.theboss.io/latest/ingest/23/status', status=503)
+        responses.add(responses.GET, 'https://api.theboss.io/latest/ingest/23/status',
+                      json={"current_message_count": 4}, status=200)
+        assert b.get_job_status(23) == {"current_message_count": 4}
+        assert len(responses.calls) == 2
+
+        adapter = b.session.get_adapter('https://api.theboss.io')
+        assert adapter.max_retries.total == 2
+        assert "POST" not in (getattr(adapter.max_retries, "allowed_methods", None) or
+                              adapter.max_retries.method_whitelist)
+
     def test_delete(self):
         """Test deleting an existing ingest job - mock server response"""
         b = BossBackend(self.example_config_data)
@@ -138,6 +210,141 @@ class BossBackendTestMixin(object):
         assert isinstance(rx_handle, str)
         assert msg_body == self.setup_helper.test_msg[1]
 
+    def test_get_task_prefetch(self):
+        """Test tasks are received in a batch and released when unprocessed"""
+        b = BossBackend(self.example_config_data)
+        b.setup(self.api_token)
+
+        # Put some stuff on the task queue
+        self.setup_helper.add_tasks(self.aws_creds["access_key"], self.aws_creds['secret_key'], self.queue_url, b)
+
+        b.join(23)
+        assert b.visibility_timeout == 500
+
+        msg_id, rx_handle, msg_body = b.get_task()
+        assert msg_body == self.setup_helper.test_msg[0]
+        assert len(b.task_buffer) == 3
+
+        # Remaining tasks are handed out from the buffer
+        msg_id, rx_handle, msg_body = b.get_task()
+        assert msg_body == self.setup_helper.test_msg[1]
+        assert len(b.task_buffer) == 2
+
+        # Unprocessed tasks go back to the queue
+        b.release_buffered_tasks()
+        assert len(b.task_buffer) == 0
+
+        msg_id, rx_handle, msg_body = b.get_task()
+        assert msg_body in self.setup_helper.test_msg[2:]
+        assert len(b.task_buffer) == 1
+
+    def test_get_task_short_visibility(self):
+        """Test prefetching on a queue with a short visibility timeout takes one receive per batch of tasks"""
+        b = BossBackend(self.example_config_data)
+        b.setup(self.api_token)
+
+        self.setup_helper.add_tasks(self.aws_creds["access_key"], self.aws_creds['secret_key'], self.queue_url, b)
+        b.join(23)
+        body = json.dumps(self.setup_helper.test_msg[0])
+        for start in range(0, 16, 8):
+            b.queue.send_messages(Entries=[{"Id": str(idx), "MessageBody": body} for idx in range(start, start + 8)])
+        b.visibility_timeout = 30  # The SQS default
+
+        calls = []
+        receive_tasks, change_task_visibility = b._receive_tasks, b.change_task_visibility
+        b._receive_tasks = lambda *args: calls.append("receive") or receive_tasks(*args)
+        b.change_task_visibility = lambda *args: calls.append("change") or change_task_visibility(*args)
+
+        tasks = [b.get_task(wait=False) for _ in range(20)]
+        assert all(msg for _, _, msg in tasks)
+        assert calls == ["receive", "receive"]
+
+    def test_prefetch_depth(self):
+        """Test fewer tasks are prefetched when they wouldn't all be handed out before their visibility runs out"""
+        b = BossBackend(self.example_config_data)
+        b.visibility_timeout = 30
+        assert b.get_visibility_margin() == 10
+        assert b.get_prefetch_depth(10) == 10
+
+        b.task_interval = 5
+        assert b.get_prefetch_depth(10) == 4
+        b.task_interval = 60
+        assert b.get_prefetch_depth(10) == 1
+        b.task_interval = 0.1
+        assert b.get_prefetch_depth(10) == 10
+
+    def test_get_task_expiring(self):
+        """Test buffered tasks that are about to become visible again are released or extended"""
+        b = BossBackend(self.example_config_data)
+        b.setup(self.api_token)
+        b.join(23)
+
+        b.change_task_visibility = lambda handles, timeout: calls.append((list(handles), timeout)) or []
+        calls = []
+
+        now = time.time()
+        b.task_buffer.extend([("id1", "rx1", json.dumps({"tile_key": "1"}), now - 1),
+                              ("id2", "rx2", json.dumps({"tile_key": "2"}), now + 5),
+                              ("id3", "rx3", json.dumps({"tile_key": "3"}), now + 10),
+                              ("id4", "rx4", json.dumps({"tile_key": "4"}), now + 400)])
+
+        msg_id, rx_handle, msg_body = b.get_task()
+
+        # Expired task was dropped, the next one extended and the other expiring one released
+        assert msg_id == "id2"
+        assert calls == [(["rx2"], 500), (["rx3"], 0)]
+        assert [task[0] for task in b.task_buffer] == ["id4"]
+
+    def test_delete_tasks(self):
+        """Test tasks are removed from the upload queue in a batch"""
+        b = BossBackend(self.example_config_data)
+        b.setup(self.api_token)
+
+        self.setup_helper.add_tasks(self.aws_creds["access_key"], self.aws_creds['secret_key'], self.queue_url, b)
+        b.join(23)
+
+        receipt_handles = [b.get_task()[1], b.get_task()[1]]
+        b.queue.reload()
+        in_flight = int(b.queue.attributes["ApproximateNumberOfMessagesNotVisible"])
+
+        assert b.delete_tasks(receipt_handles) == []
+        b.queue.reload()
+        assert int(b.queue.attributes["ApproximateNumberOfMessagesNotVisible"]) == in_flight - 2
+
+    def test_change_visibility_thread(self):
+        """Test the visibility heartbeat extends tasks with its own thread's SQS client"""
+        b = BossBackend(self.example_config_data)
+        b.setup(self.api_token)
+
+        self.setup_helper.add_tasks(self.aws_creds["access_key"], self.aws_creds['secret_key'], self.queue_url, b)
+        b.join(23)
+
+        heartbeat = VisibilityHeartbeat(b, interval=b.get_visibility_margin())
+        heartbeat.track(b.get_task()[1])
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append((heartbeat.beat(), b.sqs_clients.client('sqs'))))
+        thread.start()
+        thread.join()
+
+        extended, client = results[0]
+        assert extended == 1
+        assert client is not b.sqs_clients.client('sqs')
+
+    def test_put_tile(self):
+        """Test uploading encoded tiles and legacy file handles"""
+        b = BossBackend(self.example_config_data)
+        b.setup(self.api_token)
+        b.join(23)
+
+        b.put_tile("tile_buffer", TileBuffer(b"encoded tile"), {"message_id": "1"})
+        b.put_tile("file_handle", six.BytesIO(b"file handle"), {"message_id": "2"})
+
+        obj = b.bucket.Object("tile_buffer").get()
+        assert obj["Body"].read() == b"encoded tile"
+        assert obj["Metadata"] == {"message_id": "1"}
+        assert b.bucket.Object("file_handle").get()["Body"].read() == b"file handle"
+
     def test_encode_tile_key(self):
         """Test encoding an object key"""
         b = BossBackend(self.example_config_data)
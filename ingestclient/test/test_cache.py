@@ -0,0 +1,78 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.utils.cache import SliceCache, estimate_size
+
+import unittest
+import numpy as np
+from PIL import Image
+
+
+class TestSliceCache(unittest.TestCase):
+
+    def test_hit_miss(self):
+        """Test slices are loaded once and counted"""
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return np.zeros((10, 10), dtype=np.uint8)
+
+        cache = SliceCache(1000)
+        first = cache.get("a.png", 0, loader)
+        second = cache.get("a.png", 0, loader)
+
+        assert first is second
+        assert len(loads) == 1
+        assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "entries": 1, "bytes": 100}
+
+        # A different frame of the same file is a different slice
+        cache.get("a.png", 1, loader)
+        assert len(loads) == 2
+
+    def test_lru_eviction(self):
+        """Test the least recently used slice is evicted once the budget is exceeded"""
+        cache = SliceCache(250)
+        for name in ["a", "b"]:
+            cache.get(name, None, lambda: np.zeros(100, dtype=np.uint8))
+
+        # Touch "a" so "b" is the least recently used
+        cache.get("a", None, lambda: None)
+        cache.get("c", None, lambda: np.zeros(100, dtype=np.uint8))
+
+        stats = cache.stats()
+        assert stats["evictions"] == 1
+        assert stats["bytes"] == 200
+
+        loads = []
+        cache.get("a", None, lambda: loads.append("a"))
+        assert loads == []
+        cache.get("b", None, lambda: loads.append("b") or np.zeros(100, dtype=np.uint8))
+        assert loads == ["b"]
+
+    def test_oversized(self):
+        """Test slices larger than the budget are returned but not cached"""
+        cache = SliceCache(10)
+        data = cache.get("a", None, lambda: np.zeros(100, dtype=np.uint8))
+
+        assert data.shape == (100,)
+        assert cache.stats()["entries"] == 0
+        assert cache.stats()["bytes"] == 0
+
+    def test_estimate_size(self):
+        """Test estimating the decoded size of arrays and images"""
+        assert estimate_size(np.zeros((4, 4), dtype=np.uint16)) == 32
+        assert estimate_size(Image.new("L", (4, 4))) == 16
+        assert estimate_size(Image.new("I;16", (4, 4))) == 32
+        assert estimate_size(Image.new("RGB", (4, 4))) == 64
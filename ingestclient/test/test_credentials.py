@@ -0,0 +1,76 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.core.credentials import CredentialRefresher
+
+import time
+import unittest
+
+
+class FakeEngine(object):
+    def __init__(self, results):
+        self.results = list(results)
+        self.calls = 0
+
+    def renew_credentials(self):
+        self.calls += 1
+        result = self.results.pop(0) if self.results else False
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class TestCredentialRefresher(unittest.TestCase):
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_refresh(self):
+        """Test the refresh callback only runs after a renewal"""
+        refreshed = []
+        refresher = CredentialRefresher(FakeEngine([False, True]), on_refresh=lambda: refreshed.append(True))
+
+        assert not refresher.refresh()
+        assert refreshed == []
+        assert refresher.refresh()
+        assert refreshed == [True]
+        assert refresher.refreshes == 1
+
+    def test_thread(self):
+        """Test credentials are renewed in the background"""
+        engine = FakeEngine([False, True])
+        refresher = CredentialRefresher(engine, interval=0.01)
+        refresher.start()
+        try:
+            assert self.wait_for(lambda: refresher.refreshes == 1)
+        finally:
+            refresher.stop()
+
+        calls = engine.calls
+        time.sleep(0.05)
+        assert engine.calls == calls
+
+    def test_retry(self):
+        """Test a failed renewal doesn't stop the refresher"""
+        engine = FakeEngine([Exception("Service unavailable"), True])
+        refresher = CredentialRefresher(engine, interval=0.01)
+        refresher.start()
+        try:
+            assert self.wait_for(lambda: refresher.refreshes == 1)
+        finally:
+            refresher.stop()
+        assert engine.calls >= 2
@@ -0,0 +1,116 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.utils.encoder import TileBuffer, TileEncoder, benchmark
+
+import base64
+import hashlib
+import os
+import six
+import tempfile
+import unittest
+from PIL import Image
+import numpy as np
+
+
+class TestTileBuffer(unittest.TestCase):
+
+    def test_length_md5(self):
+        """Test the length and MD5 are computed up front"""
+        tile = TileBuffer(b"0123456789")
+        assert tile.num_bytes == 10
+        assert tile.md5 == hashlib.md5(b"0123456789").digest()
+        assert base64.b64decode(tile.content_md5) == tile.md5
+        assert tile.getvalue() is tile.data
+
+    def test_file_interface(self):
+        """Test the buffer can be read like a file"""
+        tile = TileBuffer(b"0123456789")
+        assert tile.read(4) == b"0123"
+        assert tile.tell() == 4
+        assert tile.read() == b"456789"
+        assert tile.read(3) == b""
+
+        tile.seek(-3, os.SEEK_END)
+        assert tile.read() == b"789"
+        tile.seek(0)
+        tile.seek(2, os.SEEK_CUR)
+        assert tile.read(1) == b"2"
+
+    def test_from_handle(self):
+        """Test wrapping the file handles legacy tile processors return"""
+        data = b"tile data"
+        handle = six.BytesIO(data)
+        handle.seek(4)
+        tile = TileBuffer.from_handle(handle)
+        assert tile.getvalue() == data
+        assert TileBuffer.from_handle(tile) is tile
+
+        with tempfile.TemporaryFile() as file_handle:
+            file_handle.write(data)
+            assert TileBuffer.from_handle(file_handle).getvalue() == data
+
+
+class TestTileEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.tile = (np.arange(64 * 64) % 4096).astype(np.uint16).reshape(64, 64)
+
+    def test_image_formats(self):
+        """Test PIL formats round trip from arrays and images"""
+        for upload_format, options in [("png", {}), ("png", {"compress_level": 1, "png_strategy": "rle"}),
+                                       ("tif", {}), ("tiff", {"tiff_compression": "packbits"})]:
+            encoder = TileEncoder(upload_format, **options)
+            for tile in [self.tile, Image.fromarray(self.tile)]:
+                handle = encoder.encode(tile)
+                handle.seek(0)
+                np.testing.assert_array_equal(np.array(Image.open(handle)), self.tile)
+
+    def test_compress_level(self):
+        """Test the PNG compression level is applied"""
+        fast = TileEncoder("png", compress_level=0).encode(self.tile).getvalue()
+        small = TileEncoder("png", compress_level=9).encode(self.tile).getvalue()
+        assert len(small) < len(fast)
+
+    def test_array_formats(self):
+        """Test NPZ and RAW tiles hold the array data"""
+        for compress_level in [None, 0]:
+            handle = TileEncoder("npz", compress_level=compress_level).encode(self.tile)
+            handle.seek(0)
+            np.testing.assert_array_equal(np.load(handle)["data"], self.tile)
+
+        raw = TileEncoder("raw").encode(Image.fromarray(self.tile)).getvalue()
+        np.testing.assert_array_equal(np.frombuffer(raw, dtype=np.uint16).reshape(64, 64), self.tile)
+
+    def test_from_parameters(self):
+        """Test creating an encoder from plugin parameters"""
+        encoder = TileEncoder.from_parameters({"compress_level": 3}, "tif")
+        assert encoder.upload_format == "TIFF"
+        assert encoder.compress_level == 3
+
+        encoder = TileEncoder.from_parameters({"upload_format": "PNG"}, "tif")
+        assert encoder.upload_format == "PNG"
+
+        with self.assertRaises(Exception):
+            TileEncoder("bmp")
+
+        with self.assertRaises(Exception):
+            TileEncoder("png", png_strategy="best")
+
+    def test_benchmark(self):
+        """Test benchmark results are reported per encoder"""
+        results = benchmark({"png": TileEncoder("png"), "raw": TileEncoder("raw")}, [self.tile], repeat=1)
+        assert sorted(results) == ["png", "raw"]
+        assert results["raw"]["ratio"] == 1.0
+        assert results["png"]["mb_per_sec"] > 0
@@ -16,6 +16,8 @@ from ingestclient.core.engine import Engine
 from ingestclient.core.validator import Validator, BossValidatorV01
 from ingestclient.core.backend import Backend, BossBackend
 from ingestclient.core.config import Configuration, ConfigFileError
+from ingestclient.core.upload import UploadResult
+from ingestclient.utils.ledger import UploadLedger
 from ingestclient.test.aws import Setup
 
 import os
@@ -24,7 +26,10 @@ import json
 import responses
 from pkg_resources import resource_filename
 import tempfile
+import shutil
+import time
 import boto3
+import six
 
 
 class ResponsesMixin(object):
@@ -121,6 +126,7 @@ class EngineBossTestMixin(object):
         """Test getting a task from the upload queue"""
         engine = Engine(self.config_file, self.api_token, 23)
         engine.msg_wait_iterations = 2
+        engine.backend.receive_wait_time = 1
 
         # Put some stuff on the task queue
         self.setup_helper.add_tasks(self.aws_creds["access_key"], self.aws_creds['secret_key'], self.queue_url, engine.backend)
@@ -139,6 +145,312 @@ class EngineBossTestMixin(object):
                 # Make sure the key was valid an data was loaded into the file handles
                 assert data.tell() == 182300
 
+    def test_run_by_source(self):
+        """Test running the upload loop while grouping tasks by source file"""
+        engine = Engine(self.config_file, self.api_token, 23)
+        engine.msg_wait_iterations = 1
+        engine.backend.receive_wait_time = 1
+        engine.schedule_by_source = True
+
+        # Start from an empty tile bucket
+        s3 = boto3.resource('s3')
+        tile_bucket = s3.Bucket(self.tile_bucket_name)
+        tile_bucket.objects.all().delete()
+
+        # Put some stuff on the task queue
+        self.setup_helper.add_tasks(self.aws_creds["access_key"], self.aws_creds['secret_key'], self.queue_url, engine.backend)
+
+        engine.join()
+        engine.run()
+
+        keys = sorted(obj.key for obj in tile_bucket.objects.all())
+        assert keys == sorted(msg["tile_key"] for msg in self.setup_helper.test_msg)
+
+    @unittest.skipIf(six.PY2, "The asyncio engine requires Python 3")
+    def test_run_asyncio(self):
+        """Test running the upload loop with the asyncio engine"""
+        from ingestclient.core.async_engine import AsyncEngine
+
+        engine = AsyncEngine(self.config_file, self.api_token, 23)
+        engine.msg_wait_iterations = 1
+        engine.backend.receive_wait_time = 1
+        engine.async_concurrency = 2
+
+        # Start from an empty tile bucket
+        s3 = boto3.resource('s3')
+        tile_bucket = s3.Bucket(self.tile_bucket_name)
+        tile_bucket.objects.all().delete()
+
+        # Put some stuff on the task queue
+        self.setup_helper.add_tasks(self.aws_creds["access_key"], self.aws_creds['secret_key'], self.queue_url, engine.backend)
+
+        engine.join()
+        engine.run()
+
+        keys = sorted(obj.key for obj in tile_bucket.objects.all())
+        assert keys == sorted(msg["tile_key"] for msg in self.setup_helper.test_msg)
+
+
+class FakeVisibilityBackend(object):
+    """Records visibility changes instead of calling SQS"""
+    def __init__(self):
+        self.calls = []
+        self.deleted = []
+
+    def get_identity(self):
+        return "fake://"
+
+    def change_task_visibility(self, receipt_handles, timeout):
+        self.calls.append((sorted(receipt_handles), timeout))
+        return []
+
+    def delete_tasks(self, receipt_handles):
+        self.deleted.extend(receipt_handles)
+        return []
+
+
+class TestTaskRelease(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = Engine()
+        self.engine.backend = FakeVisibilityBackend()
+        self.key_parts = {"x_index": 0, "y_index": 0, "z_index": 0, "t_index": 0}
+
+    def result(self, tile_key, receipt_handle, error=None):
+        return UploadResult((tile_key, self.key_parts, receipt_handle), None, error, 0.1, 10)
+
+    def test_failed_uploads(self):
+        """Test failed uploads are released in one batch, with a backoff per tile"""
+        self.engine.begin_tasks([("m1", "rx1", {}), ("m2", "rx2", {}), ("m3", "rx3", {})])
+        self.engine._handle_upload_results([self.result("t1", "rx1", Exception("failed")),
+                                            self.result("t2", "rx2", Exception("failed")),
+                                            self.result("t3", "rx3")])
+
+        assert self.engine.backend.calls == [(["rx1", "rx2"], 5)]
+        assert self.engine.in_progress == set()
+
+        # The delay doubles for a tile that keeps failing, up to the maximum
+        self.engine.max_failed_task_delay = 12
+        self.engine._handle_upload_results([self.result("t1", "rx4", Exception("failed"))])
+        self.engine._handle_upload_results([self.result("t1", "rx5", Exception("failed"))])
+        assert self.engine.backend.calls[1:] == [(["rx4"], 10), (["rx5"], 12)]
+
+        # A success resets the backoff
+        self.engine._handle_upload_results([self.result("t1", "rx6")])
+        self.engine._handle_upload_results([self.result("t1", "rx7", Exception("failed"))])
+        assert self.engine.backend.calls[-1] == (["rx7"], 5)
+
+    def test_release_in_progress(self):
+        """Test unfinished tasks are made visible right away"""
+        self.engine.release_in_progress()
+        assert self.engine.backend.calls == []
+
+        self.engine.begin_tasks([("m1", "rx1", {}), ("m2", "rx2", {})])
+        self.engine._handle_upload_results([self.result("t1", "rx1")])
+        self.engine.release_in_progress()
+
+        assert self.engine.backend.calls == [(["rx2"], 0)]
+        assert self.engine.in_progress == set()
+
+
+class TestLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = Engine(ingest_job_id=23)
+        self.engine.backend = FakeVisibilityBackend()
+        self.engine.ledger_path = os.path.join(self.directory, "ledger.sqlite")
+        self.engine.open_ledger()
+        self.key_parts = {"x_index": 0, "y_index": 0, "z_index": 0, "t_index": 0}
+
+    def tearDown(self):
+        self.engine.close_ledger()
+        shutil.rmtree(self.directory)
+
+    def test_skip_completed(self):
+        """Test tiles recorded as uploaded are skipped and their tasks deleted"""
+        self.engine._handle_upload_results([
+            UploadResult(("t1", self.key_parts, "rx1"), {"ETag": '"abc"'}, None, 0.5, 100, 1),
+            UploadResult(("t2", self.key_parts, "rx2"), None, Exception("failed"), 1.5, 100, 5)])
+
+        tasks = [("m1", "rx3", {"tile_key": "t1"}), ("m2", "rx4", {"tile_key": "t2"})]
+        assert self.engine.skip_completed_tasks(tasks) == tasks[1:]
+        assert self.engine.backend.deleted == ["rx3"]
+
+        # Another job's uploads don't count
+        self.engine.ingest_job_id = 24
+        assert self.engine.skip_completed_tasks(tasks) == tasks
+
+    def test_shared(self):
+        """Test uploads recorded by one engine are visible to another using the same ledger"""
+        self.engine._handle_upload_results([
+            UploadResult(("t1", self.key_parts, "rx1"), {"ETag": '"abc"'}, None, 0.5, 100, 1)])
+
+        ledger = UploadLedger(self.engine.ledger_path)
+        assert ledger.is_uploaded(23, "t1", "fake://")
+        assert not ledger.is_uploaded(23, "t1")
+        ledger.close()
+
+
+class FakeStatusBackend(object):
+    """Returns job statuses from a list"""
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+
+    def get_job_status(self, ingest_job_id):
+        return self.statuses.pop(0)
+
+
+class FakeProcess(object):
+    def __init__(self, pid, alive=True):
+        self.pid = pid
+        self.alive = alive
+
+    def is_alive(self):
+        return self.alive
+
+
+class TestWorkerProgress(unittest.TestCase):
+
+    def progress(self, tiles, seconds, stage="upload"):
+        return {"pid": 1, "time": 1000.0 + seconds, "tiles": tiles, "errors": 0, "bytes_out": tiles * 10,
+                "in_progress": 1, "stage": stage, "stage_seconds": 0.0}
+
+    def test_report(self):
+        """Test workers report progress more often than full stats"""
+        engine = Engine()
+        reports = []
+        engine.stats_reporter = lambda tag, payload: reports.append((tag, payload))
+
+        engine.set_stage("process")
+        engine.report_stats()
+        engine.report_stats()
+        assert [tag for tag, _ in reports] == ["progress", "stats"]
+        assert reports[0][1]["stage"] == "process"
+        assert "counts" in reports[1][1]["stages"]["upload"]
+
+        engine.last_progress_report = 0
+        engine.report_stats()
+        assert [tag for tag, _ in reports] == ["progress", "stats", "progress"]
+
+    def test_throughput(self):
+        """Test local throughput is summed over workers"""
+        engine = Engine()
+        engine.update_worker_progress(1, self.progress(0, 0))
+        engine.update_worker_progress(1, self.progress(100, 10))
+        engine.update_worker_progress(2, self.progress(0, 0))
+        engine.update_worker_progress(2, self.progress(50, 10))
+
+        assert engine.get_local_throughput() == 15.0
+
+    def test_stalled(self):
+        """Test workers without progress are reported as stalled, unless they are waiting for tasks"""
+        engine = Engine()
+        engine.stall_timeout = 60
+        workers = [(FakeProcess(pid), None) for pid in [1, 2, 3, 4]]
+
+        engine.update_worker_progress(1, self.progress(10, 0))
+        engine.update_worker_progress(1, self.progress(10, 5))
+        engine.update_worker_progress(2, self.progress(10, 0, "wait"))
+        engine.update_worker_progress(3, self.progress(10, 0))
+        engine.update_worker_progress(4, self.progress(10, 0))
+        assert engine.get_stalled_workers(workers) == []
+
+        for pid in [1, 2, 3]:
+            engine.worker_progress[pid]["advanced"] -= 100
+        engine.worker_progress[4]["received"] -= 100
+        engine.update_worker_progress(3, self.progress(20, 10))
+
+        assert engine.get_stalled_workers(workers) == [1, 4]
+
+        workers[0][0].alive = False
+        assert engine.get_stalled_workers(workers) == [4]
+
+    def test_long_stage(self):
+        """Test a worker that keeps processing tasks within one long stage isn't reported as stalled"""
+        engine = Engine()
+        engine.stall_timeout = 60
+        workers = [(FakeProcess(1), None)]
+
+        engine.update_worker_progress(1, dict(self.progress(10, 0, "process"), processed=5))
+        engine.worker_progress[1]["advanced"] -= 100
+        engine.update_worker_progress(1, dict(self.progress(10, 90, "process"), processed=6))
+        assert engine.get_stalled_workers(workers) == []
+
+        engine.worker_progress[1]["advanced"] -= 100
+        engine.update_worker_progress(1, dict(self.progress(10, 180, "process"), processed=6))
+        assert engine.get_stalled_workers(workers) == [1]
+
+    def test_report_per_task(self):
+        """Test progress is reported after each processed task, including ones that fail"""
+        engine = Engine()
+        engine.progress_report_interval = 0
+        engine.stats_report_interval = 1000
+        engine.last_stats_report = time.time()
+        reports = []
+        engine.stats_reporter = lambda tag, payload: reports.append((tag, payload))
+
+        def process_task(message_id, receipt_handle, msg):
+            if msg["fail"]:
+                raise Exception("Can't read the tile")
+            return {}, None, 10, {}
+        engine.process_task = process_task
+
+        tasks = [("id{}".format(i), "handle{}".format(i), {"tile_key": "key{}".format(i), "fail": i == 1})
+                 for i in range(3)]
+        processed, failed = engine.process_tasks(tasks)
+        assert len(processed) == 2
+        assert len(failed) == 1
+        assert [payload["processed"] for tag, payload in reports if tag == "progress"] == [1, 2, 3]
+
+    def test_idle(self):
+        """Test workers are idle once all are waiting for tasks with nothing in progress"""
+        engine = Engine()
+        workers = [(FakeProcess(pid), None) for pid in [1, 2, 3]]
+
+        engine.update_worker_progress(1, dict(self.progress(10, 0, "wait"), in_progress=0))
+        engine.update_worker_progress(2, dict(self.progress(10, 0, "done"), in_progress=0))
+        assert not engine.are_workers_idle(workers)
+
+        engine.update_worker_progress(3, self.progress(10, 0, "wait"))
+        assert not engine.are_workers_idle(workers)
+
+        engine.update_worker_progress(3, dict(self.progress(10, 0, "wait"), in_progress=0, retry_seconds=5))
+        assert not engine.are_workers_idle(workers)
+
+        engine.update_worker_progress(3, dict(self.progress(10, 0, "wait"), in_progress=0))
+        assert engine.are_workers_idle(workers)
+
+        engine.update_worker_progress(2, self.progress(10, 0, "upload"))
+        workers[1][0].alive = False
+        assert engine.are_workers_idle(workers)
+
+    def test_job_done(self):
+        """Test an engine on its own stops once the job status shows no tasks, and a worker once signaled"""
+        engine = Engine()
+        engine.backend = FakeStatusBackend([{"current_message_count": 0}, {"current_message_count": 3},
+                                            {"current_message_count": 0}, {"current_message_count": 0}])
+        assert not engine.check_job_done()
+        assert not engine.check_job_done()
+        assert not engine.check_job_done()
+        assert engine.check_job_done()
+
+        engine = Engine()
+        engine.backend = FakeStatusBackend([{"status": 2, "current_message_count": 5}] * 2)
+        engine.retry_deadline = time.time() + 60
+        assert not engine.check_job_done()
+        engine.retry_deadline = 0
+        assert not engine.check_job_done()
+        assert engine.check_job_done()
+
+        engine = Engine()
+        engine.wait_for_master = True
+        engine.backend = FakeStatusBackend([])
+        assert not engine.check_job_done()
+        engine.job_done.set()
+        assert engine.check_job_done()
+        assert engine.backend.statuses == []
+
 
 class TestBossEngine(EngineBossTestMixin, ResponsesMixin, unittest.TestCase):
 
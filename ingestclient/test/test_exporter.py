@@ -0,0 +1,119 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.core.engine import Engine
+from ingestclient.core.exporter import MetricsExporter
+from ingestclient.core.metrics import EngineMetrics
+
+from six.moves.urllib.request import urlopen
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def worker_stats(tiles, uptime):
+    metrics = EngineMetrics()
+    metrics.increment("tiles", tiles)
+    metrics.increment("bytes_out", tiles * 100)
+    metrics.observe("upload", 0.05)
+    stats = metrics.snapshot(counts=True)
+    stats["uptime"] = uptime
+    stats["gauges"] = {"in_progress": 2, "uploads_in_flight": 1}
+    stats["cache"] = {"hits": 3, "misses": 1, "evictions": 0, "entries": 1, "bytes": 100}
+    return stats
+
+
+class TestMetricsExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_render(self):
+        """Test worker and job metrics are formatted for Prometheus"""
+        exporter = MetricsExporter()
+        exporter.hostname = "host1"
+        exporter.update_job({"current_message_count": 50, "total_message_count": 100})
+        exporter.update_worker(123, worker_stats(10, 10.0))
+        exporter.update_worker(123, worker_stats(30, 20.0))
+
+        lines = exporter.render().splitlines()
+        assert 'ingest_job_tiles_remaining{host="host1"} 50.0' in lines
+        assert 'ingest_worker_tiles_total{host="host1",worker="123"} 30.0' in lines
+        assert 'ingest_worker_tiles_per_second{host="host1",worker="123"} 2.0' in lines
+        assert 'ingest_worker_bytes_per_second{host="host1",worker="123"} 200.0' in lines
+        assert 'ingest_worker_uploads_in_flight{host="host1",worker="123"} 1.0' in lines
+        assert 'ingest_worker_slice_cache_hits_total{host="host1",worker="123"} 3.0' in lines
+        assert '# TYPE ingest_worker_stage_seconds histogram' in lines
+        assert 'ingest_worker_stage_seconds_bucket{host="host1",worker="123",stage="upload",le="+Inf"} 1' in lines
+        assert 'ingest_worker_stage_seconds_count{host="host1",worker="123",stage="upload"} 1' in lines
+
+        # Buckets are cumulative
+        buckets = [line for line in lines if line.startswith('ingest_worker_stage_seconds_bucket') and
+                   'stage="upload"' in line]
+        assert buckets[0].endswith(" 0")
+        assert buckets[-2].endswith(" 1")
+
+    def test_forget(self):
+        """Test forgotten workers are no longer published, while the master and other workers are"""
+        exporter = MetricsExporter()
+        exporter.update_worker("master", Engine().get_stats(counts=True))
+        exporter.update_worker(123, worker_stats(10, 10.0))
+        exporter.update_worker(456, worker_stats(20, 10.0))
+
+        exporter.forget(123)
+        exporter.forget(789)
+        body = exporter.render()
+        assert 'worker="123"' not in body
+        assert 'ingest_worker_tiles_total{{host="{}",worker="456"}} 20.0'.format(exporter.hostname) in body
+        assert 'ingest_worker_tiles_total{{host="{}",worker="master"}} 0.0'.format(exporter.hostname) in body
+
+    def test_file_and_http(self):
+        """Test metrics are written to a file and served over HTTP"""
+        file_path = os.path.join(self.directory, "ingest.prom")
+        exporter = MetricsExporter(file_path, port=0)
+        exporter.update_worker(123, worker_stats(10, 10.0))
+        exporter.start()
+        try:
+            exporter.write()
+            with open(file_path) as metrics_file:
+                assert "ingest_worker_tiles_total" in metrics_file.read()
+
+            body = urlopen("http://127.0.0.1:{}/metrics".format(exporter.port)).read().decode("utf-8")
+            assert "ingest_worker_tiles_total" in body
+        finally:
+            exporter.stop()
+
+    def test_receive_worker_messages(self):
+        """Test the master collects stats sent over worker pipes"""
+        class FakeProcess(object):
+            pid = 123
+
+        master_end, worker_end = mp.Pipe()
+        worker_end.send(("stats", worker_stats(10, 10.0)))
+        worker_end.send(("stats", worker_stats(20, 20.0)))
+        worker_end.send(("progress", {"pid": 123, "time": 1000.0, "tiles": 20, "errors": 0, "bytes_out": 2000,
+                                      "in_progress": 2, "stage": "upload", "stage_seconds": 0.5}))
+
+        engine = Engine()
+        exporter = MetricsExporter()
+        engine.receive_worker_messages([(FakeProcess(), master_end)], 0, exporter)
+
+        assert engine.worker_stats[123]["counters"]["tiles"] == 20
+        assert exporter.workers["123"]["rates"]["tiles"] == 1.0
+        assert engine.worker_progress[123]["progress"]["stage"] == "upload"
@@ -0,0 +1,87 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.core.heartbeat import VisibilityHeartbeat
+
+import time
+import unittest
+
+
+class FakeBackend(object):
+    """Records visibility changes instead of calling SQS"""
+    def __init__(self):
+        self.visibility_timeout = 500
+        self.visibility_margin = 30
+        self.calls = []
+        self.failed = []
+
+    def get_visibility_margin(self):
+        return min(self.visibility_margin, self.visibility_timeout // 3)
+
+    def change_task_visibility(self, receipt_handles, timeout):
+        self.calls.append((sorted(receipt_handles), timeout))
+        return [handle for handle in receipt_handles if handle in self.failed]
+
+
+class TestVisibilityHeartbeat(unittest.TestCase):
+
+    def test_beat(self):
+        """Test only tasks close to becoming visible are extended, in one batch"""
+        backend = FakeBackend()
+        heartbeat = VisibilityHeartbeat(backend, interval=10)
+        heartbeat.track("rx1")
+        heartbeat.track("rx2")
+
+        # Tasks start with the backend's margin left, more than two intervals
+        assert heartbeat.beat() == 0
+        assert backend.calls == []
+
+        heartbeat.interval = 20
+        assert heartbeat.beat() == 2
+        assert backend.calls == [(["rx1", "rx2"], 500)]
+
+        # Extended tasks aren't due again until close to the new deadline
+        assert heartbeat.beat() == 0
+        assert heartbeat.extensions == 2
+
+    def test_untrack_and_failures(self):
+        """Test finished and unextendable tasks are no longer extended"""
+        backend = FakeBackend()
+        backend.failed = ["rx2"]
+        backend.visibility_timeout = 10
+        heartbeat = VisibilityHeartbeat(backend, interval=20)
+        for handle in ["rx1", "rx2", "rx3"]:
+            heartbeat.track(handle)
+        heartbeat.untrack("rx1")
+
+        assert heartbeat.beat() == 1
+        assert backend.calls == [(["rx2", "rx3"], 10)]
+
+        heartbeat.beat()
+        assert backend.calls[-1] == (["rx3"], 10)
+
+    def test_thread(self):
+        """Test the background thread beats until stopped"""
+        backend = FakeBackend()
+        backend.visibility_margin = 0
+        heartbeat = VisibilityHeartbeat(backend, interval=0.05)
+        heartbeat.track("rx1")
+        heartbeat.start()
+        time.sleep(0.3)
+        heartbeat.stop()
+
+        assert backend.calls
+        num_calls = len(backend.calls)
+        time.sleep(0.1)
+        assert len(backend.calls) == num_calls
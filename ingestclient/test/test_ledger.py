@@ -0,0 +1,95 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.utils.ledger import UploadLedger, UPLOADED, FAILED
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+
+class TestUploadLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, "logs", "ledger.sqlite")
+        self.ledger = UploadLedger(self.file_path)
+
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.directory)
+
+    def test_record(self):
+        """Test uploads are recorded per job and tile"""
+        self.ledger.record(23, [("t1", UPLOADED, '"abc"', 100, 0.5, 1),
+                                ("t2", FAILED, None, 200, 2.0, 5)])
+
+        assert self.ledger.is_uploaded(23, "t1")
+        assert self.ledger.is_uploaded("23", "t1")
+        assert not self.ledger.is_uploaded(23, "t2")
+        assert not self.ledger.is_uploaded(24, "t1")
+
+    def test_summary(self):
+        """Test summarizing the uploads of a job"""
+        self.ledger.record(23, [("t1", UPLOADED, '"abc"', 100, 0.5, 1),
+                                ("t2", FAILED, None, 200, 2.0, 5)])
+        self.ledger.record(23, [("t2", UPLOADED, '"def"', 200, 1.0, 2)])
+        self.ledger.record(24, [("t3", UPLOADED, '"ghi"', 300, 1.0, 1)])
+
+        summary = self.ledger.summary(23)
+        assert summary["uploaded"] == 2
+        assert summary["failed"] == 1
+        assert summary["tiles"] == 2
+        assert summary["bytes"] == 300
+        assert summary["upload_seconds"] == 1.5
+        assert summary["first"] <= summary["last"]
+
+        assert self.ledger.summary(25)["uploaded"] == 0
+
+    def test_reopen(self):
+        """Test the ledger persists across opens"""
+        self.ledger.record(23, [("t1", UPLOADED, '"abc"', 100, 0.5, 1)])
+        self.ledger.close()
+
+        self.ledger = UploadLedger(self.file_path)
+        assert self.ledger.is_uploaded(23, "t1")
+
+    def test_backends(self):
+        """Test the same job ID on different backends is tracked separately"""
+        self.ledger.record(1, [("t1", UPLOADED, '"abc"', 100, 0.5, 1)], "file:///data/a")
+
+        assert self.ledger.is_uploaded(1, "t1", "file:///data/a")
+        assert not self.ledger.is_uploaded(1, "t1", "file:///data/b")
+        assert not self.ledger.is_uploaded(1, "t1")
+        assert self.ledger.summary(1, "file:///data/a")["uploaded"] == 1
+        assert self.ledger.summary(1, "file:///data/b")["uploaded"] == 0
+
+    def test_upgrade(self):
+        """Test a ledger written before uploads were keyed by backend is upgraded"""
+        self.ledger.close()
+        os.remove(self.file_path)
+        db = sqlite3.connect(self.file_path)
+        db.execute("CREATE TABLE uploads (id INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, "
+                   "tile_key TEXT NOT NULL, status TEXT NOT NULL, etag TEXT, num_bytes INTEGER, duration REAL, "
+                   "attempts INTEGER, finished REAL, pid INTEGER)")
+        db.execute("INSERT INTO uploads (job_id, tile_key, status) VALUES ('1', 't1', 'uploaded')")
+        db.commit()
+        db.close()
+
+        self.ledger = UploadLedger(self.file_path)
+        assert not self.ledger.is_uploaded(1, "t1", "https://api.theboss.io")
+        self.ledger.record(1, [("t1", UPLOADED, '"abc"', 100, 0.5, 1)], "https://api.theboss.io")
+        assert self.ledger.is_uploaded(1, "t1", "https://api.theboss.io")
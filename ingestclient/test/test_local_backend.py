@@ -0,0 +1,311 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.core.backend import Backend, LocalBackend
+from ingestclient.core.config import Configuration
+from ingestclient.core.engine import Engine
+from ingestclient.utils.encoder import TileBuffer
+
+import hashlib
+import multiprocessing as mp
+import os
+import six
+import unittest
+import json
+import shutil
+import tempfile
+import time
+from pkg_resources import resource_filename
+
+
+class TestLocalBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        config_file = os.path.join(resource_filename("ingestclient", "test/data"), "boss-v0.1-test.json")
+        with open(config_file, 'rt') as example_file:
+            self.config_data = json.load(example_file)
+        self.config_data["client"]["backend"] = {"name": "local",
+                                                 "class": "LocalBackend",
+                                                 "host": self.directory,
+                                                 "protocol": "file"}
+        # 2 x 2 tiles, 20 slices deep
+        self.config_data["ingest_job"]["extent"] = {"x": [0, 1024], "y": [0, 600], "z": [0, 20], "t": [0, 1]}
+
+        self.backend = Backend.factory("LocalBackend", self.config_data)
+        self.backend.setup()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_create_join(self):
+        """Test a job's queue is filled with a task per tile"""
+        job_id = self.backend.create(self.config_data)
+        assert isinstance(self.backend, LocalBackend)
+        assert job_id == 1
+        assert self.backend.create(self.config_data) == 2
+
+        status, creds, queue, bucket, params, tile_count = self.backend.join(job_id)
+        assert status == 1
+        assert creds
+        assert tile_count == 80
+        assert self.backend.get_job_status(job_id) == {"id": 1, "status": 1, "current_message_count": 80,
+                                                        "total_message_count": 80}
+
+        tasks = self.backend.get_task_batch(100)
+        assert len(tasks) == 80
+        tile_keys = set()
+        for message_id, receipt_handle, msg in tasks:
+            key_parts = self.backend.decode_tile_key(msg["tile_key"])
+            chunk_parts = self.backend.decode_chunk_key(msg["chunk_key"])
+            assert key_parts["collection"] == job_id
+            assert chunk_parts["num_tiles"] == (16 if key_parts["z_index"] < 16 else 4)
+            assert chunk_parts["z_index"] == key_parts["z_index"] // 16
+            tile_keys.add(msg["tile_key"])
+        assert len(tile_keys) == 80
+
+    def test_visibility(self):
+        """Test received tasks are hidden until released or their visibility runs out"""
+        self.config_data["ingest_job"]["extent"]["z"] = [0, 1]
+        job_id = self.backend.create(self.config_data)
+        self.backend.join(job_id)
+
+        tasks = self.backend.get_task_batch(10)
+        assert len(tasks) == 4
+        assert self.backend.get_task() == (None, None, None)
+
+        # Released tasks are visible right away, even to another client
+        other = LocalBackend(self.config_data)
+        other.setup()
+        other.join(job_id)
+        assert self.backend.change_task_visibility([tasks[0][1]], 0) == []
+        assert other.get_task()[2] == tasks[0][2]
+
+        # Tasks whose visibility ran out are visible again
+        assert self.backend.change_task_visibility([tasks[1][1]], 1) == []
+        time.sleep(1.1)
+        assert other.get_task()[2] == tasks[1][2]
+
+        # The old receipt handle no longer works
+        assert self.backend.delete_tasks([tasks[1][1], tasks[2][1]]) == [tasks[1][1]]
+        assert self.backend.get_job_status(job_id)["current_message_count"] == 3
+
+    def test_put_tile(self):
+        """Test uploaded tiles are stored and their task deleted"""
+        self.config_data["ingest_job"]["extent"]["z"] = [0, 1]
+        job_id = self.backend.create(self.config_data)
+        self.backend.join(job_id)
+
+        message_id, receipt_handle, msg = self.backend.get_task()
+        response = self.backend.put_tile(msg["tile_key"], TileBuffer(b"tile"), {"receipt_handle": receipt_handle})
+
+        assert response["ETag"] == '"{}"'.format(hashlib.md5(b"tile").hexdigest())
+        with open(os.path.join(self.directory, str(job_id), "bucket", msg["tile_key"]), 'rb') as tile_file:
+            assert tile_file.read() == b"tile"
+        assert self.backend.get_job_status(job_id)["current_message_count"] == 3
+
+        self.backend.complete(job_id)
+        assert self.backend.get_job_status(job_id)["status"] == 2
+
+    def test_engine(self):
+        """Test running the upload loop against a local job"""
+        self.config_data["ingest_job"]["extent"]["z"] = [0, 2]
+        engine = Engine(configuration=Configuration(self.config_data))
+        engine.msg_wait_iterations = 1
+        engine.create_job()
+        engine.join()
+        engine.run()
+
+        status = engine.backend.get_job_status(engine.ingest_job_id)
+        assert status["current_message_count"] == 0
+        assert len(os.listdir(os.path.join(self.directory, str(engine.ingest_job_id), "bucket"))) == 8
+
+        stats = engine.get_stats()
+        assert stats["counters"]["tiles"] == 8
+        assert stats["counters"]["errors"] == 0
+        assert stats["stages"]["upload"]["count"] == 8
+        assert stats["stages"]["read"]["count"] == 8
+
+    def test_job_done(self):
+        """Test the upload loop stops once the job status shows no tasks left, without waiting out its idle limit"""
+        self.config_data["ingest_job"]["extent"]["z"] = [0, 2]
+        engine = Engine(configuration=Configuration(self.config_data))
+        engine.idle_poll_interval = 0.1
+        engine.create_job()
+        engine.join()
+
+        start_time = time.time()
+        engine.run()
+        assert time.time() - start_time < engine.msg_wait_iterations * engine.idle_poll_interval
+        assert engine.job_done.is_set()
+        assert engine.get_stats()["counters"]["tiles"] == 8
+
+    def test_ledger_reused_job_id(self):
+        """Test a job on another backend with the same ID isn't skipped as already uploaded"""
+        self.config_data["ingest_job"]["extent"]["z"] = [0, 2]
+        ledger_path = os.path.join(self.directory, "ledger.sqlite")
+        engine = Engine(configuration=Configuration(self.config_data))
+        engine.msg_wait_iterations = 1
+        engine.ledger_path = ledger_path
+        engine.create_job()
+        engine.join()
+        engine.run()
+        assert engine.get_stats()["counters"]["tiles"] == 8
+        assert engine.ledger is None
+
+        # A fresh local root numbers its jobs from 1 again
+        self.config_data["client"]["backend"]["host"] = os.path.join(self.directory, "other")
+        other = Engine(configuration=Configuration(self.config_data))
+        other.msg_wait_iterations = 1
+        other.ledger_path = ledger_path
+        other.create_job()
+        assert other.ingest_job_id == engine.ingest_job_id
+        other.join()
+        other.run()
+
+        assert other.get_stats()["counters"]["tiles"] == 8
+        assert len(os.listdir(os.path.join(self.directory, "other", str(other.ingest_job_id), "bucket"))) == 8
+
+    def test_engine_failed_tiles(self):
+        """Test the upload loop keeps going and releases tasks whose tile processor raises"""
+        self.config_data["ingest_job"]["extent"]["z"] = [0, 2]
+        for schedule_by_source in (False, True):
+            engine = Engine(configuration=Configuration(self.config_data))
+            engine.schedule_by_source = schedule_by_source
+            engine.msg_wait_iterations = 1
+            engine.idle_poll_interval = 0.1
+            engine.failed_task_delay = 60
+            engine.failure_journal = os.path.join(self.directory, "failed_tiles.jsonl")
+            engine.create_job()
+            engine.join()
+
+            if schedule_by_source:
+                # Tiles are read in batches per source file, so fail to find the source of single tiles
+                locate = engine.path_processor.process
+
+                def fail_second_slice(x_index, y_index, z_index, t_index):
+                    if z_index == 1:
+                        raise IOError("Missing source file")
+                    return locate(x_index, y_index, z_index, t_index)
+
+                engine.path_processor.process = fail_second_slice
+            else:
+                process = engine.tile_processor.process
+
+                def fail_second_slice(file_path, x_index, y_index, z_index, t_index):
+                    if z_index == 1:
+                        raise IOError("Unreadable tile")
+                    return process(file_path, x_index, y_index, z_index, t_index)
+
+                engine.tile_processor.process = fail_second_slice
+            engine.run()
+
+            stats = engine.get_stats()
+            assert stats["counters"]["tiles"] == 4
+            assert stats["counters"]["errors"] == 4
+            assert not engine.in_progress
+            assert len(os.listdir(os.path.join(self.directory, str(engine.ingest_job_id), "bucket"))) == 4
+
+            # The failed tasks were released with a backoff, not deleted
+            assert engine.backend.get_job_status(engine.ingest_job_id)["current_message_count"] == 4
+            assert engine.backend.get_task() == (None, None, None)
+
+        with open(os.path.join(self.directory, "failed_tiles.jsonl")) as journal:
+            entries = [json.loads(line) for line in journal]
+        assert len(entries) == 8
+        assert set(entry["z_index"] for entry in entries) == {1}
+
+    @unittest.skipIf(six.PY2, "The asyncio engine requires Python 3")
+    def test_async_engine_failed_tiles(self):
+        """Test the asyncio upload loop finishes and releases tasks whose tile processor raises"""
+        from ingestclient.core.async_engine import AsyncEngine
+
+        self.config_data["ingest_job"]["extent"]["z"] = [0, 2]
+        engine = AsyncEngine(configuration=Configuration(self.config_data))
+        engine.async_concurrency = 2
+        engine.msg_wait_iterations = 1
+        engine.idle_poll_interval = 0.1
+        engine.failed_task_delay = 60
+        engine.create_job()
+        engine.join()
+
+        process = engine.tile_processor.process
+
+        def fail_second_slice(file_path, x_index, y_index, z_index, t_index):
+            if z_index == 1:
+                raise IOError("Unreadable tile")
+            return process(file_path, x_index, y_index, z_index, t_index)
+
+        engine.tile_processor.process = fail_second_slice
+        engine.run()
+
+        stats = engine.get_stats()
+        assert stats["counters"]["tiles"] == 4
+        assert stats["counters"]["errors"] == 4
+        assert not engine.in_progress
+        assert len(os.listdir(os.path.join(self.directory, str(engine.ingest_job_id), "bucket"))) == 4
+
+        # The failed tasks were released with a backoff, not deleted
+        assert engine.backend.get_job_status(engine.ingest_job_id)["current_message_count"] == 4
+        assert engine.backend.get_task() == (None, None, None)
+
+    @unittest.skipIf(six.PY2, "The asyncio engine requires Python 3")
+    def test_async_engine_unsupported_params(self):
+        """Test the asyncio engine turns off engine settings it doesn't support instead of silently ignoring them"""
+        from ingestclient.core.async_engine import AsyncEngine
+
+        self.config_data["client"]["engine"] = {"schedule_by_source": True, "adaptive_concurrency": True}
+        with self.assertLogs('ingest-client', level='WARNING') as logs:
+            engine = AsyncEngine(configuration=Configuration(self.config_data))
+
+        assert not engine.schedule_by_source
+        assert not engine.adaptive_concurrency
+        assert "schedule_by_source or adaptive_concurrency" in logs.output[0]
+
+    def test_shared_credentials(self):
+        """Test a worker engine uploads with the job info and renewed credentials pushed by the master"""
+        self.config_data["ingest_job"]["extent"]["z"] = [0, 2]
+        master = Engine(configuration=Configuration(self.config_data))
+        master.create_job()
+        master.join()
+
+        worker = Engine(configuration=Configuration(self.config_data), ingest_job_id=master.ingest_job_id)
+        worker.backend.join = None  # The worker must not join the job itself
+        worker.set_job_info(master.get_job_info())
+        assert worker.tile_count == 8
+
+        master_pipe, worker_pipe = mp.Pipe()
+        worker.attach_master(worker_pipe)
+        assert not worker.renew_credentials()
+
+        # Only the upload loop reads the pipe, the credential refresher gets what it received
+        master.push_credentials([(None, master_pipe)])
+        assert not worker.renew_credentials()
+        worker.receive_master_messages()
+        assert worker.renew_credentials()
+        assert worker.credentials == master.credentials
+        assert not worker.renew_credentials()
+
+        # The worker waits for the master to signal the job is done, which the upload loop reads between receives
+        worker.msg_wait_iterations = 1000
+        worker.idle_poll_interval = 0.1
+        master.send_to_workers([(None, master_pipe)], "job_done", True)
+        worker.run()
+        assert worker.job_done.is_set()
+        assert len(os.listdir(os.path.join(self.directory, str(master.ingest_job_id), "bucket"))) == 8
+
+        # Workers that exited don't stop the master pushing to the others
+        worker_pipe.close()
+        master.push_credentials([(None, master_pipe)])
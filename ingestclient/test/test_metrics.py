@@ -0,0 +1,103 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.core.metrics import EngineMetrics, Histogram
+from ingestclient.utils.encoder import TileEncoder
+
+import threading
+import unittest
+import numpy as np
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        """Test percentiles are estimated within a bucket"""
+        histogram = Histogram()
+        for _ in range(90):
+            histogram.observe(0.01)
+        for _ in range(10):
+            histogram.observe(1.0)
+
+        summary = histogram.to_dict()
+        assert summary["count"] == 100
+        assert abs(summary["mean"] - 0.109) < 1e-9
+        assert summary["max"] == 1.0
+        assert 0.01 <= summary["p50"] < 0.012
+        assert 1.0 <= summary["p95"] < 1.2
+        assert summary["p99"] == 1.0
+
+    def test_empty_and_overflow(self):
+        """Test empty histograms and values past the last bucket"""
+        histogram = Histogram(buckets=(1.0, 2.0))
+        assert histogram.percentile(0.5) == 0.0
+
+        histogram.observe(5.0)
+        assert histogram.percentile(0.5) == 5.0
+
+    def test_merge(self):
+        """Test merging histograms"""
+        first = Histogram()
+        second = Histogram()
+        first.observe(0.01)
+        second.observe(0.1)
+        second.observe(0.2)
+
+        first.merge(second)
+        assert first.count == 3
+        assert first.max == 0.2
+        assert abs(first.total - 0.31) < 1e-9
+
+
+class TestEngineMetrics(unittest.TestCase):
+
+    def test_stages_and_counters(self):
+        """Test stage timings and counters are collected"""
+        metrics = EngineMetrics()
+        metrics.observe("upload", 0.5)
+        with metrics.timer("path"):
+            pass
+        metrics.increment("tiles")
+        metrics.increment("bytes_out", 100)
+
+        stats = metrics.snapshot()
+        assert list(stats["stages"].keys()) == ["receive", "path", "read", "encode", "upload"]
+        assert stats["stages"]["upload"]["count"] == 1
+        assert stats["stages"]["path"]["count"] == 1
+        assert stats["counters"] == {"tiles": 1, "errors": 0, "bytes_in": 0, "bytes_out": 100}
+        assert "upload p50/p95/p99" in metrics.summary()
+
+    def test_thread_seconds(self):
+        """Test stage time is also accumulated per thread"""
+        metrics = EngineMetrics()
+        metrics.observe("encode", 0.25)
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(metrics.thread_seconds("encode")))
+        thread.start()
+        thread.join()
+
+        assert metrics.thread_seconds("encode") == 0.25
+        assert other == [0.0]
+
+    def test_encoder(self):
+        """Test an encoder records encode times and raw tile bytes"""
+        metrics = EngineMetrics()
+        encoder = TileEncoder("png")
+        encoder.metrics = metrics
+        encoder.encode(np.zeros((32, 32), dtype=np.uint16))
+
+        stats = metrics.snapshot()
+        assert stats["stages"]["encode"]["count"] == 1
+        assert stats["counters"]["bytes_in"] == 2048
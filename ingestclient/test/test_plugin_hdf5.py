@@ -0,0 +1,83 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+try:
+    import h5py
+    from ingestclient.plugins.hdf5 import Hdf5FilePool
+    HAS_H5PY = True
+except ImportError:
+    HAS_H5PY = False
+
+
+@unittest.skipUnless(HAS_H5PY, "h5py is not installed")
+class TestHdf5FilePool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.files = []
+        for i in range(3):
+            file_path = os.path.join(self.tmp_dir, "{}.h5".format(i))
+            with h5py.File(file_path, 'w') as h5_file:
+                h5_file.create_dataset("data", data=np.full((4, 4), i, dtype=np.uint8))
+                h5_file.create_dataset("offset", data=np.array([i, 2 * i]))
+            self.files.append(file_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reuse(self):
+        """Test files and datasets are opened once and reused"""
+        pool = Hdf5FilePool(max_open_files=2)
+        h5_file = pool.get_file(self.files[0])
+        dataset = pool.get_dataset(self.files[0], "data")
+
+        assert pool.get_file(self.files[0]) is h5_file
+        assert pool.get_dataset(self.files[0], "data") is dataset
+        assert dataset[0, 0] == 0
+        np.testing.assert_array_equal(pool.get_array(self.files[1], "offset"), [1, 2])
+        pool.close()
+
+    def test_eviction(self):
+        """Test the least recently used file is closed when the pool is full"""
+        pool = Hdf5FilePool(max_open_files=2)
+        first = pool.get_file(self.files[0])
+        pool.get_dataset(self.files[1], "data")
+
+        # Touch the first file so the second is the least recently used
+        pool.get_file(self.files[0])
+        pool.get_file(self.files[2])
+
+        assert first.id.valid
+        assert len(pool._files) == 2
+        assert self.files[1] not in pool._files
+        assert (self.files[1], "data") not in pool._datasets
+
+        # A closed file is reopened on demand
+        assert pool.get_dataset(self.files[1], "data")[0, 0] == 1
+        pool.close()
+        assert not first.id.valid
+
+    def test_chunk_cache(self):
+        """Test the chunk cache size is passed through when set"""
+        pool = Hdf5FilePool(rdcc_nbytes=4 * 1024 * 1024)
+        h5_file = pool.get_file(self.files[0])
+        assert h5_file.id.get_access_plist().get_cache()[2] == 4 * 1024 * 1024
+        pool.close()
@@ -14,6 +14,8 @@
 from __future__ import absolute_import
 
 import os
+import shutil
+import tempfile
 import unittest
 import json
 from pkg_resources import resource_filename
@@ -70,6 +72,49 @@ class ZImageStackMixin(object):
         # Make sure the same
         np.testing.assert_array_equal(truth_img, test_img)
 
+    def test_TileProcessor_process_batch(self):
+        """Test cutting several tiles out of one image with a single read"""
+        pp = self.config.path_processor_class
+        pp.setup(self.config.get_path_processor_params())
+
+        params = self.config.get_tile_processor_params()
+        params["ingest_job"] = json.loads(json.dumps(params["ingest_job"]))
+        params["ingest_job"]["tile_size"]["x"] = 256
+        params["ingest_job"]["tile_size"]["y"] = 256
+        tp = self.config.tile_processor_class
+        tp.setup(params)
+
+        filename = pp.process(0, 0, 0, 0)
+        indices = [(1, 0, 0, 0), (0, 1, 0, 0), (1, 1, 0, 0)]
+        handles = tp.process_batch(filename, indices)
+
+        # Each tile matches the tile processed on its own
+        assert len(handles) == len(indices)
+        for (x_index, y_index, z_index, t_index), handle in zip(indices, handles):
+            test_img = np.array(Image.open(handle), dtype="uint8")
+            truth_img = np.array(Image.open(tp.process(filename, x_index, y_index, z_index, t_index)), dtype="uint8")
+            assert test_img.shape == (256, 256)
+            np.testing.assert_array_equal(truth_img, test_img)
+
+    def test_TileProcessor_slice_cache_budget(self):
+        """Test the slice cache budget comes from the client's share, then the parameters, then the default"""
+        pp = self.config.path_processor_class
+        pp.setup(self.config.get_path_processor_params())
+        filename = pp.process(0, 0, 0, 0)
+
+        def cache_bytes(override=None, parameter=None):
+            params = dict(self.config.get_tile_processor_params())
+            if parameter is not None:
+                params["slice_cache_mb"] = parameter
+            tp = type(self.config.tile_processor_class)()
+            tp.setup(params)
+            tp.slice_cache_mb = override
+            tp.process(filename, 0, 0, 0, 0)
+            return tp.slice_cache.max_bytes
+
+        assert cache_bytes() == 64 * 1024 * 1024
+        assert cache_bytes(parameter=16) == 16 * 1024 * 1024
+        assert cache_bytes(override=0.5, parameter=16) == 512 * 1024
 
 class TestZImageStackLocal(ZImageStackMixin, unittest.TestCase):
 
@@ -90,6 +135,37 @@ class TestZImageStackLocal(ZImageStackMixin, unittest.TestCase):
         assert tp.parameters["filesystem"] == "local"
         assert tp.parameters["ingest_job"]["extent"]["y"] == [0, 512]
 
+    def test_TileProcessor_process_tiff_region(self):
+        """Test tiles decoded from a region of a striped tiff match cropping the whole image"""
+        truth_file = os.path.join(resource_filename("ingestclient", "test/data/example_z_stack/"),
+                                  "3253_my_stack_section000.png")
+        truth_img = Image.open(truth_file).convert("L")
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp_dir, "section000.tif")
+            Image.fromarray(np.array(truth_img).astype(np.uint16) * 200).save(filename, tiffinfo={278: 16})
+
+            params = dict(self.config.get_tile_processor_params())
+            params["extension"] = "tif"
+            params["ingest_job"] = json.loads(json.dumps(params["ingest_job"]))
+            params["ingest_job"]["tile_size"]["x"] = 200
+            params["ingest_job"]["tile_size"]["y"] = 200
+            tp = self.config.tile_processor_class
+            tp.setup(params)
+
+            assert tp._get_region_reader(filename) is not None
+            full_img = Image.open(filename)
+            for x_index, y_index in [(0, 0), (1, 2), (2, 1)]:
+                test_img = Image.open(tp.process(filename, x_index, y_index, 0, 0))
+                crop_img = full_img.crop((200 * x_index, 200 * y_index, 200 * (x_index + 1), 200 * (y_index + 1)))
+                assert test_img.size == (200, 200)
+                np.testing.assert_array_equal(np.array(crop_img), np.array(test_img))
+
+            tp.readers.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
     @classmethod
     def setUpClass(cls):
         cls.config_file = os.path.join(resource_filename("ingestclient", "test/data"), "boss-v0.1-zStack.json")
@@ -0,0 +1,188 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.core.engine import Engine
+from ingestclient.core.exporter import MetricsExporter
+from ingestclient.core.supervisor import WorkerSupervisor
+
+import multiprocessing as mp
+import time
+import unittest
+
+
+def hang():
+    time.sleep(60)
+
+
+def crash():
+    raise SystemExit(3)
+
+
+def finish():
+    pass
+
+
+class FakeJobBackend(object):
+    """Returns a fixed job status"""
+    def __init__(self):
+        self.status = {"id": 1, "status": 1, "current_message_count": 10, "total_message_count": 10}
+        self.visibility_timeout = 500
+
+    def get_job_status(self, ingest_job_id):
+        return self.status
+
+
+class TestWorkerSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = Engine()
+        self.engine.backend = FakeJobBackend()
+        self.engine.stall_timeout = 1
+        self.workers = []
+        self.started = []
+
+    def tearDown(self):
+        for process, pipe in self.workers:
+            WorkerSupervisor.stop_worker(process)
+            pipe.close()
+
+    def start_worker(self, target=hang):
+        pipe = mp.Pipe()
+        process = mp.Process(target=target)
+        process.start()
+        self.started.append(process.pid)
+        return process, pipe[1]
+
+    def progress(self, stage):
+        return {"pid": 1, "time": time.time(), "tiles": 0, "errors": 0, "bytes_out": 0, "in_progress": 1,
+                "stage": stage, "stage_seconds": 0.0}
+
+    def test_stalled(self):
+        """Test a worker that stops advancing is killed and replaced"""
+        self.workers.append(self.start_worker())
+        old_process = self.workers[0][0]
+        supervisor = WorkerSupervisor(self.start_worker, self.workers, stall_timeout=1)
+
+        self.engine.update_worker_progress(old_process.pid, self.progress("upload"))
+        assert supervisor.check(self.engine) == []
+
+        exporter = MetricsExporter()
+        exporter.update_worker(old_process.pid, self.engine.get_stats(counts=True))
+
+        self.engine.worker_progress[old_process.pid]["advanced"] -= 5
+        assert supervisor.check(self.engine, exporter) == [old_process.pid]
+        assert not old_process.is_alive()
+        assert old_process.pid not in self.engine.worker_progress
+        assert str(old_process.pid) not in exporter.workers
+        assert len(self.workers) == 1
+        assert self.workers[0][0].pid == self.started[-1]
+        assert self.workers[0][0].is_alive()
+        assert supervisor.restarts == 1
+
+    def test_waiting(self):
+        """Test a worker waiting for tasks is not replaced"""
+        self.workers.append(self.start_worker())
+        supervisor = WorkerSupervisor(self.start_worker, self.workers, stall_timeout=1)
+
+        pid = self.workers[0][0].pid
+        self.engine.update_worker_progress(pid, self.progress("wait"))
+        self.engine.worker_progress[pid]["advanced"] -= 5
+        assert supervisor.check(self.engine) == []
+
+    def test_never_reported(self):
+        """Test a worker that never reports is replaced after the stall timeout"""
+        self.workers.append(self.start_worker())
+        supervisor = WorkerSupervisor(self.start_worker, self.workers, stall_timeout=1)
+
+        pid = self.workers[0][0].pid
+        assert supervisor.check(self.engine) == []
+        supervisor.started[pid] -= 5
+        assert supervisor.check(self.engine) == [pid]
+
+    def test_crashed(self):
+        """Test crashed workers are restarted but finished ones are left alone"""
+        self.workers.append(self.start_worker(crash))
+        self.workers.append(self.start_worker(finish))
+        for process, _ in self.workers:
+            process.join(10)
+        crashed, finished = [process.pid for process, _ in self.workers]
+        supervisor = WorkerSupervisor(self.start_worker, self.workers, stall_timeout=1)
+
+        assert supervisor.check(self.engine) == [crashed]
+        assert self.workers[0][0].is_alive()
+        assert self.workers[1][0].pid == finished
+
+    def test_job_done(self):
+        """Test workers that exit once the master signalled the job is done aren't restarted"""
+        self.workers.append(self.start_worker(crash))
+        self.workers[0][0].join(10)
+        pid = self.workers[0][0].pid
+        supervisor = WorkerSupervisor(self.start_worker, self.workers, stall_timeout=1)
+
+        self.engine.job_done.set()
+        assert supervisor.check(self.engine) == []
+        assert self.workers[0][0].pid == pid
+        assert self.started == [pid]
+
+    def test_job_over(self):
+        """Test workers that exit because the job was completed or cancelled aren't restarted"""
+        self.workers.append(self.start_worker(crash))
+        self.workers[0][0].join(10)
+        pid = self.workers[0][0].pid
+        supervisor = WorkerSupervisor(self.start_worker, self.workers, stall_timeout=1)
+
+        self.engine.backend.status = {"id": 1, "status": 3, "current_message_count": 10, "total_message_count": 10}
+        assert supervisor.check(self.engine) == []
+        assert self.workers == []
+        assert self.started == [pid]
+
+    def test_hidden_tasks(self):
+        """Test the tasks of lost workers are waited for before the job counts as out of tasks"""
+        self.workers.append(self.start_worker(crash))
+        self.workers.append(self.start_worker())
+        self.workers[0][0].join(10)
+        crashed, hung = [process.pid for process, _ in self.workers]
+        supervisor = WorkerSupervisor(self.start_worker, self.workers, stall_timeout=1)
+
+        # The queue looks empty, but the crashed worker's tasks are only hidden
+        self.engine.backend.status = {"id": 1, "status": 1, "current_message_count": 0, "total_message_count": 10}
+        assert supervisor.check(self.engine) == [crashed]
+        assert self.engine.hidden_task_deadline >= time.time() + 499
+
+        # Killing a worker also leaves its tasks hidden
+        self.engine.hidden_task_deadline = 0
+        supervisor.started[hung] -= 5
+        assert supervisor.check(self.engine) == [hung]
+        assert self.engine.hidden_task_deadline >= time.time() + 499
+
+    def test_max_restarts(self):
+        """Test workers are no longer replaced once the restart limit is reached"""
+        self.workers.append(self.start_worker(crash))
+        self.workers.append(self.start_worker())
+        self.workers[0][0].join(10)
+        supervisor = WorkerSupervisor(self.start_worker, self.workers, stall_timeout=1, max_restarts=0)
+
+        exporter = MetricsExporter()
+        for process, _ in self.workers:
+            exporter.update_worker(process.pid, self.engine.get_stats(counts=True))
+
+        pid = self.workers[1][0].pid
+        supervisor.started[pid] -= 5
+        assert supervisor.check(self.engine, exporter) == []
+
+        # The crashed worker is dropped and the hung one left running
+        assert list(exporter.workers) == [str(pid)]
+        assert len(self.workers) == 1
+        assert self.workers[0][0].pid == pid
+        assert self.workers[0][0].is_alive()
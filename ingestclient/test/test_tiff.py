@@ -0,0 +1,169 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.utils.tiff import TiffReader, TiffReaderPool
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+from pkg_resources import resource_filename
+
+from PIL import Image
+import numpy as np
+import six
+
+from ingestclient.plugins.multipage_tiff import load_tiff_multipage
+
+
+class TestTiffReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_stack(self, name, pages, **kwargs):
+        """Write uint8 pages to a multi-page tiff"""
+        file_path = os.path.join(self.tmp_dir, name)
+        images = [Image.fromarray(page) for page in pages]
+        images[0].save(file_path, format="TIFF", save_all=True, append_images=images[1:], **kwargs)
+        return file_path
+
+    def write_tiled(self, name, data, tile_size, compress=False):
+        """Write a single uint16 page as a tiled, little-endian tiff"""
+        chunks = []
+        for top in range(0, data.shape[0], tile_size):
+            for left in range(0, data.shape[1], tile_size):
+                tile = np.zeros((tile_size, tile_size), dtype='<u2')
+                region = data[top:top + tile_size, left:left + tile_size]
+                tile[:region.shape[0], :region.shape[1]] = region
+                chunks.append(zlib.compress(tile.tobytes()) if compress else tile.tobytes())
+
+        offsets = []
+        body = b''
+        for chunk in chunks:
+            offsets.append(8 + len(body))
+            body += chunk
+
+        arrays_offset = 8 + len(body)
+        arrays = struct.pack('<{}I'.format(len(chunks)), *offsets)
+        arrays += struct.pack('<{}I'.format(len(chunks)), *[len(c) for c in chunks])
+        entries = [(256, 4, 1, data.shape[1]), (257, 4, 1, data.shape[0]), (258, 3, 1, 16),
+                   (259, 3, 1, 8 if compress else 1), (262, 3, 1, 1), (277, 3, 1, 1), (322, 3, 1, tile_size),
+                   (323, 3, 1, tile_size), (324, 4, len(chunks), arrays_offset),
+                   (325, 4, len(chunks), arrays_offset + 4 * len(chunks))]
+        ifd = struct.pack('<H', len(entries))
+        for tag, field_type, count, value in entries:
+            # A single SHORT is stored left-justified in the value field
+            ifd += struct.pack('<HHIH2x' if field_type == 3 else '<HHII', tag, field_type, count, value)
+        ifd += struct.pack('<I', 0)
+
+        file_path = os.path.join(self.tmp_dir, name)
+        with open(file_path, 'wb') as tiff_file:
+            tiff_file.write(b'II' + struct.pack('<HI', 42, arrays_offset + len(arrays)) + body + arrays + ifd)
+        return file_path
+
+    def test_multipage(self):
+        """Test reading pages and regions of the big-endian test stack matches PIL"""
+        file_path = os.path.join(resource_filename("ingestclient", "test/data"), "test_multipage.tif")
+        truth = Image.open(file_path)
+
+        with TiffReader(file_path) as reader:
+            assert len(reader) == 10
+            assert reader.shape(0) == (256, 512)
+
+            for page in [0, 3, 9]:
+                truth.seek(page)
+                truth_data = np.array(truth)
+                np.testing.assert_array_equal(reader.read(page), truth_data)
+                np.testing.assert_array_equal(reader.read(page, (100, 200), (300, 700)),
+                                              truth_data[100:200, 300:700])
+
+            with self.assertRaises(IndexError):
+                reader.read(10)
+
+    def test_strips(self):
+        """Test regions spanning several strips of a little-endian stack"""
+        pages = [np.random.randint(0, 255, (1000, 300), dtype=np.uint8) for _ in range(3)]
+        file_path = self.write_stack("strips.tif", pages, tiffinfo={278: 64})
+
+        with TiffReader(file_path) as reader:
+            assert reader.byte_order == '<'
+            assert len(reader.pages[2]["strip_offsets"]) > 1
+            np.testing.assert_array_equal(reader.read(2), pages[2])
+            np.testing.assert_array_equal(reader.read(1, (200, 900), (10, 20)), pages[1][200:900, 10:20])
+            assert reader.read(0, (1000, 1200)).shape == (0, 300)
+
+    def test_compressed(self):
+        """Test compressed pages are decoded"""
+        pages = [np.random.randint(0, 4, (64, 64), dtype=np.uint8) for _ in range(2)]
+        file_path = self.write_stack("packbits.tif", pages, compression="packbits")
+
+        with TiffReader(file_path) as reader:
+            assert reader.pages[1]["compression"] == 32773
+            np.testing.assert_array_equal(reader.read(1, (10, 20), (30, 40)), pages[1][10:20, 30:40])
+            np.testing.assert_array_equal(reader.read(0), pages[0])
+
+    def test_deflate_strips(self):
+        """Test regions of Deflate compressed strips with horizontal differencing"""
+        data = (np.arange(300 * 200) % 251).astype(np.uint16).reshape(200, 300) * 200
+        file_path = os.path.join(self.tmp_dir, "deflate.tif")
+        try:
+            Image.fromarray(data).save(file_path, compression="tiff_adobe_deflate", tiffinfo={278: 16, 317: 2})
+        except (IOError, OSError):
+            self.skipTest("PIL is not built with libtiff")
+
+        with TiffReader(file_path) as reader:
+            assert reader.can_read_region(0)
+            np.testing.assert_array_equal(reader.read(0, (17, 190), (3, 299)), data[17:190, 3:299])
+
+    def test_tiles(self):
+        """Test regions spanning several tiles, including padded edge tiles"""
+        data = np.random.randint(0, 65535, (150, 170)).astype(np.uint16)
+        for compress in [False, True]:
+            file_path = self.write_tiled("tiled.tif", data, 64, compress)
+            with TiffReader(file_path) as reader:
+                assert reader.can_read_region(0)
+                np.testing.assert_array_equal(reader.read(0), data)
+                np.testing.assert_array_equal(reader.read(0, (60, 140), (100, 200)), data[60:140, 100:200])
+
+    def test_file_object(self):
+        """Test reading from an in-memory file"""
+        file_path = os.path.join(resource_filename("ingestclient", "test/data"), "test_multipage.tif")
+        with open(file_path, 'rb') as tiff_file:
+            buffer = six.BytesIO(tiff_file.read())
+
+        with TiffReader(buffer) as reader:
+            assert reader.file_path is None
+            np.testing.assert_array_equal(reader.read(5, (0, 10), (0, 10)),
+                                          load_tiff_multipage(file_path)[5, :10, :10])
+
+    def test_pool(self):
+        """Test the least recently used reader is closed when the pool is full"""
+        file_paths = [self.write_stack("{}.tif".format(i), [np.zeros((4, 4), dtype=np.uint8)]) for i in range(3)]
+        pool = TiffReaderPool(max_open_files=2)
+        first = pool.get(file_paths[0])
+        second = pool.get(file_paths[1])
+
+        assert pool.get(file_paths[0]) is first
+        pool.get(file_paths[2])
+        assert second._map is None
+        assert first._map is not None
+
+        pool.close()
+        assert first._map is None
@@ -0,0 +1,263 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from ingestclient.core.upload import (AimdController, FailureJournal, RetryPolicy, UploadExecutor, UploadResult,
+                                     is_retryable_error, is_throttle_error)
+
+from botocore.exceptions import ClientError
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+class TestUploadExecutor(unittest.TestCase):
+
+    def test_results(self):
+        """Test results and errors are reported back with their context"""
+        def upload(value):
+            if value < 0:
+                raise ValueError("negative")
+            return value * 2
+
+        executor = UploadExecutor(upload, num_threads=2)
+        executor.start()
+        for value in [1, 2, -1, 3]:
+            executor.submit(value, 10, value)
+        results = executor.wait()
+        executor.shutdown()
+
+        assert sorted(r.context for r in results) == [-1, 1, 2, 3]
+        for r in results:
+            if r.context < 0:
+                assert isinstance(r.error, ValueError)
+                assert r.response is None
+            else:
+                assert r.error is None
+                assert r.response == r.context * 2
+            assert r.num_bytes == 10
+
+        assert executor.bytes_in_flight == 0
+        assert executor.num_in_flight == 0
+
+    def test_backpressure(self):
+        """Test submit blocks while the in-flight byte budget is full"""
+        release = threading.Event()
+
+        def upload(value):
+            release.wait()
+            return value
+
+        executor = UploadExecutor(upload, num_threads=4, max_bytes_in_flight=100)
+        executor.start()
+
+        # The budget holds the first two uploads
+        executor.submit(1, 50, 1)
+        executor.submit(2, 50, 2)
+
+        submitted = threading.Event()
+
+        def submit_third():
+            executor.submit(3, 50, 3)
+            submitted.set()
+
+        thread = threading.Thread(target=submit_third)
+        thread.start()
+
+        assert not submitted.wait(0.2)
+        assert executor.bytes_in_flight == 100
+
+        release.set()
+        assert submitted.wait(5)
+        thread.join()
+
+        results = executor.wait()
+        executor.shutdown()
+        assert sorted(r.response for r in results) == [1, 2, 3]
+
+    def test_oversized_upload(self):
+        """Test an upload bigger than the whole budget still goes through"""
+        executor = UploadExecutor(lambda value: value, num_threads=1, max_bytes_in_flight=10)
+        executor.start()
+        executor.submit("big", 1000, "big")
+        results = executor.wait()
+        executor.shutdown()
+
+        assert [r.response for r in results] == ["big"]
+
+    def test_max_active(self):
+        """Test only max_active uploads run at once"""
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def upload(value):
+            with lock:
+                active.append(value)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(value)
+            return value
+
+        executor = UploadExecutor(upload, num_threads=4)
+        assert executor.set_max_active(10) == 4
+        assert executor.set_max_active(2) == 2
+        executor.start()
+        for value in range(8):
+            executor.submit(value, 1, value)
+        results = executor.wait()
+        executor.shutdown()
+
+        assert len(results) == 8
+        assert max(peak) == 2
+
+
+def throttle_error():
+    """Make the error S3 returns when it throttles requests"""
+    return ClientError({"Error": {"Code": "SlowDown", "Message": "Please reduce your request rate"},
+                        "ResponseMetadata": {"HTTPStatusCode": 503}}, "PutObject")
+
+
+class TestAimdController(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = UploadExecutor(lambda: None, num_threads=8)
+        self.executor.set_max_active(4)
+        self.controller = AimdController(self.executor, window=4)
+
+    def results(self, durations, error=None):
+        return [UploadResult(None, None, error, duration, 10) for duration in durations]
+
+    def test_increase(self):
+        """Test concurrency grows by one per good window, up to the number of threads"""
+        assert self.controller.update(self.results([0.1] * 4)) == 5
+        assert self.controller.update(self.results([0.1] * 3)) == 5
+        assert self.controller.update(self.results([0.1] * 17)) == 8
+
+    def test_latency_decrease(self):
+        """Test concurrency is halved when latency rises"""
+        self.controller.update(self.results([0.1] * 4))
+        assert self.controller.limit == 5
+        assert self.controller.update(self.results([0.5] * 4)) == 2
+
+    def test_throttle_decrease(self):
+        """Test a throttled upload halves concurrency once per window"""
+        assert is_throttle_error(throttle_error())
+        assert not is_throttle_error(ValueError("nope"))
+
+        assert self.controller.update(self.results([0.1], throttle_error())) == 2
+        assert self.controller.update(self.results([0.1], throttle_error())) == 2
+
+        # The window with the second throttled upload still backs off when it ends
+        assert self.controller.update(self.results([0.1] * 3)) == 1
+        assert self.controller.update(self.results([0.1] * 4)) == 2
+
+    def test_errors_decrease(self):
+        """Test a window with failed uploads backs off"""
+        assert self.controller.update(self.results([0.1] * 3) + self.results([0.1], ValueError("failed"))) == 2
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_retry(self):
+        """Test transient errors are retried with the same arguments"""
+        calls = []
+
+        def upload(buffer):
+            calls.append(buffer)
+            if len(calls) < 3:
+                raise IOError("connection reset")
+            return "ok"
+
+        buffer = object()
+        policy = RetryPolicy(max_attempts=5, base_delay=0.001, max_delay=0.002)
+        assert policy.call(upload, buffer) == ("ok", None, 3)
+        assert all(b is buffer for b in calls)
+
+    def test_give_up(self):
+        """Test uploads stop after the maximum attempts or a permanent error"""
+        def upload():
+            raise IOError("connection reset")
+
+        policy = RetryPolicy(max_attempts=2, base_delay=0.001)
+        response, error, attempts = policy.call(upload)
+        assert response is None
+        assert isinstance(error, IOError)
+        assert attempts == 2
+
+        denied = ClientError({"Error": {"Code": "AccessDenied"}, "ResponseMetadata": {"HTTPStatusCode": 403}},
+                             "PutObject")
+        assert not is_retryable_error(denied)
+        assert is_retryable_error(throttle_error())
+
+        def upload_denied():
+            raise denied
+
+        assert policy.call(upload_denied) == (None, denied, 1)
+
+    def test_delay(self):
+        """Test the backoff doubles up to the cap"""
+        policy = RetryPolicy(base_delay=1, max_delay=3)
+        for _ in range(20):
+            assert 0 <= policy.get_delay(1) <= 1
+            assert 0 <= policy.get_delay(2) <= 2
+            assert 0 <= policy.get_delay(5) <= 3
+
+    def test_executor(self):
+        """Test the executor reports the attempts of retried uploads"""
+        calls = []
+
+        def upload():
+            calls.append(1)
+            if len(calls) == 1:
+                raise IOError("connection reset")
+
+        executor = UploadExecutor(upload, num_threads=1, retry_policy=RetryPolicy(base_delay=0.001))
+        executor.start()
+        executor.submit("tile", 10)
+        results = executor.wait()
+        executor.shutdown()
+
+        assert results[0].error is None
+        assert results[0].attempts == 2
+
+
+class TestFailureJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record(self):
+        """Test failed tiles are appended as JSON lines"""
+        file_path = os.path.join(self.directory, "logs", "failed.jsonl")
+        journal = FailureJournal(file_path)
+        assert not os.path.exists(file_path)
+
+        key_parts = {"x_index": 1, "y_index": 2, "z_index": 3, "t_index": 0}
+        journal.record("tile1", key_parts, IOError("connection reset"), 5)
+        journal.record("tile2", key_parts, IOError("connection reset"), 5)
+
+        with open(file_path) as journal_file:
+            entries = [json.loads(line) for line in journal_file]
+        assert [entry["tile_key"] for entry in entries] == ["tile1", "tile2"]
+        assert entries[0]["z_index"] == 3
+        assert entries[0]["attempts"] == 5
+        assert entries[0]["error"] == "connection reset"
@@ -0,0 +1,131 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import boto3
+from botocore.config import Config
+import threading
+
+
+# Region of the ingest service's upload queues and tile buckets
+DEFAULT_REGION = "us-east-1"
+
+# Keys of the optional "aws" parameters accepted by ClientFactory.from_params()
+PARAMS = ("region", "endpoint_url", "max_pool_connections", "retry_mode", "max_attempts", "connect_timeout",
+          "read_timeout")
+
+
+class ClientFactory(object):
+    def __init__(self, access_key=None, secret_key=None, region=None, endpoint_url=None, max_pool_connections=50,
+                 retry_mode="adaptive", max_attempts=5, connect_timeout=10, read_timeout=60):
+        """
+        A class to create boto3 clients and resources that share a tuned configuration
+
+        Clients and resources are cached per thread, since a boto3 session and its resources can't be shared between
+        threads. Each factory has its own session, so a factory for renewed credentials can be built while another
+        is in use.
+
+        Args:
+            access_key(str): AWS access key. None to use the default boto3 credentials
+            secret_key(str): AWS secret key
+            region(str): AWS region. None to let boto3 resolve it from the environment or the AWS config
+            endpoint_url(str|dict): Endpoint to use in place of AWS, e.g. for an S3 compatible store. A dict maps
+                                    service names to endpoints
+            max_pool_connections(int): Connections each client keeps open. botocore defaults to 10, too few for
+                                       the engine's concurrent uploads
+            retry_mode(str): botocore retry mode: "legacy", "standard" or "adaptive", which also rate limits the
+                             client when throttled
+            max_attempts(int): Attempts of each request, including the first
+            connect_timeout(float): Seconds to wait for a connection
+            read_timeout(float): Seconds to wait for a response
+        """
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self.config = Config(region_name=self.region,
+                             max_pool_connections=max_pool_connections,
+                             retries={"mode": retry_mode, "total_max_attempts": max_attempts},
+                             connect_timeout=connect_timeout,
+                             read_timeout=read_timeout)
+        self.session = boto3.session.Session(aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+                                             region_name=self.region)
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def from_params(cls, params=None, credentials=None, region=None):
+        """Method to create a factory from the optional "aws" parameters of a config section
+
+        Args:
+            params(dict): Any of "region", "endpoint_url", "max_pool_connections", "retry_mode", "max_attempts",
+                          "connect_timeout" and "read_timeout"
+            credentials(dict): "access_key" and "secret_key". None to use the default boto3 credentials
+            region(str): Region to use if params doesn't set one
+
+        Returns:
+            (ClientFactory)
+        """
+        kwargs = dict((key, value) for key, value in (params or {}).items() if key in PARAMS)
+        if credentials:
+            kwargs["access_key"] = credentials["access_key"]
+            kwargs["secret_key"] = credentials["secret_key"]
+        if region and not kwargs.get("region"):
+            kwargs["region"] = region
+        return cls(**kwargs)
+
+    def get_endpoint_url(self, service):
+        """Method to get the endpoint of a service
+
+        Args:
+            service(str): The service name, e.g. "s3"
+
+        Returns:
+            (str): The endpoint, or None for the AWS default
+        """
+        if isinstance(self.endpoint_url, dict):
+            return self.endpoint_url.get(service)
+        return self.endpoint_url
+
+    def client(self, service):
+        """Method to get the calling thread's client for a service
+
+        Args:
+            service(str): The service name, e.g. "s3"
+
+        Returns:
+            (botocore.client.BaseClient)
+        """
+        return self._get("client", service)
+
+    def resource(self, service):
+        """Method to get the calling thread's resource for a service
+
+        Args:
+            service(str): The service name, e.g. "s3"
+
+        Returns:
+            (boto3.resources.base.ServiceResource)
+        """
+        return self._get("resource", service)
+
+    def _get(self, kind, service):
+        """Method to get a cached client or resource, creating it for the calling thread as needed"""
+        cache = getattr(self._local, "cache", None)
+        if cache is None:
+            cache = self._local.cache = {}
+
+        if (kind, service) not in cache:
+            create = self.session.client if kind == "client" else self.session.resource
+            with self._lock:
+                cache[(kind, service)] = create(service, endpoint_url=self.get_endpoint_url(service),
+                                                config=self.config)
+        return cache[(kind, service)]
@@ -0,0 +1,115 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from collections import OrderedDict
+import threading
+
+
+def estimate_size(data):
+    """Method to estimate the memory used by a decoded slice
+
+    Args:
+        data(numpy.ndarray|PIL.Image.Image): The decoded data
+
+    Returns:
+        (int): Size in bytes
+    """
+    if hasattr(data, "nbytes"):
+        return int(data.nbytes)
+
+    # PIL images store 1-bit, 8-bit and palette images in a byte per pixel, 16-bit images in 2 and all others in 4
+    if data.mode in ("1", "L", "P"):
+        pixel_size = 1
+    elif data.mode.startswith("I;16"):
+        pixel_size = 2
+    else:
+        pixel_size = 4
+    return data.size[0] * data.size[1] * pixel_size
+
+
+class SliceCache(object):
+    def __init__(self, max_bytes):
+        """
+        A least-recently-used cache of decoded slices, bounded by their total size
+
+        Args:
+            max_bytes(int): The memory budget. Slices bigger than the budget are never cached. 0 disables caching
+        """
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path, frame, loader):
+        """Method to get a decoded slice, loading and caching it on a miss
+
+        Args:
+            file_path(str): The file containing the slice
+            frame: Identifies the slice within the file, e.g. a page or time index. None for the whole file
+            loader(callable): Called without arguments to decode the slice on a miss
+
+        Returns:
+            (numpy.ndarray|PIL.Image.Image): The decoded slice
+        """
+        key = (file_path, frame)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                entry = self._entries.pop(key)
+                self._entries[key] = entry
+                return entry[0]
+            self.misses += 1
+
+        data = loader()
+        size = estimate_size(data)
+        if size > self.max_bytes:
+            return data
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (data, size)
+                self.num_bytes += size
+
+            while self.num_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.num_bytes -= evicted_size
+                self.evictions += 1
+
+        return data
+
+    def clear(self):
+        """Method to drop every cached slice
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+
+    def stats(self):
+        """Method to get the cache counters
+
+        Returns:
+            (dict): hits, misses, evictions, entries and bytes currently cached
+        """
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self._entries),
+                    "bytes": self.num_bytes}
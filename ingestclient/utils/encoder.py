@@ -0,0 +1,222 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from PIL import Image
+import numpy as np
+import base64
+import hashlib
+import six
+import time
+import zlib
+
+from .cache import estimate_size
+
+
+# Alternate spellings of the supported formats
+FORMATS = {
+    'PNG': 'PNG',
+    'TIF': 'TIFF',
+    'TIFF': 'TIFF',
+    'JPG': 'JPEG',
+    'JPEG': 'JPEG',
+    'NPZ': 'NPZ',
+    'RAW': 'RAW'
+}
+
+# zlib strategies selectable for PNG
+PNG_STRATEGIES = {
+    'default': zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'huffman_only': zlib.Z_HUFFMAN_ONLY,
+    'rle': getattr(zlib, 'Z_RLE', 3),
+    'fixed': getattr(zlib, 'Z_FIXED', 4)
+}
+
+
+class TileBuffer(six.BytesIO):
+    def __init__(self, data):
+        """
+        An encoded tile, ready to upload without further copies
+
+        The length and MD5 are computed once, by the tile processor, so uploads can send the bytes as they are. The
+        buffer can also be read like a file, so code that opens tile handles with PIL keeps working.
+
+        Args:
+            data(bytes): The encoded tile
+        """
+        six.BytesIO.__init__(self, data)
+        self.data = data
+        self.view = memoryview(data)
+        self.num_bytes = self.view.nbytes
+        self.md5 = hashlib.md5(self.view).digest()
+
+    @classmethod
+    def from_handle(cls, handle):
+        """Method to wrap a file handle returned by a tile processor that doesn't create TileBuffers
+
+        Args:
+            handle(file-like): A handle to the encoded tile
+
+        Returns:
+            (TileBuffer)
+        """
+        if isinstance(handle, cls):
+            return handle
+        if hasattr(handle, "getvalue"):
+            # BytesIO shares its buffer with the returned bytes instead of copying it
+            return cls(handle.getvalue())
+        handle.seek(0)
+        return cls(handle.read())
+
+    @property
+    def content_md5(self):
+        """The base64 encoded MD5 of the tile, as used by the S3 Content-MD5 header"""
+        return base64.b64encode(self.md5).decode('ascii')
+
+    def getvalue(self):
+        """Method to get the encoded tile
+
+        Returns:
+            (bytes)
+        """
+        return self.data
+
+
+class TileEncoder(object):
+    def __init__(self, upload_format="png", compress_level=None, png_strategy=None, tiff_compression=None,
+                 quality=None):
+        """
+        A class to encode tiles for upload
+
+        PNG, TIFF and JPEG tiles are encoded with PIL. NPZ (numpy.savez) and RAW (the C-order array bytes, no header)
+        skip image encoding entirely, but must only be used with a backend that decodes them.
+
+        Args:
+            upload_format(str): The tile format, one of png, tif, tiff, jpg, jpeg, npz or raw
+            compress_level(int): zlib level 0-9 for PNG and NPZ. None for the library default. 0 stores NPZ
+                                 uncompressed
+            png_strategy(str): zlib strategy for PNG, one of default, filtered, huffman_only, rle or fixed
+            tiff_compression(str): PIL TIFF compression, e.g. tiff_deflate or packbits. None stores TIFF uncompressed
+            quality(int): JPEG quality 1-95. None for the PIL default
+        """
+        if upload_format.upper() not in FORMATS:
+            raise Exception("Unsupported upload format: {}".format(upload_format))
+        if png_strategy is not None and png_strategy not in PNG_STRATEGIES:
+            raise Exception("Unsupported PNG strategy: {}".format(png_strategy))
+
+        self.upload_format = FORMATS[upload_format.upper()]
+        self.compress_level = compress_level
+        self.png_strategy = png_strategy
+        self.tiff_compression = tiff_compression
+        self.quality = quality
+        self.metrics = None  # Set by the engine to record encode times and raw tile bytes
+
+    @classmethod
+    def from_parameters(cls, parameters, default_format):
+        """Method to create an encoder from plugin parameters
+
+        Reads the optional "upload_format", "compress_level", "png_strategy", "tiff_compression" and "quality"
+        parameters.
+
+        Args:
+            parameters(dict): Parameters for the dataset to be processed
+            default_format(str): The format to use if "upload_format" isn't set
+
+        Returns:
+            (TileEncoder)
+        """
+        return cls(parameters.get("upload_format", default_format),
+                   compress_level=parameters.get("compress_level"),
+                   png_strategy=parameters.get("png_strategy"),
+                   tiff_compression=parameters.get("tiff_compression"),
+                   quality=parameters.get("quality"))
+
+    def encode(self, tile_data):
+        """Method to encode a tile
+
+        Args:
+            tile_data(PIL.Image.Image|numpy.ndarray): The tile
+
+        Returns:
+            (TileBuffer): The encoded tile
+        """
+        if self.metrics is None:
+            return self._encode(tile_data)
+
+        self.metrics.increment("bytes_in", estimate_size(tile_data))
+        with self.metrics.timer("encode"):
+            return self._encode(tile_data)
+
+    def _encode(self, tile_data):
+        """Method to encode a tile without recording metrics"""
+        output = six.BytesIO()
+
+        if self.upload_format in ('NPZ', 'RAW'):
+            data = np.asarray(tile_data)
+            if self.upload_format == 'RAW':
+                return TileBuffer(np.ascontiguousarray(data).tobytes())
+            elif self.compress_level == 0:
+                np.savez(output, data=data)
+            else:
+                np.savez_compressed(output, data=data)
+            return TileBuffer(output.getvalue())
+
+        if isinstance(tile_data, np.ndarray):
+            tile_data = Image.fromarray(tile_data)
+
+        options = {}
+        if self.upload_format == 'PNG':
+            if self.compress_level is not None:
+                options["compress_level"] = self.compress_level
+            if self.png_strategy is not None:
+                options["compress_type"] = PNG_STRATEGIES[self.png_strategy]
+        elif self.upload_format == 'TIFF':
+            if self.tiff_compression is not None:
+                options["compression"] = self.tiff_compression
+        elif self.upload_format == 'JPEG':
+            if self.quality is not None:
+                options["quality"] = self.quality
+
+        tile_data.save(output, format=self.upload_format, **options)
+        return TileBuffer(output.getvalue())
+
+
+def benchmark(encoders, tiles, repeat=3):
+    """Method to measure the throughput and compression of encoders
+
+    Args:
+        encoders(dict(str, TileEncoder)): The encoders to compare, by name
+        tiles(list(numpy.ndarray)): The tiles to encode
+        repeat(int): The number of times each tile is encoded
+
+    Returns:
+        (dict(str, dict)): For each encoder, "mb_per_sec" of raw tile data encoded, "ratio" of raw to encoded size
+                           and "seconds" spent encoding
+    """
+    raw_bytes = sum(tile.nbytes for tile in tiles) * repeat
+
+    results = {}
+    for name, encoder in encoders.items():
+        encoded_bytes = 0
+        start_time = time.time()
+        for _ in range(repeat):
+            for tile in tiles:
+                encoded_bytes += encoder.encode(tile).num_bytes
+        seconds = max(time.time() - start_time, 1e-9)
+
+        results[name] = {"mb_per_sec": raw_bytes / seconds / 1024 / 1024,
+                         "ratio": float(raw_bytes) / encoded_bytes,
+                         "seconds": seconds}
+
+    return results
@@ -12,11 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from abc import ABCMeta, abstractmethod
-import boto3
 import os
 import six
 import tempfile
 
+from .aws import ClientFactory
+
 
 class DynamicFilesystem(object):
     """Class to support converting between things that can look like a filesystem
@@ -116,22 +117,48 @@ class LocalFilesystem(BaseFilesystem):
         return open(path, mode="rb")
 
 
-class S3Filesystem(BaseFilesystem):
-    """An S3 based filesystem"""
+class BaseS3Filesystem(BaseFilesystem):
+    """Base class for filesystems that read from an S3 bucket"""
 
     def __init__(self, parameters):
-        """The S3 filesystem uses boto3 under the hood and assumes you have setup your boto3 credentials properly.
+        """
 
         Required parameters:
          "bucket": the name of the bucket to use
 
+        Optional parameters:
+         "aws": boto3 settings, see ingestclient.utils.aws.ClientFactory.from_params()
+
         Args:
             parameters(dict): Parameters to configure the S3 filesystem
         """
         BaseFilesystem.__init__(self, parameters)
 
-        self.s3 = boto3.resource('s3')
-        self.bucket = self.s3.Bucket(parameters['bucket'])
+        self.clients = ClientFactory.from_params(parameters.get("aws"))
+        self.bucket_name = parameters['bucket']
+
+    @property
+    def bucket(self):
+        """The calling thread's bucket resource, since boto3 resources can't be shared between threads"""
+        return self.clients.resource('s3').Bucket(self.bucket_name)
+
+
+class S3Filesystem(BaseS3Filesystem):
+    """An S3 based filesystem"""
+
+    def __init__(self, parameters):
+        """The S3 filesystem uses boto3 under the hood and assumes you have setup your boto3 credentials properly.
+
+        Required parameters:
+         "bucket": the name of the bucket to use
+
+        Optional parameters:
+         "aws": boto3 settings, see ingestclient.utils.aws.ClientFactory.from_params()
+
+        Args:
+            parameters(dict): Parameters to configure the S3 filesystem
+        """
+        BaseS3Filesystem.__init__(self, parameters)
 
     def get_file(self, path):
         """Method to get a file from the "file system"
@@ -147,7 +174,7 @@ class S3Filesystem(BaseFilesystem):
         return output
 
 
-class S3CopyTempFilesystem(BaseFilesystem):
+class S3CopyTempFilesystem(BaseS3Filesystem):
     """An S3 based filesystem that copies data locally.
     Useful when chunking big tiles, but must have enough local storage"""
 
@@ -157,13 +184,13 @@ class S3CopyTempFilesystem(BaseFilesystem):
         Required parameters:
          "bucket": the name of the bucket to use
 
+        Optional parameters:
+         "aws": boto3 settings, see ingestclient.utils.aws.ClientFactory.from_params()
+
         Args:
             parameters(dict): Parameters to configure the S3 filesystem
         """
-        BaseFilesystem.__init__(self, parameters)
-
-        self.s3 = boto3.resource('s3')
-        self.bucket = self.s3.Bucket(parameters['bucket'])
+        BaseS3Filesystem.__init__(self, parameters)
         self.file_map = {}
 
     def __del__(self):
@@ -245,7 +272,7 @@ class LocalFilesystemAbsPath(BaseFilesystem):
         return path
 
 
-class S3CopyTempFilesystemAbsPath(BaseFilesystem):
+class S3CopyTempFilesystemAbsPath(BaseS3Filesystem):
     """A version of an S3 Filesystem that copies files to temp space locally, once, to improve performance"""
 
     def __init__(self, parameters):
@@ -254,13 +281,13 @@ class S3CopyTempFilesystemAbsPath(BaseFilesystem):
         Required parameters:
          "bucket": the name of the bucket to use
 
+        Optional parameters:
+         "aws": boto3 settings, see ingestclient.utils.aws.ClientFactory.from_params()
+
         Args:
             parameters(dict): Parameters to configure the S3 filesystem
         """
-        BaseFilesystem.__init__(self, parameters)
-
-        self.s3 = boto3.resource('s3')
-        self.bucket = self.s3.Bucket(parameters['bucket'])
+        BaseS3Filesystem.__init__(self, parameters)
         self.file_map = {}
 
         if "temp_dir" in parameters:
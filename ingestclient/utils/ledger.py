@@ -0,0 +1,144 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import sqlite3
+import threading
+import time
+
+
+UPLOADED = "uploaded"
+FAILED = "failed"
+
+
+class UploadLedger(object):
+    def __init__(self, file_path):
+        """
+        An append-only SQLite record of tile uploads, shared by the upload processes of a client
+
+        Each finished upload adds a row with its status, ETag, size, duration and number of attempts. A resumed job
+        uses it to skip tiles that were already uploaded, and it remains as an offline record of the ingest. Job IDs
+        are only unique within an ingest service, so uploads are keyed by the backend's identity as well.
+
+        Args:
+            file_path(str): Path to the SQLite database. Created if it doesn't exist
+        """
+        directory = os.path.dirname(file_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(file_path, timeout=30, check_same_thread=False)
+        with self._lock, self._db:
+            # Write-ahead logging lets several processes append while others read
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS uploads ("
+                             "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                             "backend TEXT NOT NULL DEFAULT '', "
+                             "job_id TEXT NOT NULL, "
+                             "tile_key TEXT NOT NULL, "
+                             "status TEXT NOT NULL, "
+                             "etag TEXT, "
+                             "num_bytes INTEGER, "
+                             "duration REAL, "
+                             "attempts INTEGER, "
+                             "finished REAL, "
+                             "pid INTEGER)")
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(uploads)")]
+            if "backend" not in columns:
+                # Ledgers written before uploads were keyed by backend. Their rows match no backend, so are never
+                # skipped
+                self._db.execute("ALTER TABLE uploads ADD COLUMN backend TEXT NOT NULL DEFAULT ''")
+            self._db.execute("DROP INDEX IF EXISTS uploads_tile")
+            self._db.execute("CREATE INDEX IF NOT EXISTS uploads_backend_tile ON uploads "
+                             "(backend, job_id, tile_key, status)")
+
+    def record(self, job_id, entries, backend=""):
+        """Method to append finished uploads in a single transaction
+
+        Args:
+            job_id(int|str): The ingest job ID
+            entries(list((str, str, str, int, float, int))): The tile key, status (UPLOADED or FAILED), ETag, size in
+                                                            bytes, duration in seconds and attempts of each upload
+            backend(str): Identity of the backend the job belongs to
+
+        Returns:
+            None
+        """
+        if not entries:
+            return
+
+        finished = time.time()
+        pid = os.getpid()
+        rows = [(backend, str(job_id), tile_key, status, etag, num_bytes, duration, attempts, finished, pid)
+                for tile_key, status, etag, num_bytes, duration, attempts in entries]
+        with self._lock, self._db:
+            self._db.executemany("INSERT INTO uploads (backend, job_id, tile_key, status, etag, num_bytes, duration, "
+                                 "attempts, finished, pid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def is_uploaded(self, job_id, tile_key, backend=""):
+        """Method to check if a tile was already uploaded
+
+        Args:
+            job_id(int|str): The ingest job ID
+            tile_key(str): The tile key
+            backend(str): Identity of the backend the job belongs to
+
+        Returns:
+            (bool)
+        """
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM uploads WHERE backend = ? AND job_id = ? AND tile_key = ? "
+                                   "AND status = ? LIMIT 1", (backend, str(job_id), tile_key, UPLOADED)).fetchone()
+        return row is not None
+
+    def summary(self, job_id, backend=""):
+        """Method to summarize the uploads of a job
+
+        Args:
+            job_id(int|str): The ingest job ID
+            backend(str): Identity of the backend the job belongs to
+
+        Returns:
+            (dict): The number of "uploaded" and "failed" uploads, "tiles" uploaded at least once, uploaded "bytes",
+                    "upload_seconds" spent in successful uploads and the "first" and "last" finish times
+        """
+        job = (backend, str(job_id))
+        with self._lock:
+            uploaded, num_bytes, upload_seconds = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(num_bytes), 0), COALESCE(SUM(duration), 0) FROM uploads "
+                "WHERE backend = ? AND job_id = ? AND status = ?", job + (UPLOADED,)).fetchone()
+            failed = self._db.execute("SELECT COUNT(*) FROM uploads WHERE backend = ? AND job_id = ? AND status = ?",
+                                      job + (FAILED,)).fetchone()[0]
+            tiles = self._db.execute("SELECT COUNT(DISTINCT tile_key) FROM uploads "
+                                     "WHERE backend = ? AND job_id = ? AND status = ?", job + (UPLOADED,)).fetchone()[0]
+            first, last = self._db.execute("SELECT MIN(finished), MAX(finished) FROM uploads "
+                                           "WHERE backend = ? AND job_id = ?", job).fetchone()
+
+        return {"uploaded": uploaded,
+                "failed": failed,
+                "tiles": tiles,
+                "bytes": num_bytes,
+                "upload_seconds": upload_seconds,
+                "first": first,
+                "last": last}
+
+    def close(self):
+        """Method to close the database
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._db.close()
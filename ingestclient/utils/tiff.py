@@ -0,0 +1,347 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from collections import OrderedDict
+from PIL import Image
+import numpy as np
+import six
+import mmap
+import struct
+import zlib
+
+
+# TIFF field type -> (struct format, size in bytes)
+FIELD_TYPES = {1: ('B', 1), 2: ('B', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 6: ('b', 1), 7: ('B', 1),
+               8: ('h', 2), 9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8), 16: ('Q', 8), 17: ('q', 8),
+               18: ('Q', 8)}
+
+# Tags needed to locate and decode page data
+TAGS = {256: "width", 257: "height", 258: "bits_per_sample", 259: "compression", 262: "photometric",
+        273: "strip_offsets",
+        277: "samples_per_pixel", 278: "rows_per_strip", 279: "strip_byte_counts", 284: "planar_config",
+        317: "predictor", 322: "tile_width", 323: "tile_height", 324: "tile_offsets", 325: "tile_byte_counts",
+        339: "sample_format"}
+
+# TIFF SampleFormat -> numpy kind
+SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+
+# Compression schemes decoded without PIL: none, Adobe Deflate and the old Deflate code
+UNCOMPRESSED = 1
+DEFLATE = (8, 32946)
+
+
+class TiffReader(object):
+    def __init__(self, source):
+        """
+        A random-access reader for single and multi-page TIFF files
+
+        The page directory is indexed once when the file is opened. Uncompressed and Deflate compressed pages,
+        striped or tiled, are decoded one strip or tile at a time straight from a memory map of the file, so only
+        the data overlapping the requested region is touched. Other pages are decoded with PIL.
+
+        Args:
+            source(str|file): Absolute path to the TIFF file, or a file object. File objects without a file
+                              descriptor, such as six.BytesIO, are read from memory. The reader closes the file
+        """
+        if isinstance(source, six.string_types):
+            self.file_path = source
+            self._file = open(source, 'rb')
+        else:
+            self.file_path = getattr(source, "name", None)
+            self._file = source
+        self._image = None
+
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, IOError, ValueError):
+            self._map = None
+            self._buffer = self._file.getvalue()
+        else:
+            self._buffer = self._map
+
+        byte_order = self._buffer[:2]
+        if byte_order == b'II':
+            self.byte_order = '<'
+        elif byte_order == b'MM':
+            self.byte_order = '>'
+        else:
+            self.close()
+            raise IOError("Not a TIFF file: {}".format(self.file_path))
+
+        version = self._unpack('H', 2)[0]
+        if version == 42:
+            self._big_tiff = False
+            first_ifd = self._unpack('I', 4)[0]
+        elif version == 43:
+            self._big_tiff = True
+            first_ifd = self._unpack('Q', 8)[0]
+        else:
+            self.close()
+            raise IOError("Unsupported TIFF version {}: {}".format(version, self.file_path))
+
+        self.pages = self._index_pages(first_ifd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.pages)
+
+    def close(self):
+        """Method to release the memory map and file handles
+
+        Returns:
+            None
+        """
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+        self._buffer = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def shape(self, page=0):
+        """Method to get the shape of a page
+
+        Args:
+            page(int): The page index
+
+        Returns:
+            (tuple(int, int)): The page (height, width)
+        """
+        return self.pages[page]["height"], self.pages[page]["width"]
+
+    def read(self, page=0, y_range=None, x_range=None):
+        """Method to read a page, or a region of it
+
+        Ranges are clipped to the page like numpy slices.
+
+        Args:
+            page(int): The page index
+            y_range(tuple(int, int)): The [start, stop) rows to read. The whole page if None
+            x_range(tuple(int, int)): The [start, stop) columns to read. The whole page if None
+
+        Returns:
+            (numpy.ndarray): The region in yx order, or yxc for multi-sample pages
+        """
+        if page < 0 or page >= len(self.pages):
+            raise IndexError("Invalid TIFF page: {}".format(page))
+
+        ifd = self.pages[page]
+        y_start, y_stop = self._clip(y_range, ifd["height"])
+        x_start, x_stop = self._clip(x_range, ifd["width"])
+
+        if self.can_read_region(page):
+            return self._read_chunks(page, y_start, y_stop, x_start, x_stop)
+
+        return self._read_pil(page)[y_start:y_stop, x_start:x_stop]
+
+    def can_read_region(self, page=0):
+        """Method to check if a region of a page can be decoded without decoding the whole page
+
+        Args:
+            page(int): The page index
+
+        Returns:
+            (bool): True if only the strips or tiles overlapping a region are decoded
+        """
+        ifd = self.pages[page]
+        bits = set(ifd["bits_per_sample"])
+        if ifd["compression"] != UNCOMPRESSED and ifd["compression"] not in DEFLATE:
+            return False
+        if ifd["predictor"] not in (1, 2) or (ifd["predictor"] == 2 and ifd["sample_format"] == 3):
+            return False
+        if "tile_width" in ifd:
+            has_chunks = "tile_offsets" in ifd and "tile_byte_counts" in ifd and "tile_height" in ifd
+        else:
+            has_chunks = "strip_offsets" in ifd and "strip_byte_counts" in ifd
+        return (has_chunks and len(bits) == 1 and bits.pop() in (8, 16, 32, 64) and
+                ifd["sample_format"] in SAMPLE_KINDS and
+                (ifd["planar_config"] == 1 or ifd["samples_per_pixel"] == 1))
+
+    def _unpack(self, fmt, offset):
+        """Method to unpack values from the file in its byte order"""
+        return struct.unpack_from(self.byte_order + fmt, self._buffer, offset)
+
+    def _index_pages(self, ifd_offset):
+        """Method to walk the IFD chain and collect the tags of every page
+
+        Args:
+            ifd_offset(int): Offset of the first IFD
+
+        Returns:
+            (list(dict)): The tags of each page
+        """
+        if self._big_tiff:
+            count_fmt, count_size, entry_size, offset_fmt, value_size = 'Q', 8, 20, 'Q', 8
+        else:
+            count_fmt, count_size, entry_size, offset_fmt, value_size = 'H', 2, 12, 'I', 4
+
+        pages = []
+        visited = set()
+        while ifd_offset and ifd_offset not in visited:
+            visited.add(ifd_offset)
+            num_entries = self._unpack(count_fmt, ifd_offset)[0]
+            ifd = {}
+            for entry in range(num_entries):
+                entry_offset = ifd_offset + count_size + entry * entry_size
+                tag, field_type = self._unpack('HH', entry_offset)
+                if tag not in TAGS or field_type not in FIELD_TYPES:
+                    continue
+
+                count = self._unpack(offset_fmt, entry_offset + 4)[0]
+                fmt, size = FIELD_TYPES[field_type]
+                value_offset = entry_offset + 4 + value_size
+                if count * size > value_size:
+                    value_offset = self._unpack(offset_fmt, value_offset)[0]
+                values = self._unpack(fmt * count, value_offset)
+                ifd[TAGS[tag]] = values if tag in (258, 273, 279, 324, 325) else values[0]
+
+            ifd.setdefault("compression", 1)
+            ifd.setdefault("samples_per_pixel", 1)
+            ifd.setdefault("planar_config", 1)
+            ifd.setdefault("predictor", 1)
+            ifd.setdefault("sample_format", 1)
+            ifd.setdefault("bits_per_sample", (1,))
+            ifd.setdefault("rows_per_strip", ifd.get("height", 0))
+            pages.append(ifd)
+
+            ifd_offset = self._unpack(offset_fmt, ifd_offset + count_size + num_entries * entry_size)[0]
+
+        return pages
+
+    @staticmethod
+    def _clip(index_range, size):
+        """Method to clip a [start, stop) range to a dimension"""
+        if index_range is None:
+            return 0, size
+        return max(0, min(index_range[0], size)), max(0, min(index_range[1], size))
+
+    def dtype(self, page=0):
+        """Method to get the numpy dtype of a page's samples
+
+        Args:
+            page(int): The page index
+
+        Returns:
+            (numpy.dtype): The sample type in the file's byte order
+        """
+        ifd = self.pages[page]
+        bits = ifd["bits_per_sample"][0]
+        return np.dtype("{}{}{}".format(self.byte_order, SAMPLE_KINDS[ifd["sample_format"]], bits // 8))
+
+    def _read_chunks(self, page, y_start, y_stop, x_start, x_stop):
+        """Method to copy a region out of the strips or tiles that overlap it"""
+        ifd = self.pages[page]
+        dtype = self.dtype(page)
+        samples = ifd["samples_per_pixel"]
+        if "tile_width" in ifd:
+            chunk_width, chunk_height = ifd["tile_width"], ifd["tile_height"]
+            offsets, byte_counts = ifd["tile_offsets"], ifd["tile_byte_counts"]
+        else:
+            chunk_width, chunk_height = ifd["width"], min(ifd["rows_per_strip"], ifd["height"])
+            offsets, byte_counts = ifd["strip_offsets"], ifd["strip_byte_counts"]
+        chunks_across = (ifd["width"] + chunk_width - 1) // chunk_width
+
+        data = np.empty((max(y_stop - y_start, 0), max(x_stop - x_start, 0), samples), dtype=dtype)
+        if data.size:
+            for chunk_y in range(y_start // chunk_height, (y_stop - 1) // chunk_height + 1):
+                for chunk_x in range(x_start // chunk_width, (x_stop - 1) // chunk_width + 1):
+                    chunk_index = chunk_y * chunks_across + chunk_x
+                    top, left = chunk_y * chunk_height, chunk_x * chunk_width
+                    # Strips at the bottom of the page are short, tiles are always padded to full size
+                    num_rows = chunk_height if "tile_width" in ifd else min(chunk_height, ifd["height"] - top)
+                    chunk = self._decode_chunk(ifd, offsets[chunk_index], byte_counts[chunk_index], dtype,
+                                               (num_rows, chunk_width, samples))
+
+                    y0, y1 = max(y_start, top), min(y_stop, top + num_rows)
+                    x0, x1 = max(x_start, left), min(x_stop, left + chunk_width)
+                    data[y0 - y_start:y1 - y_start, x0 - x_start:x1 - x_start] = \
+                        chunk[y0 - top:y1 - top, x0 - left:x1 - left]
+
+        if samples == 1:
+            data = data[:, :, 0]
+        return data
+
+    def _decode_chunk(self, ifd, offset, byte_count, dtype, shape):
+        """Method to get a strip or tile as an array of the given shape, decompressing it if needed"""
+        count = shape[0] * shape[1] * shape[2]
+        if ifd["compression"] == UNCOMPRESSED:
+            return np.frombuffer(self._buffer, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+        chunk = np.frombuffer(zlib.decompress(self._buffer[offset:offset + byte_count]), dtype=dtype,
+                              count=count).reshape(shape)
+        if ifd["predictor"] == 2:
+            # Undo horizontal differencing, wrapping like the encoder did
+            chunk = np.cumsum(chunk, axis=1, dtype=dtype)
+        return chunk
+
+    def _read_pil(self, page):
+        """Method to decode a page with PIL, keeping the image open so later seeks reuse its frame index"""
+        if self._image is None:
+            self._file.seek(0)
+            self._image = Image.open(self._file)
+        self._image.seek(page)
+        return np.array(self._image)
+
+
+class TiffReaderPool(object):
+    """A bounded pool of open TiffReaders, closing the least recently used reader when the pool is full"""
+
+    def __init__(self, max_open_files=8):
+        """
+
+        Args:
+            max_open_files(int): The maximum number of files kept open
+        """
+        self.max_open_files = max_open_files
+        self._readers = OrderedDict()
+
+    def get(self, file_path, opener=None):
+        """Method to get a reader, opening the file if needed
+
+        Args:
+            file_path(str): Absolute path to the TIFF file
+            opener(callable): Called without arguments to get the file object to read when the file isn't open yet.
+                              The file is opened from file_path if None
+
+        Returns:
+            (TiffReader): The open reader
+        """
+        if file_path in self._readers:
+            reader = self._readers.pop(file_path)
+        else:
+            reader = TiffReader(opener() if opener else file_path)
+        self._readers[file_path] = reader
+
+        while len(self._readers) > self.max_open_files:
+            self._readers.popitem(last=False)[1].close()
+
+        return reader
+
+    def close(self):
+        """Method to close every open reader
+
+        Returns:
+            None
+        """
+        while self._readers:
+            self._readers.popitem(last=False)[1].close()